@@ -1,10 +1,11 @@
-from fastapi import APIRouter, Depends, Request, HTTPException
+from fastapi import APIRouter, Depends, Request, HTTPException, Response
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from app.models import AuditLog
-from app.schemas import AuditLogOut
+from app.models import AuditLog, AuditArchive, User
+from app.schemas import AuditLogOut, AuditArchiveOut
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
-from datetime import datetime
+from app.utils import audit_queue, audit_index, audit_archive
 
 router = APIRouter()
 
@@ -16,63 +17,140 @@ def get_db():
         db.close()
 
 # Utility: log an action (call from other endpoints!)
-def log_action(db, user_id, action, detail, ip=None):
-    entry = AuditLog(
-        user_id=user_id,
-        action=action,
-        detail=detail,
-        ip=ip,
-        timestamp=datetime.utcnow()
-    )
-    db.add(entry)
-    db.commit()
+# Events are queued and written in batches in the background; `db` is kept for
+# call-site compatibility and is never committed here.
+def log_action(db, user_id, action, detail, ip=None, **fields):
+    audit_queue.enqueue(user_id, action, detail, ip, **fields)
 
-# List logs (admin only)
+# Admin: audit writer queue depth and throughput
+@router.get("/queue-stats")
+def queue_stats(current_user=Depends(require_role("admin"))):
+    return audit_queue.stats()
+
+MAX_PAGE = 500
+
+def _page(q, response: Response, cursor: int | None, limit: int):
+    """Newest first, keyset on id: each page is an index range scan regardless of table size."""
+    limit = max(1, min(limit, MAX_PAGE))
+    if cursor:
+        q = q.filter(AuditLog.id < cursor)
+    logs = q.order_by(AuditLog.id.desc()).limit(limit).all()
+    if len(logs) == limit:
+        response.headers["X-Next-Cursor"] = str(logs[-1].id)
+    return logs
+
+def _resolve_filters(db, category, pc, employee) -> dict:
+    """Map the list filters onto structured columns, keeping their original text semantics.
+
+    category: the action prefix (indexed) when some action starts with it, otherwise a
+    substring of the action. pc: a PC id, or text matched against "PC:<pc>" in the detail.
+    employee: an actor id, or a user name (case-insensitive), or text matched against
+    "Employee:<name>" in the detail when no user has that name.
+    """
+    filters = {"category": None, "action_like": None, "pc_id": None, "user_ids": None, "detail_like": []}
+    if category:
+        cat = audit_index.derive_fields(category, None)["category"]
+        # Only a bare word can be a prefix; "user_login" and the like stay substring matches
+        if category.isalpha() and db.query(AuditLog.id).filter(AuditLog.category == cat).first() is not None:
+            filters["category"] = cat
+        else:
+            filters["action_like"] = category.lower()
+    if pc:
+        if pc.strip().isdigit():
+            filters["pc_id"] = int(pc)
+        else:
+            filters["detail_like"].append(f"pc:{pc}".lower())
+    if employee:
+        if employee.strip().isdigit():
+            filters["user_ids"] = [int(employee)]
+        else:
+            ids = [uid for (uid,) in db.query(User.id).filter(func.lower(User.name) == employee.strip().lower()).all()]
+            if ids:
+                filters["user_ids"] = ids
+            else:
+                filters["detail_like"].append(f"employee:{employee}".lower())
+    return filters
+
+# List logs (admin only); pass the X-Next-Cursor response header back as ?cursor= for the next page.
+# archive=true searches the gzip files of months moved out of the hot table instead.
 @router.get("/", response_model=list[AuditLogOut])
 def list_logs(
+    response: Response,
     start: str | None = None,
     end: str | None = None,
     category: str | None = None,
     pc: str | None = None,
+    cafe: int | None = None,
+    target: int | None = None,
     employee: str | None = None,
     user: str | None = None,
+    q: str | None = None,
+    cursor: int | None = None,
+    limit: int = 100,
+    archive: bool = False,
     current_user=Depends(require_role("admin")),
     db: Session = Depends(get_db)
 ):
-    q = db.query(AuditLog)
     from datetime import datetime as _dt
+    filters = {
+        **_resolve_filters(db, category, pc, employee),
+        "cafe_id": cafe,
+        "target_id": target,
+        "user_id": None,
+        "q": q,
+    }
     if start:
-        try: q = q.filter(AuditLog.timestamp >= _dt.fromisoformat(start))
+        try: filters["start"] = _dt.fromisoformat(start)
         except: pass
     if end:
-        try: q = q.filter(AuditLog.timestamp <= _dt.fromisoformat(end))
+        try: filters["end"] = _dt.fromisoformat(end)
         except: pass
-    if category:
-        q = q.filter(AuditLog.action.ilike(f"%{category}%"))
     if user:
-        # naive: search in detail or require user_id match if numeric
+        # numeric: actor id; otherwise searched like free text
         try:
-            uid = int(user)
-            q = q.filter(AuditLog.user_id == uid)
-        except:
-            q = q.filter(AuditLog.detail.ilike(f"%{user}%"))
-    # pc/employee filters can be encoded in detail for now
-    if pc:
-        q = q.filter(AuditLog.detail.ilike(f"%PC:{pc}%"))
-    if employee:
-        q = q.filter(AuditLog.detail.ilike(f"%Employee:{employee}%"))
-    logs = q.order_by(AuditLog.timestamp.desc()).limit(1000).all()
-    return logs
+            filters["user_id"] = int(user)
+        except ValueError:
+            filters["q"] = f"{q or ''} {user}".strip()
+    if archive:
+        limit = max(1, min(limit, MAX_PAGE))
+        rows = audit_archive.query_archives(db, filters, cursor, limit)
+        if len(rows) == limit:
+            response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+        return rows
+    query = db.query(AuditLog)
+    if filters.get("start"):
+        query = query.filter(AuditLog.timestamp >= filters["start"])
+    if filters.get("end"):
+        query = query.filter(AuditLog.timestamp <= filters["end"])
+    for key in ("category", "pc_id", "cafe_id", "target_id", "user_id"):
+        if filters[key] is not None:
+            query = query.filter(getattr(AuditLog, key) == filters[key])
+    if filters["user_ids"] is not None:
+        query = query.filter(AuditLog.user_id.in_(filters["user_ids"]))
+    if filters["action_like"]:
+        query = query.filter(AuditLog.action.ilike(f"%{filters['action_like']}%"))
+    for term in filters["detail_like"]:
+        query = query.filter(AuditLog.detail.ilike(f"%{term}%"))
+    if filters["q"]:
+        query = audit_index.apply_search(query, filters["q"])
+    return _page(query, response, cursor, limit)
+
+# Admin: months moved to cold storage (query them with /?archive=true)
+@router.get("/archives", response_model=list[AuditArchiveOut])
+def list_archives(current_user=Depends(require_role("admin")), db: Session = Depends(get_db)):
+    return db.query(AuditArchive).order_by(AuditArchive.month.desc(), AuditArchive.id.desc()).all()
 
 # (Optional) Get user-specific logs
 @router.get("/user/{user_id}", response_model=list[AuditLogOut])
 def user_logs(
     user_id: int,
+    response: Response,
+    cursor: int | None = None,
+    limit: int = 100,
     current_user=Depends(require_role("admin")),
     db: Session = Depends(get_db)
 ):
-    logs = db.query(AuditLog).filter_by(user_id=user_id).order_by(AuditLog.timestamp.desc()).limit(100).all()
-    return logs
+    return _page(db.query(AuditLog).filter_by(user_id=user_id), response, cursor, limit)
 
 # Client-originated audit log (auth optional; prefer with JWT)
 @router.post("/client")
@@ -34,21 +34,26 @@ def get_db():
         db.close()
 
 # ---- JWT Authentication Dependency (defined early to use in Depends) ----
-def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=401,
-        detail="Could not validate credentials",
-    )
+def user_from_token(db, token: str | None):
+    """The user a bearer token belongs to, or None when it is missing, invalid or expired."""
+    if not token:
+        return None
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        email = payload.get("sub")
-        if email is None:
-            raise credentials_exception
     except JWTError:
-        raise credentials_exception
-    user = db.query(User).filter(User.email == email).first()
+        return None
+    email = payload.get("sub")
+    if email is None:
+        return None
+    return db.query(User).filter(User.email == email).first()
+
+def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+    user = user_from_token(db, token)
     if user is None:
-        raise credentials_exception
+        raise HTTPException(
+            status_code=401,
+            detail="Could not validate credentials",
+        )
     return user
 
 # ---- Role-based Dependency ----
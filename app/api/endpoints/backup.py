@@ -1,11 +1,10 @@
-import shutil
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.models import BackupEntry
 from app.schemas import BackupEntryOut
 from app.database import SessionLocal
 from app.api.endpoints.auth import require_role
-from datetime import datetime
+from app.utils import backup_engine
 import os
 
 router = APIRouter()
@@ -17,36 +16,26 @@ def get_db():
     finally:
         db.close()
 
-# Path to your SQLite DB (change if needed)
-DB_PATH = "./lance.db"
-BACKUP_DIR = "./backups"
+# Live DB path is derived from DATABASE_URL (None when not on SQLite)
+DB_PATH = backup_engine.DB_PATH
+BACKUP_DIR = backup_engine.BACKUP_DIR
 
 os.makedirs(BACKUP_DIR, exist_ok=True)
 
-# Admin: trigger backup
+# Admin: trigger backup (runs in the background; poll /{id}/status)
 @router.post("/create", response_model=BackupEntryOut)
 def create_backup(
     note: str = None,
+    kind: str = "full",
     current_user=Depends(require_role("admin")),
     db: Session = Depends(get_db)
 ):
-    now = datetime.utcnow().strftime("%Y%m%d-%H%M%S")
-    backup_filename = f"lance_backup_{now}.db"
-    backup_path = os.path.join(BACKUP_DIR, backup_filename)
+    if kind not in ("full", "incremental"):
+        raise HTTPException(status_code=400, detail="kind must be full or incremental")
     try:
-        shutil.copyfile(DB_PATH, backup_path)
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Backup failed: {str(e)}")
-    entry = BackupEntry(
-        backup_type="manual",
-        file_path=backup_path,
-        created_at=datetime.utcnow(),
-        note=note
-    )
-    db.add(entry)
-    db.commit()
-    db.refresh(entry)
-    return entry
+        return backup_engine.start_backup(db, "manual", note, kind)
+    except backup_engine.BackupBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
 
 # Admin: list all backups
 @router.get("/", response_model=list[BackupEntryOut])
@@ -56,7 +45,29 @@ def list_backups(
 ):
     return db.query(BackupEntry).order_by(BackupEntry.created_at.desc()).all()
 
-# Admin: download backup (optional, returns file)
+# Admin: progress of a backup job
+@router.get("/{backup_id}/status")
+def backup_status(
+    backup_id: int,
+    current_user=Depends(require_role("admin")),
+    db: Session = Depends(get_db)
+):
+    entry = db.query(BackupEntry).filter_by(id=backup_id).first()
+    if not entry:
+        raise HTTPException(status_code=404, detail="Backup not found")
+    live = backup_engine.progress(backup_id) or {}
+    return {
+        "id": entry.id,
+        "status": entry.status,
+        "phase": live.get("phase", entry.status),
+        "progress": live.get("progress", 1.0 if entry.status == "done" else None),
+        "bytes_in": live.get("bytes_in"),
+        "byte_size": entry.byte_size,
+        "sha256": entry.sha256,
+        "error": entry.error,
+    }
+
+# Admin: download backup (streamed from disk)
 from fastapi.responses import FileResponse
 
 @router.get("/download/{backup_id}")
@@ -68,11 +79,14 @@ def download_backup(
     entry = db.query(BackupEntry).filter_by(id=backup_id).first()
     if not entry:
         raise HTTPException(status_code=404, detail="Backup not found")
+    if entry.status not in (None, "done"):
+        raise HTTPException(status_code=409, detail=f"Backup is {entry.status}")
     if not os.path.exists(entry.file_path):
         raise HTTPException(status_code=404, detail="File not found on disk")
-    return FileResponse(path=entry.file_path, filename=os.path.basename(entry.file_path))
+    headers = {"X-Checksum-SHA256": entry.sha256} if entry.sha256 else None
+    return FileResponse(path=entry.file_path, filename=os.path.basename(entry.file_path), headers=headers)
 
-# Admin: restore from backup (overwrites current DB)
+# Admin: restore from backup (overwrites current DB after verifying the whole chain)
 @router.post("/restore/{backup_id}")
 def restore_backup(
     backup_id: int,
@@ -82,8 +96,12 @@ def restore_backup(
     entry = db.query(BackupEntry).filter_by(id=backup_id).first()
     if not entry:
         raise HTTPException(status_code=404, detail="Backup not found")
+    if entry.status not in (None, "done"):
+        raise HTTPException(status_code=409, detail=f"Backup is {entry.status}")
     try:
-        shutil.copyfile(entry.file_path, DB_PATH)
+        backup_engine.restore(db, entry)
+    except backup_engine.RestoreError as e:
+        raise HTTPException(status_code=422, detail=f"Restore aborted: {str(e)}")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Restore failed: {str(e)}")
     return {"message": "Restore completed from backup."}
@@ -5,6 +5,7 @@ from app.schemas import PricingRuleIn, PricingRuleOut
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
 from datetime import datetime, timedelta
+from app.utils import leaderboard as leaderboard_feed
 
 router = APIRouter()
 
@@ -134,6 +135,7 @@ def calculate_billing(session: PCSession, db: Session):
         user.coins_balance += coins_earned
         db.add(CoinTransaction(user_id=user.id, amount=coins_earned, reason="session_playtime"))
     db.commit()
+    leaderboard_feed.record_metric(user.id, leaderboard_feed.METRIC_COINS_EARNED, coins_earned)
     return bill
 
 # To use: call `calculate_billing(session, db)` at session end in your session endpoint!
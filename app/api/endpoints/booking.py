@@ -6,6 +6,7 @@ from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
 from app.api.endpoints.audit import log_action
 from datetime import datetime
+from app.utils import webhooks
 
 router = APIRouter()
 
@@ -16,6 +17,12 @@ def get_db():
     finally:
         db.close()
 
+def _booking_event(b: Booking) -> dict:
+    return {
+        "booking_id": b.id, "user_id": b.user_id, "pc_id": b.pc_id,
+        "start_time": b.start_time, "end_time": b.end_time, "status": b.status,
+    }
+
 # User: create a booking
 @router.post("/", response_model=BookingOut)
 def create_booking(
@@ -41,6 +48,8 @@ def create_booking(
         created_at=datetime.utcnow()
     )
     db.add(b)
+    db.flush()
+    webhooks.emit(db, webhooks.BOOKING_CREATED, _booking_event(b))
     db.commit()
     db.refresh(b)
     try: log_action(db, getattr(current_user,'id',None), 'booking_create', f'PC:{b.pc_id} {b.start_time}->{b.end_time}', None)
@@ -58,6 +67,7 @@ def confirm_booking(
     if not b:
         raise HTTPException(status_code=404, detail="Booking not found")
     b.status = "confirmed"
+    webhooks.emit(db, webhooks.BOOKING_CONFIRMED, _booking_event(b))
     db.commit()
     db.refresh(b)
     try: log_action(db, getattr(current_user,'id',None), 'booking_confirm', f'Booking:{b.id}', None)
@@ -131,6 +141,7 @@ def cancel_booking(
     if current_user.role != "admin" and b.user_id != current_user.id:
         raise HTTPException(status_code=403, detail="Not allowed")
     b.status = "cancelled"
+    webhooks.emit(db, webhooks.BOOKING_CANCELLED, _booking_event(b))
     db.commit()
     db.refresh(b)
     try: log_action(db, getattr(current_user,'id',None), 'booking_cancel', f'Booking:{b.id}', None)
@@ -148,6 +159,7 @@ def complete_booking(
     if not b:
         raise HTTPException(status_code=404, detail="Booking not found")
     b.status = "completed"
+    webhooks.emit(db, webhooks.BOOKING_COMPLETED, _booking_event(b))
     db.commit()
     db.refresh(b)
     try: log_action(db, getattr(current_user,'id',None), 'booking_complete', f'Booking:{b.id}', None)
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from app.models import ChatMessage
-from app.schemas import ChatMessageIn, ChatMessageOut
+from app.schemas import ChatMessageIn, ChatMessageOut, ChatConversationOut, ChatReadIn
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user
+from app.utils import chat as chat_store
+from app.utils import push
 from datetime import datetime
+import asyncio
 
 router = APIRouter()
 
+MAX_PAGE = 100
+
 def get_db():
     db = SessionLocal()
     try:
@@ -15,9 +20,19 @@ def get_db():
     finally:
         db.close()
 
-# Send message
+def _page(q, response: Response, cursor: int | None, limit: int):
+    """Newest first, keyset on id; pass X-Next-Cursor back as ?cursor= for older messages."""
+    limit = max(1, min(limit, MAX_PAGE))
+    if cursor:
+        q = q.filter(ChatMessage.id < cursor)
+    msgs = q.order_by(ChatMessage.id.desc()).limit(limit).all()
+    if len(msgs) == limit:
+        response.headers["X-Next-Cursor"] = str(msgs[-1].id)
+    return msgs
+
+# Send message (pushed to the recipient's PC socket or /ws/admin; everyone for broadcasts)
 @router.post("/", response_model=ChatMessageOut)
-def send_message(
+async def send_message(
     msg: ChatMessageIn,
     current_user=Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -30,15 +45,95 @@ def send_message(
         timestamp=datetime.utcnow(),
         read=False
     )
-    db.add(cm)
-    db.commit()
-    db.refresh(cm)
-    return cm
 
-# Get my messages (latest first)
+    def _save():
+        db.add(cm)
+        chat_store.record_message(db, cm)
+        db.commit()
+        db.refresh(cm)
+        routes = [push.route_for(db, cm.to_user_id)]
+        if cm.to_user_id is not None:
+            # Echo to the sender's other sessions
+            routes.append(push.route_for(db, cm.from_user_id))
+        return routes
+
+    routes = await asyncio.to_thread(_save)
+    out = ChatMessageOut.model_validate(cm)
+    await push.deliver(routes, {"type": "chat", "message": out.model_dump(mode="json")})
+    return out
+
+# Get my messages (latest first, paginated)
 @router.get("/", response_model=list[ChatMessageOut])
-def my_messages(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    msgs = db.query(ChatMessage).filter(
+def my_messages(
+    response: Response,
+    cursor: int | None = None,
+    limit: int = 50,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    q = db.query(ChatMessage).filter(
         (ChatMessage.to_user_id == current_user.id) | (ChatMessage.to_user_id == None)
-    ).order_by(ChatMessage.timestamp.desc()).all()
-    return msgs
+    )
+    return _page(q, response, cursor, limit)
+
+# My conversations with unread counters, most recent first
+@router.get("/conversations", response_model=list[ChatConversationOut])
+def my_conversations(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+    return chat_store.conversations(db, current_user.id)
+
+# Total unread across conversations
+@router.get("/unread")
+def unread_count(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+    convs = chat_store.conversations(db, current_user.id)
+    return {
+        "total": sum(c["unread_count"] for c in convs),
+        "conversations": {c["conversation_id"]: c["unread_count"] for c in convs if c["unread_count"]},
+    }
+
+def _check_access(conversation_id: str, current_user):
+    if conversation_id == chat_store.BROADCAST:
+        return
+    members = chat_store.participants(conversation_id)
+    if members is None:
+        raise HTTPException(status_code=404, detail="Conversation not found")
+    if current_user.id not in members and current_user.role not in push.ADMIN_ROLES:
+        raise HTTPException(status_code=403, detail="Not allowed")
+
+# History of one conversation (latest first, paginated)
+@router.get("/conversations/{conversation_id}/messages", response_model=list[ChatMessageOut])
+def conversation_messages(
+    conversation_id: str,
+    response: Response,
+    cursor: int | None = None,
+    limit: int = 50,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    _check_access(conversation_id, current_user)
+    q = db.query(ChatMessage).filter(ChatMessage.conversation_id == conversation_id)
+    return _page(q, response, cursor, limit)
+
+# Mark a conversation read (up to the newest message unless up_to_id is given)
+@router.post("/conversations/{conversation_id}/read")
+async def mark_conversation_read(
+    conversation_id: str,
+    body: ChatReadIn | None = None,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    _check_access(conversation_id, current_user)
+    members = chat_store.participants(conversation_id)
+
+    def _mark():
+        up_to = chat_store.mark_read(db, current_user.id, conversation_id, body.up_to_id if body else None)
+        # Read receipt for the other participant of a direct conversation
+        routes = [push.route_for(db, m) for m in (members or ()) if m != current_user.id]
+        return up_to, routes
+
+    up_to, routes = await asyncio.to_thread(_mark)
+    if routes:
+        await push.deliver(routes, {
+            "type": "chat_read", "conversation_id": conversation_id,
+            "user_id": current_user.id, "up_to_id": up_to,
+        })
+    return {"conversation_id": conversation_id, "last_read_id": up_to}
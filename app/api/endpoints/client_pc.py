@@ -1,12 +1,13 @@
 from fastapi import APIRouter, Depends, HTTPException, Request
 from sqlalchemy.orm import Session
-from app.models import ClientPC, License, Cafe
+from app.models import ClientPC, License, Cafe, PC
 from app.schemas import ClientPCCreate, ClientPCOut
 from app.database import SessionLocal
 from datetime import datetime, timedelta
 from app.api.endpoints.auth import get_current_user, require_role
 from app.models import Booking
 from app.api.endpoints.audit import log_action
+from app.utils import manifests, pc_links
 
 
 router = APIRouter()
@@ -48,6 +49,9 @@ def register_pc(
         grace_until=datetime.utcnow() + timedelta(days=3)
     )
     db.add(new_pc)
+    db.flush()
+    pc_links.link(db, new_pc)
+    manifests.bump_pcs(db)
     db.commit()
     db.refresh(new_pc)
     return new_pc
@@ -115,6 +119,29 @@ def rebind_pc(
     db.commit()
     return {"status": "rebound"}
 
+# Admin: link a client PC to the pcs row that holds its groups and game assignments
+@router.post("/link/{pc_id}", response_model=ClientPCOut)
+def link_pc(
+    pc_id: int,
+    machine_id: int | None = None,
+    current_user=Depends(require_role("admin")),
+    db: Session = Depends(get_db)
+):
+    pc = db.query(ClientPC).filter_by(id=pc_id).first()
+    if not pc:
+        raise HTTPException(status_code=404, detail="PC not found")
+    if machine_id is not None:
+        if db.query(PC.id).filter(PC.id == machine_id).first() is None:
+            raise HTTPException(status_code=404, detail="Machine not found")
+        holder = db.query(ClientPC.id).filter(ClientPC.pc_id == machine_id, ClientPC.id != pc.id).first()
+        if holder is not None:
+            raise HTTPException(status_code=409, detail=f"Machine already linked to client PC {holder.id}")
+    pc.pc_id = machine_id
+    manifests.bump_pcs(db)
+    db.commit()
+    db.refresh(pc)
+    return pc
+
 # List PCs for the current user's cafe
 @router.get("/", response_model=list[ClientPCOut])
 def list_pcs(
@@ -4,6 +4,7 @@ from app.models import Game, PCGame, PC
 from app.schemas import GameBase, GameOut, PCGameOut
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user
+from app.utils import game_search, catalog, manifests
 from datetime import datetime
 
 router = APIRouter()
@@ -34,8 +35,10 @@ def add_game(
         is_free=getattr(game, 'is_free', False)
     )
     db.add(db_game)
+    catalog.stamp(db, [db_game])
     db.commit()
     db.refresh(db_game)
+    game_search.upsert([db_game])
     return db_game
 
 # List all games
@@ -56,6 +59,7 @@ def assign_game(
         raise HTTPException(status_code=404, detail="PC not found")
     pcgame = PCGame(pc_id=pc_id, game_id=game_id)
     db.add(pcgame)
+    manifests.bump_assignments(db)
     db.commit()
     db.refresh(pcgame)
     return pcgame
@@ -67,7 +71,4 @@ def games_for_pc(
     current_user=Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    pcgames = db.query(PCGame).filter_by(pc_id=pc_id).all()
-    game_ids = [pg.game_id for pg in pcgames]
-    games = db.query(Game).filter(Game.id.in_(game_ids)).all()
-    return games
+    return db.query(Game).join(PCGame, PCGame.game_id == Game.id).filter(PCGame.pc_id == pc_id).all()
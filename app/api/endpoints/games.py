@@ -1,63 +1,149 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Response, Header, UploadFile, File
+from fastapi.responses import JSONResponse
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
+import io
 
 from app.database import get_db
-from app.models import Game, User
-from app.schemas import GameCreate, GameUpdate, Game
-from app.api.endpoints.auth import get_current_user
+from app.models import ClientPC, Game, User
+from app.schemas import GameCreate, GameUpdate, Game as GameOut
+from app.api.endpoints.auth import get_current_user, require_role
 from app.api.endpoints.audit import log_action
+from app.utils import game_search, catalog, catalog_import, eligibility, manifests, push
 
 router = APIRouter()
 
-@router.get("", response_model=List[Game])
+def _ordered(db: Session, ids: List[int]) -> list:
+    """Load one page of games by primary key, keeping the index's ranking."""
+    if not ids:
+        return []
+    rows = {g.id: g for g in db.query(Game).filter(Game.id.in_(ids)).all()}
+    return [rows[i] for i in ids if i in rows]
+
+@router.get("", response_model=List[GameOut])
 def list_games(
+    response: Response,
     skip: int = Query(0, ge=0),
     limit: int = Query(100, ge=1, le=1000),
     search: Optional[str] = None,
     category: Optional[str] = None,
     enabled: Optional[bool] = None,
+    tag: Optional[str] = None,
+    cursor: Optional[str] = None,
     db: Session = Depends(get_db),
 ):
-    """List games with optional filtering and pagination"""
-    query = db.query(Game)
-    
-    if search:
-        query = query.filter(Game.name.ilike(f"%{search}%"))
-    
-    if category:
-        query = query.filter(Game.category == category)
-    
-    if enabled is not None:
-        query = query.filter(Game.enabled == enabled)
-    
-    games = query.offset(skip).limit(limit).all()
-    return games
+    """List games ranked by relevance; X-Total-Count carries the count, X-Next-Cursor the next page"""
+    result = game_search.search(db, search, category, enabled, tag, cursor, limit, skip)
+    response.headers["X-Total-Count"] = str(result["total"])
+    if result["next_cursor"]:
+        response.headers["X-Next-Cursor"] = result["next_cursor"]
+    return _ordered(db, result["ids"])
+
+@router.get("/search")
+def search_games(
+    q: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=1000),
+    category: Optional[str] = None,
+    enabled: Optional[bool] = None,
+    tag: Optional[str] = None,
+    cursor: Optional[str] = None,
+    db: Session = Depends(get_db),
+):
+    """Search-as-you-type: ranked results, total, facets and next cursor in one call"""
+    result = game_search.search(db, q, category, enabled, tag, cursor, limit)
+    return {
+        "items": [GameOut.model_validate(g) for g in _ordered(db, result["ids"])],
+        "total": result["total"],
+        "facets": result["facets"],
+        "next_cursor": result["next_cursor"],
+    }
 
 @router.get("/count")
 def get_games_count(
     search: Optional[str] = None,
     category: Optional[str] = None,
     enabled: Optional[bool] = None,
+    tag: Optional[str] = None,
     db: Session = Depends(get_db),
 ):
     """Get total count of games with optional filtering"""
-    query = db.query(Game)
-    
-    if search:
-        query = query.filter(Game.name.ilike(f"%{search}%"))
-    
-    if category:
-        query = query.filter(Game.category == category)
-    
-    if enabled is not None:
-        query = query.filter(Game.enabled == enabled)
-    
-    count = query.count()
-    return {"count": count}
+    result = game_search.search(db, search, category, enabled, tag, limit=0)
+    return {"count": result["total"]}
 
-@router.post("", response_model=Game)
+@router.get("/catalog")
+def get_catalog(
+    if_none_match: Optional[str] = Header(None),
+    accept_encoding: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Full catalog snapshot, precompressed per version; 304 when the client's ETag is current"""
+    snap = catalog.snapshot(db)
+    tag = catalog.etag(snap["version"])
+    headers = {"ETag": tag, "X-Catalog-Version": str(snap["version"]), "Vary": "Accept-Encoding"}
+    if if_none_match and tag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    encoding = catalog.pick_encoding(accept_encoding, snap)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=snap[encoding], media_type="application/json", headers=headers)
+
+@router.get("/catalog/delta")
+def get_catalog_delta(
+    since: int = Query(..., ge=0),
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+):
+    """Games changed and ids deleted after catalog version `since`; `reset` asks for a full reload.
+
+    304 only for a conditional request whose ETag is current; otherwise an empty delta is a 200.
+    """
+    result = catalog.delta(db, since)
+    tag = catalog.etag(result["version"])
+    headers = {"ETag": tag, "X-Catalog-Version": str(result["version"])}
+    if if_none_match and tag in [t.strip() for t in if_none_match.split(",")] and not result["reset"]:
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(result, headers=headers)
+
+@router.get("/eligible")
+def eligible_games(
+    pc_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Ids of enabled games this user may see on this PC; details come from /catalog"""
+    user = current_user
+    if user_id is not None and user_id != current_user.id:
+        if current_user.role not in push.ADMIN_ROLES:
+            raise HTTPException(status_code=403, detail="Not allowed")
+        user = db.query(User).filter(User.id == user_id).first()
+        if not user:
+            raise HTTPException(status_code=404, detail="User not found")
+    ids = eligibility.visible_games(db, pc_id, user)
+    return {"pc_id": pc_id, "user_id": user.id, "catalog_version": catalog.current_version(db), "game_ids": ids}
+
+@router.get("/manifest/{pc_id}")
+def get_manifest(
+    pc_id: int,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db),
+    current_user: User = Depends(get_current_user)
+):
+    """Assigned and eligible games for a PC and its signed-in user; also pushed over /ws/pc on change"""
+    if getattr(current_user, "role", None) not in push.ADMIN_ROLES:
+        signed_in = db.query(ClientPC.current_user_id).filter(ClientPC.id == pc_id).scalar()
+        if signed_in != current_user.id:
+            raise HTTPException(status_code=403, detail="Not allowed")
+    manifest = manifests.manifest_for(db, pc_id)
+    if manifest is None:
+        raise HTTPException(status_code=404, detail="PC not found")
+    tag = f'"manifest-{manifest["version"]}"'
+    if if_none_match and tag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": tag})
+    return JSONResponse(manifest, headers={"ETag": tag})
+
+@router.post("", response_model=GameOut)
 def create_game(
     game: GameCreate,
     db: Session = Depends(get_db),
@@ -74,8 +160,10 @@ def create_game(
     
     db_game = Game(**game.dict())
     db.add(db_game)
+    catalog.stamp(db, [db_game])
     db.commit()
     db.refresh(db_game)
+    game_search.upsert([db_game])
     
     # Log the action
     log_action(
@@ -86,7 +174,32 @@ def create_game(
     
     return db_game
 
-@router.put("/{game_id}", response_model=Game)
+@router.post("/import")
+def import_games(
+    file: UploadFile = File(...),
+    format: Optional[str] = None,
+    dry_run: bool = False,
+    db: Session = Depends(get_db),
+    current_user: User = Depends(require_role("admin"))
+):
+    """Bulk upsert games from a JSONL or CSV upload, streamed in batches"""
+    try:
+        fmt = catalog_import.detect_format(file.filename, format)
+    except catalog_import.ImportFormatError as exc:
+        raise HTTPException(status_code=400, detail=str(exc))
+    stream = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+    result = catalog_import.import_rows(db, catalog_import.read_rows(stream, fmt), dry_run=dry_run)
+    
+    if not dry_run:
+        log_action(
+            db, current_user.id,
+            "games_imported",
+            f"Imported {file.filename}: {result['created']} created, {result['updated']} updated, {result['skipped']} skipped"
+        )
+    
+    return result
+
+@router.put("/{game_id}", response_model=GameOut)
 def update_game(
     game_id: int,
     game_update: GameUpdate,
@@ -104,8 +217,10 @@ def update_game(
         setattr(db_game, field, value)
     
     db_game.last_updated = datetime.utcnow()
+    catalog.stamp(db, [db_game])
     db.commit()
     db.refresh(db_game)
+    game_search.upsert([db_game])
     
     # Log the action
     log_action(
@@ -129,7 +244,9 @@ def delete_game(
     
     game_name = db_game.name
     db.delete(db_game)
+    version = catalog.tombstone(db, [game_id])
     db.commit()
+    game_search.remove([game_id], version)
     
     # Log the action
     log_action(
@@ -153,8 +270,11 @@ def bulk_toggle_games(
     for game in games:
         game.enabled = enabled
         game.last_updated = datetime.utcnow()
+    if games:
+        catalog.stamp(db, games)
     
     db.commit()
+    game_search.upsert(games)
     
     # Log the action
     log_action(
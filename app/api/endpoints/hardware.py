@@ -1,11 +1,11 @@
-from sqlalchemy import func
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from app.models import HardwareStat
-from app.schemas import HardwareStatIn, HardwareStatOut
+from app.schemas import HardwareStatIn, HardwareStatOut, HardwareBatchIn, HardwareLatestOut
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
-from datetime import datetime
+from datetime import datetime, timedelta
+from app.utils import telemetry, telemetry_rollup, hardware_latest, hardware_alerts
 
 router = APIRouter()
 
@@ -35,25 +35,43 @@ def post_stat(
     db.add(hs)
     db.commit()
     db.refresh(hs)
+    telemetry.observe([{
+        "id": hs.id, "pc_id": hs.pc_id, "timestamp": hs.timestamp,
+        "cpu_percent": hs.cpu_percent, "ram_percent": hs.ram_percent, "disk_percent": hs.disk_percent,
+        "gpu_percent": hs.gpu_percent, "temp": hs.temp,
+    }])
     return hs
 
-# Admin: List latest stats for all PCs
-@router.get("/latest", response_model=list[HardwareStatOut])
+# Client POSTs buffered samples in one call; rows are written in batches by app.utils.telemetry
+@router.post("/batch")
+def post_stat_batch(
+    batch: HardwareBatchIn,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    if len(batch.samples) > telemetry.MAX_SAMPLES_PER_BATCH:
+        raise HTTPException(status_code=413, detail=f"At most {telemetry.MAX_SAMPLES_PER_BATCH} samples per batch")
+    if not telemetry.can_report(db, current_user, batch.pc_id):
+        raise HTTPException(status_code=403, detail="Not signed in on this PC")
+    accepted = telemetry.ingest_samples(batch.pc_id, [s.dict() for s in batch.samples])
+    return {"accepted": accepted, "rejected": len(batch.samples) - accepted}
+
+# Admin: ingestion buffer status
+@router.get("/ingest-stats")
+def ingest_stats(current_user=Depends(require_role("admin"))):
+    return telemetry.stats()
+
+# Admin: List latest stats for all PCs (served from the live snapshot; changes are pushed on /ws/admin)
+@router.get("/latest", response_model=list[HardwareLatestOut])
 def latest_stats(
     current_user=Depends(require_role("admin")),
-    db: Session = Depends(get_db)
 ):
-    # For each PC, get the latest stat entry
-    subq = db.query(
-        HardwareStat.pc_id,
-        func.max(HardwareStat.timestamp).label('max_ts')
-    ).group_by(HardwareStat.pc_id).subquery()
-    stats = db.query(HardwareStat).join(
-        subq,
-        (HardwareStat.pc_id == subq.c.pc_id) &
-        (HardwareStat.timestamp == subq.c.max_ts)
-    ).all()
-    return stats
+    return hardware_latest.snapshot()
+
+# Admin: rules currently tripped (alerts and resolutions are pushed on /ws/admin)
+@router.get("/alerts")
+def active_alerts(current_user=Depends(require_role("admin"))):
+    return hardware_alerts.active_alerts()
 
 # Admin: Get full stat history for a PC
 @router.get("/history/{pc_id}", response_model=list[HardwareStatOut])
@@ -64,3 +82,22 @@ def stat_history(
 ):
     stats = db.query(HardwareStat).filter_by(pc_id=pc_id).order_by(HardwareStat.timestamp.desc()).limit(100).all()
     return stats
+
+# Admin: chart data for a PC; the storage tier is picked from the range and requested resolution
+@router.get("/series/{pc_id}")
+def stat_series(
+    pc_id: int,
+    start: datetime | None = None,
+    end: datetime | None = None,
+    points: int = 300,
+    metrics: str | None = None,
+    current_user=Depends(require_role("admin")),
+    db: Session = Depends(get_db)
+):
+    end = end or datetime.utcnow()
+    start = start or (end - timedelta(hours=1))
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    points = max(10, min(points, 5000))
+    metric_list = [m.strip() for m in metrics.split(",")] if metrics else None
+    return telemetry_rollup.query_series(db, pc_id, start, end, points, metric_list)
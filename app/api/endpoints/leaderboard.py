@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
-from sqlalchemy import and_
+from sqlalchemy import and_, func
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
-from app.models import Leaderboard, LeaderboardEntry
-from app.schemas import LeaderboardIn, LeaderboardOut, LeaderboardEntryOut
+from app.models import Leaderboard, LeaderboardEntry, LeaderboardArchive
+from app.schemas import LeaderboardIn, LeaderboardOut, LeaderboardEntryOut, LeaderboardArchiveOut
+from app.utils import leaderboard as leaderboard_feed
 from datetime import datetime, timedelta
 
 router = APIRouter()
@@ -28,8 +29,8 @@ def create_lb(lb: LeaderboardIn, current_user=Depends(require_role("admin")), db
 def list_lbs(db: Session = Depends(get_db)):
     return db.query(Leaderboard).filter_by(active=True).all()
 
-def period_bounds(scope: str):
-    now = datetime.utcnow()
+def period_bounds(scope: str, now: datetime | None = None):
+    now = now or datetime.utcnow()
     if scope == 'daily':
         start = now.replace(hour=0, minute=0, second=0, microsecond=0)
         end = start + timedelta(days=1)
@@ -44,22 +45,40 @@ def period_bounds(scope: str):
             end = start.replace(month=start.month+1)
     return start, end
 
+# Admin: manual adjustment. Regular increments are fed server-side by app.utils.leaderboard
 @router.post("/record/{leaderboard_id}")
-def record_value(leaderboard_id: int, value: int, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+def record_value(leaderboard_id: int, value: int, user_id: int | None = None, current_user=Depends(require_role("admin")), db: Session = Depends(get_db)):
     lb = db.query(Leaderboard).filter_by(id=leaderboard_id, active=True).first()
     if not lb:
         raise HTTPException(status_code=404, detail="Leaderboard not found")
+    target_id = user_id or current_user.id
     start, end = period_bounds(lb.scope)
-    entry = db.query(LeaderboardEntry).filter_by(leaderboard_id=leaderboard_id, user_id=current_user.id, period_start=start, period_end=end).first()
-    if not entry:
-        entry = LeaderboardEntry(leaderboard_id=leaderboard_id, user_id=current_user.id, period_start=start, period_end=end, value=0)
-        db.add(entry)
-    entry.value += value
+    leaderboard_feed.upsert_entries(db, [{
+        "leaderboard_id": leaderboard_id, "user_id": target_id, "period_start": start, "period_end": end, "value": value,
+    }])
     db.commit()
     return {"ok": True}
 
+# Current period standings
 @router.get("/{leaderboard_id}", response_model=list[LeaderboardEntryOut])
 def list_leaderboard(leaderboard_id: int, db: Session = Depends(get_db)):
-    entries = db.query(LeaderboardEntry).filter_by(leaderboard_id=leaderboard_id).order_by(LeaderboardEntry.value.desc()).limit(50).all()
+    lb = db.query(Leaderboard).filter_by(id=leaderboard_id).first()
+    if not lb:
+        raise HTTPException(status_code=404, detail="Leaderboard not found")
+    start, _ = period_bounds(lb.scope)
+    entries = db.query(LeaderboardEntry).filter_by(leaderboard_id=leaderboard_id, period_start=start).order_by(LeaderboardEntry.value.desc()).limit(50).all()
     return entries
 
+# Frozen standings of a finished period (latest finished period if none given)
+@router.get("/{leaderboard_id}/archive", response_model=list[LeaderboardArchiveOut])
+def archived_leaderboard(leaderboard_id: int, period_start: datetime | None = None, db: Session = Depends(get_db)):
+    if period_start is None:
+        period_start = db.query(func.max(LeaderboardArchive.period_start)).filter(
+            LeaderboardArchive.leaderboard_id == leaderboard_id
+        ).scalar()
+        if period_start is None:
+            return []
+    return db.query(LeaderboardArchive).filter_by(
+        leaderboard_id=leaderboard_id, period_start=period_start
+    ).order_by(LeaderboardArchive.rank.asc()).limit(50).all()
+
@@ -1,13 +1,18 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from app.models import Notification
-from app.schemas import NotificationIn, NotificationOut
+from app.schemas import NotificationIn, NotificationOut, NotificationReadIn
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user
+from app.utils import notifications as inbox
+from app.utils import push
 from datetime import datetime
+import asyncio
 
 router = APIRouter()
 
+MAX_PAGE = 100
+
 def get_db():
     db = SessionLocal()
     try:
@@ -15,9 +20,9 @@ def get_db():
     finally:
         db.close()
 
-# Send notification
+# Send notification (pushed to the target user's PC socket or /ws/admin; everyone for broadcasts)
 @router.post("/", response_model=NotificationOut)
-def send_notification(
+async def send_notification(
     notif: NotificationIn,
     current_user=Depends(get_current_user),
     db: Session = Depends(get_db)
@@ -30,15 +35,74 @@ def send_notification(
         created_at=datetime.utcnow(),
         seen=False
     )
-    db.add(n)
-    db.commit()
-    db.refresh(n)
-    return n
 
-# Get my notifications (latest first)
+    def _save():
+        db.add(n)
+        db.commit()
+        db.refresh(n)
+        if n.user_id is None:
+            inbox.invalidate_all()
+        else:
+            inbox.invalidate([n.user_id])
+        return push.route_for(db, n.user_id)
+
+    route = await asyncio.to_thread(_save)
+    out = NotificationOut.model_validate(n)
+    await push.deliver([route], {"type": "notification", "notification": out.model_dump(mode="json")})
+    return out
+
+# Get my notifications (latest first, paginated; pass X-Next-Cursor back as ?cursor=)
 @router.get("/", response_model=list[NotificationOut])
-def my_notifications(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    notes = db.query(Notification).filter(
-        (Notification.user_id == current_user.id) | (Notification.user_id == None)
-    ).order_by(Notification.created_at.desc()).all()
-    return notes
+def my_notifications(
+    response: Response,
+    cursor: int | None = None,
+    limit: int = 50,
+    unread: bool = False,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    limit = max(1, min(limit, MAX_PAGE))
+    watermark = inbox.broadcast_watermark(db, current_user.id)
+    mine = Notification.user_id == current_user.id
+    broadcast = Notification.user_id == None
+    if unread:
+        mine = mine & (Notification.seen == False)  # noqa: E712
+        broadcast = broadcast & (Notification.id > watermark)
+    q = db.query(Notification).filter(mine | broadcast)
+    if cursor:
+        q = q.filter(Notification.id < cursor)
+    notes = q.order_by(Notification.id.desc()).limit(limit).all()
+    if len(notes) == limit:
+        response.headers["X-Next-Cursor"] = str(notes[-1].id)
+    return inbox.with_seen(notes, watermark)
+
+# Unread counters (cached per user, dropped whenever a notification is sent or read)
+@router.get("/unread-count")
+def unread_count(current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+    return inbox.unread_counts(db, current_user.id)
+
+# Mark everything read (up to the newest notification unless up_to_id is given)
+@router.post("/read")
+def mark_all_read(
+    body: NotificationReadIn | None = None,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    up_to = inbox.mark_read(db, current_user.id, body.up_to_id if body else None)
+    return {"up_to_id": up_to, **inbox.unread_counts(db, current_user.id)}
+
+# Mark one personal notification read
+@router.post("/{notification_id}/read")
+def mark_one_read(
+    notification_id: int,
+    current_user=Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    n = db.query(Notification).filter(Notification.id == notification_id).first()
+    if not n or n.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    if not n.seen:
+        n.seen = True
+        db.commit()
+        inbox.invalidate([current_user.id])
+    return inbox.unread_counts(db, current_user.id)
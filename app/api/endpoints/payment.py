@@ -1,21 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
-import os
-from app import config
-try:
-    import stripe  # type: ignore
-except Exception:
-    stripe = None
-try:
-    import razorpay  # type: ignore
-except Exception:
-    razorpay = None
+from fastapi import APIRouter, Depends, HTTPException, Response
+import asyncio
 from sqlalchemy.orm import Session
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
 from app.api.endpoints.audit import log_action
-from app.models import Product, ProductCategory, Order, OrderItem, User, WalletTransaction, Coupon
+from app.utils import orders, payments
+from app.models import Product, ProductCategory
 from pydantic import BaseModel
-from datetime import datetime
 
 router = APIRouter()
 
@@ -58,136 +49,56 @@ class OrderIn(BaseModel):
 
 @router.post("/order", response_model=dict)
 def create_order(order: OrderIn, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    if not order.items:
-        raise HTTPException(status_code=400, detail="No items")
-    # Calculate total
-    product_map = {p.id: p for p in db.query(Product).filter(Product.id.in_([i["product_id"] for i in order.items])).all()}
-    total = 0.0
-    for item in order.items:
-        prod = product_map.get(item["product_id"]) if isinstance(item, dict) else None
-        if not prod:
-            raise HTTPException(status_code=404, detail=f"Product {item.get('product_id')} not found")
-        qty = int(item.get("quantity", 1))
-        total += prod.price * qty
-    user = db.query(User).filter_by(id=current_user.id).first()
-    # Apply coupon if provided
-    if order.coupon_code:
-        cp = db.query(Coupon).filter_by(code=order.coupon_code).first()
-        if cp and (cp.applies_to in ("*", "product")):
-            total = max(0.0, round(total * (100.0 - cp.discount_percent) / 100.0, 2))
-    if user.wallet_balance < total:
-        raise HTTPException(status_code=400, detail="Insufficient wallet balance")
-    user.wallet_balance -= total
-    o = Order(user_id=user.id, total=total, created_at=datetime.utcnow())
-    db.add(o)
-    db.commit()
-    db.refresh(o)
-    # Create items and wallet tx
-    for item in order.items:
-        prod = product_map[item["product_id"]]
-        qty = int(item.get("quantity", 1))
-        db.add(OrderItem(order_id=o.id, product_id=prod.id, quantity=qty, price=prod.price))
-    db.add(WalletTransaction(user_id=user.id, amount=-total, timestamp=datetime.utcnow(), type="deduct", description=f"Order #{o.id}"))
-    db.commit()
-    try: log_action(db, getattr(current_user,'id',None), 'order_create', f'Order:{o.id} total:{total}', None)
-    except Exception: pass
-    return {"order_id": o.id, "total": total}
+    try:
+        result = orders.place_order(db, current_user.id, order.items, order.coupon_code)
+    except orders.OrderError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    log_action(db, current_user.id, 'order_create', f'Order:{result["order_id"]} total:{result["total"]}', None)
+    return {"order_id": result["order_id"], "total": result["total"]}
 
 
-# Admin: list orders with basic filters
+# Admin: list orders, newest first; pass the X-Next-Cursor response header back as ?cursor=
 @router.get("/order", response_model=list[dict])
-def list_orders(status: str | None = None, db: Session = Depends(get_db), current_user=Depends(require_role("admin"))):
-    q = db.query(Order)
+def list_orders(
+    response: Response,
+    status: str | None = None,
+    user_id: int | None = None,
+    cursor: int | None = None,
+    limit: int = 50,
+    db: Session = Depends(get_db),
+    current_user=Depends(require_role("admin")),
+):
     # status placeholder (no field yet) — return all for now
-    orders = q.order_by(Order.created_at.desc()).all()
-    out = []
-    for o in orders:
-        u = db.query(User).filter_by(id=o.user_id).first()
-        out.append({
-            "id": o.id,
-            "datetime": o.created_at.isoformat() if o.created_at else None,
-            "status": "paid",  # placeholder; extend later
-            "username": u.name if u else None,
-            "action": "purchase",
-            "details": f"{len(db.query(OrderItem).filter_by(order_id=o.id).all())} items",
-            "amount": o.total,
-            "source": "wallet",
-        })
-    return out
+    rows = orders.list_orders(db, cursor=cursor, limit=limit, user_id=user_id)
+    if len(rows) == max(1, min(limit, orders.MAX_PAGE)):
+        response.headers["X-Next-Cursor"] = str(rows[-1]["id"])
+    return rows
 
 
+def _price(db: Session, order: OrderIn) -> list[dict]:
+    try:
+        lines, _ = orders.price_items(db, order.items)
+    except orders.OrderError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return lines
+
+
+# Hosted checkout; repeating the same cart while it is pending returns the same URL
 @router.post("/stripe/checkout", response_model=dict)
-def create_stripe_checkout(order: OrderIn, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    if stripe is None:
-        raise HTTPException(status_code=400, detail="Stripe SDK not available on server")
-    secret = config.STRIPE_SECRET
-    if not secret:
-        raise HTTPException(status_code=400, detail="Stripe not configured")
-    stripe.api_key = secret
-    currency = config.STRIPE_CURRENCY
-    # Validate items and build line items
-    product_map = {p.id: p for p in db.query(Product).filter(Product.id.in_([i["product_id"] for i in order.items])).all()}
-    line_items = []
-    for item in order.items:
-        prod = product_map.get(item["product_id"]) if isinstance(item, dict) else None
-        if not prod:
-            raise HTTPException(status_code=404, detail=f"Product {item.get('product_id')} not found")
-        qty = int(item.get("quantity", 1))
-        line_items.append({
-            'price_data': {
-                'currency': currency,
-                'product_data': {'name': prod.name},
-                'unit_amount': int(round(prod.price * 100)),
-            },
-            'quantity': max(1, qty),
-        })
-    success_url = config.STRIPE_SUCCESS_URL
-    cancel_url = config.STRIPE_CANCEL_URL
-    session = stripe.checkout.Session.create(
-        mode='payment',
-        line_items=line_items,
-        success_url=success_url,
-        cancel_url=cancel_url,
-        metadata={'user_id': str(current_user.id)}
-    )
-    return {"url": session.url}
+async def create_stripe_checkout(order: OrderIn, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+    lines = await asyncio.to_thread(_price, db, order)
+    try:
+        session = await payments.checkout("stripe", current_user, lines)
+    except payments.GatewayError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return {"url": session["url"]}
 
 
 @router.post("/razorpay/paymentlink", response_model=dict)
-def create_razorpay_payment_link(order: OrderIn, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
-    if razorpay is None:
-        raise HTTPException(status_code=400, detail="Razorpay SDK not available on server")
-    key_id = config.RAZORPAY_KEY_ID
-    key_secret = config.RAZORPAY_KEY_SECRET
-    if not key_id or not key_secret:
-        raise HTTPException(status_code=400, detail="Razorpay not configured")
-    client = razorpay.Client(auth=(key_id, key_secret))
-    currency = config.RAZORPAY_CURRENCY.upper()
-    product_map = {p.id: p for p in db.query(Product).filter(Product.id.in_([i["product_id"] for i in order.items])).all()}
-    total = 0.0
-    description_parts = []
-    for item in order.items:
-        prod = product_map.get(item["product_id"]) if isinstance(item, dict) else None
-        if not prod:
-            raise HTTPException(status_code=404, detail=f"Product {item.get('product_id')} not found")
-        qty = int(item.get("quantity", 1))
-        total += prod.price * qty
-        description_parts.append(f"{prod.name}x{qty}")
-    amount_subunits = int(round(total * 100))
-    payload = {
-        "amount": amount_subunits,
-        "currency": currency,
-        "description": ", ".join(description_parts) or "Purchase",
-        "customer": {
-            "name": getattr(current_user, 'name', 'Customer'),
-            "email": getattr(current_user, 'email', None)
-        },
-        "notify": {"email": True},
-        "callback_url": config.RAZORPAY_SUCCESS_URL,
-        "callback_method": "get"
-    }
+async def create_razorpay_payment_link(order: OrderIn, current_user=Depends(get_current_user), db: Session = Depends(get_db)):
+    lines = await asyncio.to_thread(_price, db, order)
     try:
-        link = client.payment_link.create(payload)
-        return {"url": link.get("short_url") or link.get("url")}
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Razorpay error: {e}")
+        link = await payments.checkout("razorpay", current_user, lines)
+    except payments.GatewayError as e:
+        raise HTTPException(status_code=e.status_code, detail=e.detail)
+    return {"url": link["url"]}
@@ -4,6 +4,7 @@ from app.models import PCGroup, PCToGroup, PC
 from app.schemas import PCGroupIn, PCGroupOut, PCToGroupIn, PCToGroupOut
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
+from app.utils import eligibility
 
 router = APIRouter()
 
@@ -23,6 +24,7 @@ def create_group(
 ):
     g = PCGroup(name=group.name, description=group.description)
     db.add(g)
+    eligibility.bump_groups(db)
     db.commit()
     db.refresh(g)
     return g
@@ -47,6 +49,7 @@ def assign_pc_to_group(
         raise HTTPException(status_code=404, detail="Group not found")
     mapping = PCToGroup(pc_id=data.pc_id, group_id=data.group_id)
     db.add(mapping)
+    eligibility.bump_groups(db)
     db.commit()
     db.refresh(mapping)
     return mapping
@@ -1,13 +1,19 @@
-from fastapi import APIRouter, Depends, UploadFile, File, HTTPException
+from fastapi import APIRouter, Depends, UploadFile, File, HTTPException, Request
+from fastapi.responses import FileResponse, Response
+from sqlalchemy import func
 from sqlalchemy.orm import Session
-from app.models import Screenshot, PC
+from app.models import Screenshot, PC, PCToGroup
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
+from app.utils import screenshots as screenshot_store
+from app.utils import screenshot_images
+import hashlib
 from datetime import datetime
+import asyncio
 import os
 
 router = APIRouter()
-UPLOAD_DIR = "./screenshots"
+UPLOAD_DIR = screenshot_store.UPLOAD_DIR
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 
 def get_db():
@@ -25,33 +31,118 @@ async def upload_screenshot(
     current_user=Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    filename = f"{pc_id}_{datetime.utcnow().strftime('%Y%m%d%H%M%S')}.png"
-    filepath = os.path.join(UPLOAD_DIR, filename)
-    with open(filepath, "wb") as f:
-        content = await file.read()
-        f.write(content)
+    try:
+        stored = await screenshot_store.store_upload(file)
+    except screenshot_store.ScreenshotTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    except screenshot_store.UnsupportedImage as e:
+        raise HTTPException(status_code=415, detail=str(e))
     ss = Screenshot(
         pc_id=pc_id,
-        image_url=filepath,
+        image_url=stored["path"],
         timestamp=datetime.utcnow(),
-        taken_by=current_user.id
+        taken_by=current_user.id,
+        sha256=stored["sha256"],
+        byte_size=stored["byte_size"],
+        width=stored["width"],
+        height=stored["height"],
     )
-    db.add(ss)
-    db.commit()
-    db.refresh(ss)
-    return {"image_url": filepath}
+
+    def _save():
+        db.add(ss)
+        db.commit()
+        db.refresh(ss)
+        screenshot_store.remember_latest(ss)
+
+    await asyncio.to_thread(_save)
+    if stored["created"]:
+        screenshot_images.schedule_variants(stored["path"])
+    return {
+        "id": ss.id,
+        "image_url": stored["path"],
+        "byte_size": stored["byte_size"],
+        "width": stored["width"],
+        "height": stored["height"],
+        "deduplicated": not stored["created"],
+    }
 
 # Admin: List latest screenshots per PC
 @router.get("/latest", tags=["screenshot"])
 def latest_screenshots(current_user=Depends(require_role("admin")), db: Session = Depends(get_db)):
-    pcs = db.query(PC).all()
-    results = []
-    for pc in pcs:
-        ss = db.query(Screenshot).filter_by(pc_id=pc.id).order_by(Screenshot.timestamp.desc()).first()
-        if ss:
-            results.append({
-                "pc_id": pc.id,
-                "image_url": ss.image_url,
-                "timestamp": ss.timestamp
-            })
-    return results
+    return screenshot_store.latest_all(db)
+
+# Content-addressed files never change, so clients may cache them forever
+_IMMUTABLE = "private, max-age=31536000, immutable"
+# The original standing in for a variant that is not generated yet must not be cached as that variant
+_FALLBACK = "private, no-cache"
+
+def _not_modified(request: Request, etag: str) -> bool:
+    inm = request.headers.get("if-none-match")
+    return bool(inm) and etag in [t.strip() for t in inm.split(",")]
+
+# Admin: serve a screenshot (variant: thumb, preview or original)
+@router.get("/image/{screenshot_id}")
+async def screenshot_image(
+    screenshot_id: int,
+    request: Request,
+    variant: str = "thumb",
+    current_user=Depends(require_role("admin")),
+    db: Session = Depends(get_db)
+):
+    if variant not in ("original", *screenshot_images.VARIANTS):
+        raise HTTPException(status_code=400, detail="Unknown variant")
+    ss = await asyncio.to_thread(lambda: db.query(Screenshot).filter_by(id=screenshot_id).first())
+    if not ss or not os.path.exists(ss.image_url):
+        raise HTTPException(status_code=404, detail="Screenshot not found")
+    path = ss.image_url
+    cache_control = _IMMUTABLE
+    if variant != "original":
+        candidate = screenshot_images.variant_path(ss.image_url, variant)
+        if screenshot_images.available() and os.path.exists(candidate):
+            path = candidate
+        else:
+            # Not generated yet, failed, or generated before this feature: serve the original
+            # meanwhile and (re)schedule generation so a later request gets the variant
+            screenshot_images.schedule_variants(ss.image_url)
+            variant = "original"
+            cache_control = _FALLBACK
+    digest = ss.sha256 or hashlib.sha256(ss.image_url.encode()).hexdigest()
+    etag = f'"{digest}-{variant}"'
+    headers = {"ETag": etag, "Cache-Control": cache_control}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    return FileResponse(path=path, headers=headers)
+
+# Admin: one composited image of the latest screenshot of every PC in a PC group
+@router.get("/contact-sheet/{group_id}")
+async def contact_sheet(
+    group_id: int,
+    request: Request,
+    current_user=Depends(require_role("admin")),
+    db: Session = Depends(get_db)
+):
+    if not screenshot_images.available():
+        raise HTTPException(status_code=503, detail="Image processing not available on server")
+
+    def _latest_for_group():
+        pc_ids = db.query(PCToGroup.pc_id).filter(PCToGroup.group_id == group_id)
+        subq = db.query(
+            Screenshot.pc_id, func.max(Screenshot.timestamp).label("max_ts")
+        ).filter(Screenshot.pc_id.in_(pc_ids)).group_by(Screenshot.pc_id).subquery()
+        return db.query(Screenshot, PC.name).join(
+            subq, (Screenshot.pc_id == subq.c.pc_id) & (Screenshot.timestamp == subq.c.max_ts)
+        ).outerjoin(PC, PC.id == Screenshot.pc_id).order_by(Screenshot.pc_id).all()
+
+    rows = await asyncio.to_thread(_latest_for_group)
+    if not rows:
+        raise HTTPException(status_code=404, detail="No screenshots for this group")
+    tiles = []
+    for ss, pc_name in rows:
+        thumb = screenshot_images.variant_path(ss.image_url, "thumb")
+        tiles.append((pc_name or f"PC {ss.pc_id}", thumb if os.path.exists(thumb) else ss.image_url))
+    etag = '"' + hashlib.sha256("|".join(f"{ss.id}:{ss.sha256}" for ss, _ in rows).encode()).hexdigest() + '"'
+    headers = {"ETag": etag, "Cache-Control": "private, max-age=10"}
+    if _not_modified(request, etag):
+        return Response(status_code=304, headers=headers)
+    data = await screenshot_images.run_in_pool(screenshot_images.render_contact_sheet, tiles)
+    return Response(content=data, media_type="image/jpeg", headers=headers)
@@ -7,6 +7,8 @@ from app.models import Session as PCSession, ClientPC
 from app.database import SessionLocal
 from datetime import datetime
 from app.api.endpoints.billing import calculate_billing
+from app.utils import leaderboard as leaderboard_feed
+from app.utils import manifests, webhooks
 
 router = APIRouter()
 
@@ -27,6 +29,10 @@ def start_session(data: SessionStart, db: Session = Depends(get_db)):
         amount=0.0
     )
     db.add(session)
+    db.flush()
+    webhooks.emit(db, webhooks.SESSION_STARTED, {
+        "session_id": session.id, "pc_id": session.pc_id, "user_id": session.user_id, "start_time": session.start_time,
+    })
     db.commit()
     db.refresh(session)
     try: log_action(db, data.user_id, 'session_start', f'PC:{data.pc_id}', None)
@@ -37,6 +43,7 @@ def start_session(data: SessionStart, db: Session = Depends(get_db)):
         pc = db.query(ClientPC).filter_by(id=data.pc_id).first()
         if pc:
             pc.current_user_id = data.user_id
+            manifests.bump_pcs(db)
             db.commit()
     except Exception:
         pass
@@ -50,10 +57,20 @@ def stop_session(session_id: int, db: Session = Depends(get_db)):
     if session.end_time:
         return session
     session.end_time = datetime.utcnow()
+    webhooks.emit(db, webhooks.SESSION_STOPPED, {
+        "session_id": session.id, "pc_id": session.pc_id, "user_id": session.user_id,
+        "start_time": session.start_time, "end_time": session.end_time,
+        "minutes": round((session.end_time - session.start_time).total_seconds() / 60.0, 2) if session.start_time else None,
+    })
     db.commit()
     db.refresh(session)
     try: log_action(db, session.user_id, 'session_stop', f'PC:{session.pc_id} duration', None)
     except Exception: pass
+    # Feed play time to leaderboards (flushed in batches)
+    leaderboard_feed.record_metric(
+        session.user_id, leaderboard_feed.METRIC_PLAY_MINUTES,
+        (session.end_time - session.start_time).total_seconds() / 60.0, at=session.end_time,
+    )
     # Attempt to calculate and charge billing
     try:
         _ = calculate_billing(session, db)
@@ -65,6 +82,7 @@ def stop_session(session_id: int, db: Session = Depends(get_db)):
         pc = db.query(ClientPC).filter_by(id=session.pc_id).first()
         if pc:
             pc.current_user_id = None
+            manifests.bump_pcs(db)
             db.commit()
     except Exception:
         pass
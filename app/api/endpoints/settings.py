@@ -1,45 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, status, Response, Header
 from sqlalchemy.orm import Session
 from typing import List, Optional
 from datetime import datetime
-import json
 
 from app.database import get_db
 from app.models import Setting, User
 from app.schemas import SettingIn, SettingOut, SettingUpdate, SettingsBulkUpdate
 from app.api.endpoints.auth import get_current_user
 from app.api.endpoints.audit import log_action
+from app.utils import settings_registry
+from app.utils.settings_registry import parse_value, serialize_value
 
 router = APIRouter()
 
-def parse_value(value: str | int | float | bool | dict | list | None, value_type: str):
-    """Parse string value to appropriate type"""
-    # If already parsed or None, return as-is
-    if value is None or isinstance(value, (bool, int, float, dict, list)):
-        return value
-    if value_type == "boolean":
-        return value.lower() in ("true", "1", "yes")
-    elif value_type == "number":
-        try:
-            return int(value)
-        except ValueError:
-            try:
-                return float(value)
-            except ValueError:
-                return value
-    elif value_type == "json":
-        try:
-            return json.loads(value)
-        except json.JSONDecodeError:
-            return value
-    return value
-
-def serialize_value(value, value_type: str) -> str:
-    """Convert value to string for storage"""
-    if value_type == "json" and isinstance(value, (dict, list)):
-        return json.dumps(value)
-    return str(value)
-
 @router.get("", response_model=List[SettingOut])
 def get_settings(
     category: Optional[str] = None,
@@ -48,24 +21,20 @@ def get_settings(
     db: Session = Depends(get_db),
 ):
     """Get settings, optionally filtered by category or key"""
-    query = db.query(Setting)
-
-    if category:
-        query = query.filter(Setting.category == category)
-
-    if key:
-        query = query.filter(Setting.key == key)
-
-    if public_only:
-        query = query.filter(Setting.is_public == True)
+    return settings_registry.rows(db, category, key, public_only)
 
-    settings = query.all()
-
-    # Convert stored values to appropriate types
-    for setting in settings:
-        setting.value = parse_value(setting.value, setting.value_type)
-
-    return settings
+@router.get("/public", response_model=List[SettingOut])
+def get_public_settings(
+    response: Response,
+    if_none_match: Optional[str] = Header(None),
+    db: Session = Depends(get_db)
+):
+    """Get all public settings (no authentication required); changes are also pushed over /ws/pc"""
+    tag = f'W/"settings-{settings_registry.version(db)}"'
+    if if_none_match and tag in [t.strip() for t in if_none_match.split(",")]:
+        return Response(status_code=304, headers={"ETag": tag})
+    response.headers["ETag"] = tag
+    return settings_registry.rows(db, public_only=True)
 
 @router.get("/{setting_id}", response_model=SettingOut)
 def get_setting(
@@ -74,12 +43,9 @@ def get_setting(
     current_user: User = Depends(get_current_user)
 ):
     """Get a specific setting by ID"""
-    setting = db.query(Setting).filter(Setting.id == setting_id).first()
+    setting = settings_registry.get_row(db, setting_id)
     if not setting:
         raise HTTPException(status_code=404, detail="Setting not found")
-
-    # Convert stored value to appropriate type
-    setting.value = parse_value(setting.value, setting.value_type)
     return setting
 
 @router.post("", response_model=SettingOut)
@@ -114,6 +80,7 @@ def create_setting(
     )
 
     db.add(db_setting)
+    settings_registry.changed(db)
     db.commit()
     db.refresh(db_setting)
 
@@ -153,6 +120,7 @@ def update_setting(
     db_setting.updated_by = current_user.id
     db_setting.updated_at = datetime.utcnow()
 
+    settings_registry.changed(db)
     db.commit()
     db.refresh(db_setting)
 
@@ -173,64 +141,29 @@ def bulk_update_settings(
     db: Session = Depends(get_db),
     current_user: User = Depends(get_current_user)
 ):
-    """Bulk update multiple settings"""
-    updated_settings = []
-
-    for setting_data in bulk_update.settings:
-        # Find existing setting
-        db_setting = db.query(Setting).filter(
-            Setting.category == setting_data.category,
-            Setting.key == setting_data.key
-        ).first()
-
-        if db_setting:
-            # Update existing setting
-            old_value = parse_value(db_setting.value, db_setting.value_type)
-            stored_value = serialize_value(setting_data.value, setting_data.value_type)
-
-            db_setting.value = stored_value
-            db_setting.value_type = setting_data.value_type
-            db_setting.description = setting_data.description
-            db_setting.updated_by = current_user.id
-            db_setting.updated_at = datetime.utcnow()
-
-            # Convert stored value back to appropriate type for response
-            db_setting.value = parse_value(db_setting.value, db_setting.value_type)
-            updated_settings.append(db_setting)
-
-            # Log the action
-            log_action(
-                db, current_user.id,
-                "setting_updated",
-                f"Updated setting {setting_data.category}.{setting_data.key} from {old_value} to {setting_data.value}"
-            )
-        else:
-            # Create new setting
-            stored_value = serialize_value(setting_data.value, setting_data.value_type)
-
-            db_setting = Setting(
-                category=setting_data.category,
-                key=setting_data.key,
-                value=stored_value,
-                value_type=setting_data.value_type,
-                description=setting_data.description,
-                updated_by=current_user.id
-            )
-
-            db.add(db_setting)
-            # Convert stored value back to appropriate type for response
-            db_setting.value = parse_value(db_setting.value, db_setting.value_type)
-            updated_settings.append(db_setting)
-
-            # Log the action
-            log_action(
-                db, current_user.id,
-                "setting_created",
-                f"Created setting {setting_data.category}.{setting_data.key} = {setting_data.value}"
-            )
+    """Bulk update multiple settings atomically (created when missing)"""
+    try:
+        saved, changes = settings_registry.bulk_upsert(
+            db, [s.model_dump() for s in bulk_update.settings], current_user.id
+        )
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise HTTPException(status_code=400, detail="Settings update failed; nothing was changed")
+
+    if changes["created"] or changes["updated"]:
+        parts = [f"{name} from {old} to {new}" for name, old, new in changes["updated"]]
+        parts += [f"{name} created" for name in changes["created"]]
+        # One entry for the whole save, capped so a large page does not produce a huge row
+        detail = "; ".join(parts)
+        log_action(
+            db, current_user.id,
+            "settings_bulk_updated",
+            f"Updated {len(changes['updated'])}, created {len(changes['created'])} settings: "
+            + (detail if len(detail) <= 4000 else detail[:4000] + "...")
+        )
 
-    db.commit()
-    return updated_settings
+    return saved
 
 @router.delete("/{setting_id}")
 def delete_setting(
@@ -246,6 +179,7 @@ def delete_setting(
     setting_info = f"{db_setting.category}.{db_setting.key}"
 
     db.delete(db_setting)
+    settings_registry.changed(db)
     db.commit()
 
     # Log the action
@@ -263,26 +197,7 @@ def get_settings_by_category(
     db: Session = Depends(get_db),
 ):
     """Get all settings for a specific category"""
-    settings = db.query(Setting).filter(Setting.category == category).all()
-
-    # Convert stored values to appropriate types
-    for setting in settings:
-        setting.value = parse_value(setting.value, setting.value_type)
-
-    return settings
-
-@router.get("/public", response_model=List[SettingOut])
-def get_public_settings(
-    db: Session = Depends(get_db)
-):
-    """Get all public settings (no authentication required)"""
-    settings = db.query(Setting).filter(Setting.is_public == True).all()
-
-    # Convert stored values to appropriate types
-    for setting in settings:
-        setting.value = parse_value(setting.value, setting.value_type)
-
-    return settings
+    return settings_registry.rows(db, category)
 
 @router.post("/initialize-defaults")
 def initialize_default_settings(
@@ -379,12 +294,13 @@ def initialize_default_settings(
                 category=setting_data["category"],
                 description=setting_data.get("description", ""),
                 is_public=False,
-                created_at=datetime.utcnow(),
                 updated_at=datetime.utcnow()
             )
             db.add(setting)
             created_count += 1
     
+    if created_count:
+        settings_registry.changed(db)
     db.commit()
     
     # Log the action
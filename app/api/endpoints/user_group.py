@@ -4,6 +4,7 @@ from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user, require_role
 from app.models import UserGroup, User
 from app.schemas import UserGroupIn, UserGroupOut
+from app.utils import eligibility
 
 router = APIRouter()
 
@@ -22,6 +23,7 @@ def create_group(group: UserGroupIn, current_user=Depends(require_role("admin"))
         raise HTTPException(status_code=400, detail="Group name exists")
     g = UserGroup(**group.dict())
     db.add(g)
+    eligibility.bump_groups(db)
     db.commit()
     db.refresh(g)
     return g
@@ -5,6 +5,7 @@ from app.schemas import WalletTransactionOut, WalletAction
 from app.database import SessionLocal
 from app.api.endpoints.auth import get_current_user
 from datetime import datetime
+from app.utils import webhooks
 
 router = APIRouter()
 
@@ -42,6 +43,11 @@ def topup_wallet(
         type="topup", description=action.description
     )
     db.add(tx)
+    db.flush()
+    webhooks.emit(db, webhooks.WALLET_TOPUP, {
+        "transaction_id": tx.id, "user_id": user.id, "amount": tx.amount,
+        "balance": user.wallet_balance, "timestamp": tx.timestamp,
+    })
     db.commit()
     db.refresh(tx)
     return tx
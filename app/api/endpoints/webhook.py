@@ -1,11 +1,11 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
-from app.models import Webhook
-from app.schemas import WebhookIn, WebhookOut
+from app.models import Webhook, WebhookDelivery
+from app.schemas import WebhookIn, WebhookOut, WebhookDeliveryOut
 from app.database import SessionLocal
 from app.api.endpoints.auth import require_role, get_current_user
+from app.utils import webhooks
 from datetime import datetime
-import requests # pyright: ignore[reportMissingModuleSource]
 
 router = APIRouter()
 
@@ -53,3 +53,46 @@ def deactivate_webhook(
     wh.is_active = False
     db.commit()
     return {"message": "Webhook deactivated"}
+
+MAX_PAGE = 500
+
+# Admin: delivery log, newest first; pass the X-Next-Cursor response header back as ?cursor=
+@router.get("/deliveries", response_model=list[WebhookDeliveryOut])
+def list_deliveries(
+    response: Response,
+    webhook_id: int | None = None,
+    status: str | None = None,
+    cursor: int | None = None,
+    limit: int = 100,
+    current_user=Depends(require_role("admin")),
+    db: Session = Depends(get_db)
+):
+    limit = max(1, min(limit, MAX_PAGE))
+    q = db.query(WebhookDelivery)
+    if webhook_id is not None:
+        q = q.filter(WebhookDelivery.webhook_id == webhook_id)
+    if status:
+        q = q.filter(WebhookDelivery.status == status)
+    if cursor:
+        q = q.filter(WebhookDelivery.id < cursor)
+    rows = q.order_by(WebhookDelivery.id.desc()).limit(limit).all()
+    if len(rows) == limit:
+        response.headers["X-Next-Cursor"] = str(rows[-1].id)
+    return rows
+
+# Admin: send a failed (or pending) delivery again now
+@router.post("/deliveries/{delivery_id}/retry", response_model=WebhookDeliveryOut)
+def retry_delivery(
+    delivery_id: int,
+    current_user=Depends(require_role("admin")),
+    db: Session = Depends(get_db)
+):
+    d = webhooks.retry(db, delivery_id)
+    if d is None:
+        raise HTTPException(status_code=404, detail="Delivery not found")
+    return d
+
+# Admin: dispatcher counters and per-endpoint circuit breakers
+@router.get("/dispatcher")
+def dispatcher_status(current_user=Depends(require_role("admin")), db: Session = Depends(get_db)):
+    return webhooks.status(db)
@@ -3,7 +3,7 @@ from dotenv import load_dotenv
 from fastapi.middleware.cors import CORSMiddleware
 import os
 from app.api.endpoints import wallet
-from app.database import engine, Base
+from app.database import engine
 from app.api.endpoints import auth, pc, session
 from app.api.endpoints import game
 from app.api.endpoints import remote_command
@@ -39,6 +39,16 @@ from app.api.endpoints import coupon
 from app.api.endpoints import settings, games
 from app.ws import pc as ws_pc
 from app.ws import admin as ws_admin
+from app.utils import leaderboard as leaderboard_feed
+from app.utils import telemetry, telemetry_rollup, hardware_latest, hardware_alerts
+from app.utils import screenshot_images
+from app.utils import screenshots as screenshot_store
+from app.utils import audit_queue, audit_index, audit_archive
+from app.utils import backup_engine
+from app.utils import chat as chat_store
+from app.utils import game_search, manifests, settings_registry
+from app.utils import payments, webhooks
+from app.utils import schema
 
 # Load environment from .env if present
 try:
@@ -46,87 +56,9 @@ try:
 except Exception:
     pass
 
-Base.metadata.create_all(bind=engine)
-
-# Lightweight migration for SQLite: ensure users.wallet_balance column exists
-# NOTE: This migration code is SQLite-specific using PRAGMA commands.
-# For PostgreSQL production deployments, use Alembic for proper database migrations.
-# The try-except block will safely skip this for non-SQLite databases.
-try:
-    from sqlalchemy import text
-    with engine.connect() as conn:
-        # Users
-        res = conn.execute(text("PRAGMA table_info(users)"))
-        cols = [row[1] for row in res]
-        if 'wallet_balance' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN wallet_balance FLOAT DEFAULT 0.0"))
-            conn.commit()
-        if 'coins_balance' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN coins_balance INTEGER DEFAULT 0"))
-            conn.commit()
-        if 'user_group_id' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN user_group_id INTEGER"))
-            conn.commit()
-        if 'birthdate' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN birthdate DATETIME"))
-            conn.commit()
-        if 'two_factor_secret' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN two_factor_secret TEXT"))
-            conn.commit()
-        if 'is_email_verified' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN is_email_verified BOOLEAN DEFAULT 0"))
-            conn.commit()
-        if 'email_verification_sent_at' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN email_verification_sent_at DATETIME"))
-            conn.commit()
-        if 'first_name' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN first_name TEXT"))
-            conn.commit()
-        if 'last_name' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN last_name TEXT"))
-            conn.commit()
-        if 'phone' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN phone TEXT"))
-            conn.commit()
-        if 'tos_accepted' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN tos_accepted BOOLEAN DEFAULT 0"))
-            conn.commit()
-        if 'tos_accepted_at' not in cols:
-            conn.execute(text("ALTER TABLE users ADD COLUMN tos_accepted_at DATETIME"))
-            conn.commit()
-        # Games
-        resg = conn.execute(text("PRAGMA table_info(games)"))
-        gcols = [r[1] for r in resg]
-        if 'min_age' not in gcols:
-            conn.execute(text("ALTER TABLE games ADD COLUMN min_age INTEGER"))
-            conn.commit()
-        # Ensure new tables exist
-        Base.metadata.create_all(bind=engine)
-        # ClientPC migration: add current_user_id if missing
-        resc = conn.execute(text("PRAGMA table_info(client_pcs)"))
-        ccols = [r[1] for r in resc]
-        if 'current_user_id' not in ccols:
-            conn.execute(text("ALTER TABLE client_pcs ADD COLUMN current_user_id INTEGER"))
-            conn.commit()
-        if 'device_id' not in ccols:
-            conn.execute(text("ALTER TABLE client_pcs ADD COLUMN device_id TEXT"))
-            conn.commit()
-        if 'bound' not in ccols:
-            conn.execute(text("ALTER TABLE client_pcs ADD COLUMN bound BOOLEAN DEFAULT 0"))
-            conn.commit()
-        if 'bound_at' not in ccols:
-            conn.execute(text("ALTER TABLE client_pcs ADD COLUMN bound_at DATETIME"))
-            conn.commit()
-        if 'grace_until' not in ccols:
-            conn.execute(text("ALTER TABLE client_pcs ADD COLUMN grace_until DATETIME"))
-            conn.commit()
-        if 'suspended' not in ccols:
-            conn.execute(text("ALTER TABLE client_pcs ADD COLUMN suspended BOOLEAN DEFAULT 0"))
-            conn.commit()
-        # Ensure challenges and tokens tables exist via ORM metadata
-        Base.metadata.create_all(bind=engine)
-except Exception:
-    pass
+# Create new tables, add columns missing from older databases and run the one-time index migrations
+# (shared with backup restore, which upgrades a restored copy the same way before swapping it in)
+schema.upgrade(engine)
 
 app = FastAPI()
 
@@ -138,6 +70,9 @@ origins = [
     "http://localhost:3000",      # Alternative dev port
 ]
 
+# Refuse oversized screenshots before the multipart parser spools them (added first so CORS wraps it)
+app.add_middleware(screenshot_store.UploadLimit, path_prefix="/api/screenshot/upload/")
+
 # FOR DEVELOPMENT ONLY: allow all origins when ALLOW_ALL_CORS=true
 if os.getenv("ALLOW_ALL_CORS", "false").lower() == "true":
     # When allow_credentials=True, Starlette disallows wildcard origins; use regex instead
@@ -304,9 +239,42 @@ async def _broadcast_timeleft_loop():
             pass
         await asyncio.sleep(60)
 
+# The loop only keeps weak references to tasks; hold the background loops for the app's lifetime
+_background: set[asyncio.Task] = set()
+
 @app.on_event("startup")
 async def _start_background():
     try:
-        asyncio.create_task(_broadcast_timeleft_loop())
+        for loop in (
+            _broadcast_timeleft_loop(),
+            leaderboard_feed.flush_loop(),
+            leaderboard_feed.rollover_loop(),
+            telemetry.flush_loop(),
+            telemetry_rollup.maintenance_loop(),
+            hardware_latest.push_loop(),
+            hardware_alerts.alert_loop(),
+            screenshot_store.retention_loop(),
+            audit_queue.flush_loop(),
+            audit_index.backfill_task(),
+            audit_archive.archive_loop(),
+            backup_engine.schedule_loop(),
+            chat_store.backfill_task(),
+            game_search.warm_task(),
+            manifests.push_loop(),
+            settings_registry.push_loop(),
+            webhooks.dispatch_loop(),
+        ):
+            task = asyncio.create_task(loop)
+            _background.add(task)
+            task.add_done_callback(_background.discard)
     except Exception:
         pass
+
+@app.on_event("shutdown")
+async def _stop_background():
+    leaderboard_feed.flush_on_shutdown()
+    telemetry.flush_on_shutdown()
+    audit_queue.flush_on_shutdown()
+    screenshot_images.shutdown()
+    await payments.close()
+    await webhooks.close()
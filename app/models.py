@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Float, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.database import Base
@@ -62,6 +62,14 @@ class Game(Base):
     never_use_parent_license = Column(Boolean, default=False)
     image_600x900 = Column(String, nullable=True)  # URL to poster image
     image_background = Column(String, nullable=True)  # URL to background image
+    catalog_version = Column(Integer, default=0, index=True)  # catalog version of the last change
+
+class GameTombstone(Base):
+    """Deleted games, kept so catalog deltas can report removals."""
+    __tablename__ = "game_tombstones"
+    game_id = Column(Integer, primary_key=True)
+    catalog_version = Column(Integer, index=True)
+    deleted_at = Column(DateTime, default=datetime.utcnow)
 
 class PCGame(Base):
     __tablename__ = "pc_games"
@@ -87,6 +95,26 @@ class ChatMessage(Base):
     message = Column(String)
     timestamp = Column(DateTime, default=datetime.utcnow)
     read = Column(Boolean, default=False)
+    # "dm:<low user id>:<high user id>" or "broadcast"
+    conversation_id = Column(String, nullable=True)
+    __table_args__ = (
+        Index("ix_chat_messages_to_user_timestamp", "to_user_id", "timestamp"),
+        Index("ix_chat_messages_conversation_id", "conversation_id", "id"),
+    )
+
+class ChatSummary(Base):
+    """Per-user, per-conversation unread counter and read position."""
+    __tablename__ = "chat_summaries"
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+    conversation_id = Column(String)
+    unread_count = Column(Integer, default=0)
+    last_message_id = Column(Integer, nullable=True)
+    last_read_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        UniqueConstraint("user_id", "conversation_id", name="uq_chat_summary_user_conversation"),
+    )
 
 class Notification(Base):
     __tablename__ = "notifications"
@@ -96,7 +124,18 @@ class Notification(Base):
     type = Column(String)  # info, warning, error, alert, etc.
     content = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
-    seen = Column(Boolean, default=False)
+    seen = Column(Boolean, default=False)  # personal notifications only; broadcasts use NotificationReadMark
+    __table_args__ = (
+        Index("ix_notifications_user_id_id", "user_id", "id"),
+        Index("ix_notifications_user_seen", "user_id", "seen"),
+    )
+
+class NotificationReadMark(Base):
+    """Per-user watermark: broadcast notifications with id <= broadcast_read_id are read."""
+    __tablename__ = "notification_read_marks"
+    user_id = Column(Integer, ForeignKey("users.id"), primary_key=True)
+    broadcast_read_id = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
 
 class SupportTicket(Base):
     __tablename__ = "support_tickets"
@@ -130,6 +169,29 @@ class HardwareStat(Base):
     disk_percent = Column(Float)
     gpu_percent = Column(Float, nullable=True)  # Optional, if you can fetch GPU
     temp = Column(Float, nullable=True)
+    __table_args__ = (
+        Index("ix_hardware_stats_pc_timestamp", "pc_id", "timestamp"),
+        Index("ix_hardware_stats_timestamp", "timestamp"),
+    )
+
+class HardwareRollup(Base):
+    __tablename__ = "hardware_rollups"
+    id = Column(Integer, primary_key=True, index=True)
+    pc_id = Column(Integer, ForeignKey("pcs.id"))
+    tier = Column(Integer)  # bucket width in seconds: 60, 900, 3600
+    metric = Column(String)  # cpu_percent, ram_percent, disk_percent, gpu_percent, temp
+    bucket_start = Column(DateTime)
+    count = Column(Integer, default=0)
+    min = Column(Float)
+    avg = Column(Float)
+    max = Column(Float)
+    p95 = Column(Float)
+    __table_args__ = (
+        Index("ix_hardware_rollups_pc_tier_bucket", "pc_id", "tier", "bucket_start"),
+        Index("ix_hardware_rollups_tier_bucket", "tier", "bucket_start"),
+        # Rollups upsert on this; existing databases get it via telemetry_rollup.prepare_unique_index
+        Index("uq_hardware_rollups_pc_tier_metric_bucket", "pc_id", "tier", "metric", "bucket_start", unique=True),
+    )
 
 class ClientUpdate(Base):
     __tablename__ = "client_updates"
@@ -160,6 +222,33 @@ class AuditLog(Base):
     detail = Column(String, nullable=True)
     timestamp = Column(DateTime, default=datetime.utcnow)
     ip = Column(String, nullable=True)
+    # Structured fields derived from action/detail so filters never scan free text
+    category = Column(String, nullable=True)
+    pc_id = Column(Integer, nullable=True)
+    cafe_id = Column(Integer, nullable=True)
+    target_id = Column(Integer, nullable=True)
+    __table_args__ = (
+        # Newest-first keyset pagination within each filter
+        Index("ix_audit_logs_category_id", "category", "id"),
+        Index("ix_audit_logs_pc_id_id", "pc_id", "id"),
+        Index("ix_audit_logs_cafe_id_id", "cafe_id", "id"),
+        Index("ix_audit_logs_user_id_id", "user_id", "id"),
+        Index("ix_audit_logs_target_id", "target_id"),
+        Index("ix_audit_logs_timestamp", "timestamp"),
+    )
+
+class AuditArchive(Base):
+    """One gzip JSONL file holding audit rows moved out of audit_logs for a month."""
+    __tablename__ = "audit_archives"
+    id = Column(Integer, primary_key=True, index=True)
+    month = Column(String, index=True)  # YYYY-MM
+    path = Column(String, unique=True)
+    row_count = Column(Integer, default=0)
+    first_id = Column(Integer)
+    last_id = Column(Integer)
+    byte_size = Column(Integer, default=0)
+    sha256 = Column(String, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class PCGroup(Base):
     __tablename__ = "pc_groups"
@@ -180,6 +269,17 @@ class BackupEntry(Base):
     file_path = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
     note = Column(String, nullable=True)
+    status = Column(String, default="done")  # pending, running, done, failed
+    compression = Column(String, nullable=True)  # gzip, or None for legacy raw copies
+    byte_size = Column(Integer, nullable=True)
+    sha256 = Column(String, nullable=True)
+    error = Column(String, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    kind = Column(String, default="full")  # full, incremental
+    # Incrementals hold the pages changed since this backup
+    parent_id = Column(Integer, ForeignKey("backup_entries.id"), nullable=True)
+    # sha256 of the restored database image, checked before a restore is swapped in
+    image_sha256 = Column(String, nullable=True)
 
 class PricingRule(Base):
     __tablename__ = "pricing_rules"
@@ -226,6 +326,49 @@ class Webhook(Base):
     secret = Column(String, nullable=True)  # Optional: for verifying authenticity
     created_at = Column(DateTime, default=datetime.utcnow)
 
+# Outbox: written in the same transaction as the change it describes, fanned out to deliveries by the dispatcher
+class WebhookEvent(Base):
+    __tablename__ = "webhook_events"
+    id = Column(Integer, primary_key=True, index=True)
+    event = Column(String)
+    payload = Column(String)  # JSON
+    created_at = Column(DateTime, default=datetime.utcnow)
+    dispatched_at = Column(DateTime, nullable=True)
+    __table_args__ = (
+        Index("ix_webhook_events_dispatched_id", "dispatched_at", "id"),
+    )
+
+# One event to one endpoint; doubles as the delivery log
+class WebhookDelivery(Base):
+    __tablename__ = "webhook_deliveries"
+    id = Column(Integer, primary_key=True, index=True)
+    webhook_id = Column(Integer, ForeignKey("webhooks.id"))
+    event_id = Column(Integer, ForeignKey("webhook_events.id"))
+    event = Column(String)
+    status = Column(String, default="pending")  # pending, delivered, failed
+    attempts = Column(Integer, default=0)
+    next_attempt_at = Column(DateTime, default=datetime.utcnow)
+    locked_until = Column(DateTime, nullable=True)
+    # Set per claim; a sender whose lease expired and was re-claimed cannot overwrite the new outcome
+    lease_token = Column(String, nullable=True)
+    response_status = Column(Integer, nullable=True)
+    last_error = Column(String, nullable=True)
+    duration_ms = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    delivered_at = Column(DateTime, nullable=True)
+    __table_args__ = (
+        Index("ix_webhook_deliveries_status_next", "status", "next_attempt_at"),
+        Index("ix_webhook_deliveries_webhook_id_id", "webhook_id", "id"),
+    )
+
+# Circuit breaker per endpoint, shared by every worker's dispatcher
+class WebhookBreaker(Base):
+    __tablename__ = "webhook_breakers"
+    webhook_id = Column(Integer, ForeignKey("webhooks.id"), primary_key=True)
+    failures = Column(Integer, default=0)  # consecutive failed batches
+    trips = Column(Integer, default=0)
+    open_until = Column(DateTime, nullable=True)
+
 class PlatformAccount(Base):
     __tablename__ = "platform_accounts"
     id = Column(Integer, primary_key=True, index=True)
@@ -292,6 +435,13 @@ class Screenshot(Base):
     image_url = Column(String)  # Path or link to saved screenshot
     timestamp = Column(DateTime, default=datetime.utcnow)
     taken_by = Column(Integer, ForeignKey("users.id"), nullable=True)
+    sha256 = Column(String, nullable=True, index=True)  # content hash; identical images share one file
+    byte_size = Column(Integer, nullable=True)
+    width = Column(Integer, nullable=True)
+    height = Column(Integer, nullable=True)
+    __table_args__ = (
+        Index("ix_screenshots_pc_timestamp", "pc_id", "timestamp"),
+    )
 
 class ProductCategory(Base):
     __tablename__ = "product_categories"
@@ -312,6 +462,9 @@ class Order(Base):
     user_id = Column(Integer, ForeignKey("users.id"))
     total = Column(Float, default=0.0)
     created_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_orders_user_id_id", "user_id", "id"),
+    )
 
 class OrderItem(Base):
     __tablename__ = "order_items"
@@ -320,6 +473,9 @@ class OrderItem(Base):
     product_id = Column(Integer, ForeignKey("products.id"))
     quantity = Column(Integer, default=1)
     price = Column(Float)  # unit price at time of order
+    __table_args__ = (
+        Index("ix_order_items_order_id", "order_id"),
+    )
 
 # Advanced engagement: prizes, leaderboards, events, coupons
 
@@ -356,6 +512,26 @@ class LeaderboardEntry(Base):
     period_start = Column(DateTime)
     period_end = Column(DateTime)
     value = Column(Integer, default=0)
+    __table_args__ = (
+        Index("ix_leaderboard_entries_lb_period_user", "leaderboard_id", "period_start", "user_id"),
+        Index("ix_leaderboard_entries_lb_period_end", "leaderboard_id", "period_end"),
+        # Flushes upsert on this; existing databases get it via leaderboard.prepare_unique_index
+        Index("uq_leaderboard_entries_lb_user_period", "leaderboard_id", "user_id", "period_start", unique=True),
+    )
+
+class LeaderboardArchive(Base):
+    __tablename__ = "leaderboard_archives"
+    id = Column(Integer, primary_key=True, index=True)
+    leaderboard_id = Column(Integer, ForeignKey("leaderboards.id"))
+    user_id = Column(Integer, ForeignKey("users.id"))
+    period_start = Column(DateTime)
+    period_end = Column(DateTime)
+    rank = Column(Integer)
+    value = Column(Integer, default=0)
+    archived_at = Column(DateTime, default=datetime.utcnow)
+    __table_args__ = (
+        Index("ix_leaderboard_archives_lb_period_rank", "leaderboard_id", "period_start", "rank"),
+    )
 
 class Event(Base):
     __tablename__ = "events"
@@ -392,6 +568,8 @@ class CouponRedemption(Base):
     coupon_id = Column(Integer, ForeignKey("coupons.id"))
     user_id = Column(Integer, ForeignKey("users.id"))
     timestamp = Column(DateTime, default=datetime.utcnow)
+    # Order the use was spent on; NULL for a redemption from /api/coupon/redeem not yet used in an order
+    order_id = Column(Integer, ForeignKey("orders.id"), nullable=True)
 
 class Cafe(Base):
     __tablename__ = "cafes"
@@ -456,6 +634,8 @@ class ClientPC(Base):
     bound_at = Column(DateTime, nullable=True)
     grace_until = Column(DateTime, nullable=True)
     suspended = Column(Boolean, default=False)
+    # The machine's pcs row (groups, game assignments); ids of the two tables are unrelated
+    pc_id = Column(Integer, ForeignKey("pcs.id"), nullable=True, unique=True, index=True)
 
     
     
@@ -468,6 +648,13 @@ class PasswordResetToken(Base):
     used = Column(Boolean, default=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
+class VersionCounter(Base):
+    """Named monotonic counters (catalog version etc.), bumped inside the writing transaction."""
+    __tablename__ = "version_counters"
+    name = Column(String, primary_key=True)
+    value = Column(Integer, default=0)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
 class Setting(Base):
     __tablename__ = "settings"
     id = Column(Integer, primary_key=True, index=True)
@@ -479,3 +666,6 @@ class Setting(Base):
     updated_by = Column(Integer, ForeignKey("users.id"), nullable=True)
     updated_at = Column(DateTime, default=datetime.utcnow)
     is_public = Column(Boolean, default=False)  # if true, can be read by clients
+    __table_args__ = (
+        Index("uq_settings_category_key", "category", "key", unique=True),
+    )
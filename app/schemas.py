@@ -1,5 +1,5 @@
 from pydantic import BaseModel
-from typing import Optional
+from typing import Any, Optional
 from datetime import datetime
 
 class UserBase(BaseModel):
@@ -166,10 +166,20 @@ class ChatMessageOut(ChatMessageIn):
     from_user_id: int
     timestamp: datetime
     read: bool
+    conversation_id: str | None = None
 
     class Config:
         from_attributes = True
 
+class ChatConversationOut(BaseModel):
+    conversation_id: str
+    unread_count: int
+    last_message_id: int | None = None
+    last_read_id: int = 0
+
+class ChatReadIn(BaseModel):
+    up_to_id: int | None = None
+
 class NotificationIn(BaseModel):
     user_id: int | None = None
     pc_id: int | None = None
@@ -184,6 +194,9 @@ class NotificationOut(NotificationIn):
     class Config:
         from_attributes = True
 
+class NotificationReadIn(BaseModel):
+    up_to_id: int | None = None
+
 class SupportTicketIn(BaseModel):
     pc_id: int | None = None
     issue: str
@@ -228,6 +241,22 @@ class HardwareStatOut(HardwareStatIn):
     class Config:
         from_attributes = True
 
+class HardwareLatestOut(HardwareStatIn):
+    id: int | None = None  # not yet assigned while the sample is still buffered
+    timestamp: datetime
+
+class HardwareSampleIn(BaseModel):
+    cpu_percent: float
+    ram_percent: float
+    disk_percent: float
+    gpu_percent: float | None = None
+    temp: float | None = None
+    timestamp: datetime | None = None  # sample time on the agent; server time if omitted
+
+class HardwareBatchIn(BaseModel):
+    pc_id: int
+    samples: list[HardwareSampleIn]
+
 class ClientUpdateIn(BaseModel):
     version: str
     description: str | None = None
@@ -268,6 +297,22 @@ class AuditLogOut(BaseModel):
     detail: str | None = None
     timestamp: datetime
     ip: str | None = None
+    category: str | None = None
+    pc_id: int | None = None
+    cafe_id: int | None = None
+    target_id: int | None = None
+
+    class Config:
+        from_attributes = True
+
+class AuditArchiveOut(BaseModel):
+    id: int
+    month: str
+    row_count: int
+    first_id: int
+    last_id: int
+    byte_size: int
+    created_at: datetime
 
     class Config:
         from_attributes = True
@@ -296,6 +341,14 @@ class BackupEntryOut(BaseModel):
     file_path: str
     created_at: datetime
     note: str | None = None
+    status: str | None = None
+    compression: str | None = None
+    byte_size: int | None = None
+    sha256: str | None = None
+    error: str | None = None
+    finished_at: datetime | None = None
+    kind: str | None = None
+    parent_id: int | None = None
 
     class Config:
         from_attributes = True
@@ -328,6 +381,23 @@ class WebhookOut(WebhookIn):
     class Config:
         from_attributes = True
 
+class WebhookDeliveryOut(BaseModel):
+    id: int
+    webhook_id: int
+    event_id: int
+    event: str
+    status: str
+    attempts: int
+    next_attempt_at: datetime | None = None
+    response_status: int | None = None
+    last_error: str | None = None
+    duration_ms: int | None = None
+    created_at: datetime
+    delivered_at: datetime | None = None
+
+    class Config:
+        from_attributes = True
+
 class MembershipPackageIn(BaseModel):
     name: str
     description: str | None = None
@@ -397,6 +467,7 @@ class ClientPCOut(ClientPCBase):
     bound_at: Optional[datetime] = None
     grace_until: Optional[datetime] = None
     suspended: bool | None = None
+    pc_id: Optional[int] = None
     class Config:
         from_attributes = True
 
@@ -448,6 +519,7 @@ class CouponRedemptionOut(BaseModel):
     coupon_id: int
     user_id: int
     timestamp: datetime
+    order_id: Optional[int] = None
     class Config:
         from_attributes = True
 
@@ -473,6 +545,10 @@ class LeaderboardEntryOut(BaseModel):
     class Config:
         from_attributes = True
 
+class LeaderboardArchiveOut(LeaderboardEntryOut):
+    rank: int
+    archived_at: datetime
+
 # Events
 class EventIn(BaseModel):
     name: str
@@ -553,6 +629,7 @@ class SettingUpdate(BaseModel):
 
 class SettingOut(SettingIn):
     id: int
+    value: Any  # parsed according to value_type
     updated_by: int | None = None
     updated_at: datetime
     is_public: bool
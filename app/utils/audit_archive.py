@@ -0,0 +1,187 @@
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app.database import SessionLocal
+from app.models import AuditLog, AuditArchive
+
+# Months kept in audit_logs (current month included); older months move to archive files
+HOT_MONTHS = int(os.getenv("AUDIT_HOT_MONTHS", "3"))
+ARCHIVE_DIR = os.getenv("AUDIT_ARCHIVE_DIR", "./audit_archive")
+ARCHIVE_CHUNK = int(os.getenv("AUDIT_ARCHIVE_CHUNK", "5000"))
+ARCHIVE_INTERVAL_SEC = int(os.getenv("AUDIT_ARCHIVE_INTERVAL_SEC", str(6 * 3600)))
+
+_COLUMNS = ("id", "user_id", "action", "detail", "timestamp", "ip", "category", "pc_id", "cafe_id", "target_id")
+
+
+def month_start(ts: datetime, months_back: int = 0) -> datetime:
+    index = ts.year * 12 + ts.month - 1 - months_back
+    return datetime(index // 12, index % 12 + 1, 1)
+
+
+def hot_cutoff(now: datetime | None = None) -> datetime:
+    """Rows older than this live in archive files."""
+    return month_start(now or datetime.utcnow(), HOT_MONTHS - 1)
+
+
+def _encode(row) -> str:
+    out = {c: getattr(row, c) for c in _COLUMNS}
+    out["timestamp"] = out["timestamp"].isoformat() if out["timestamp"] else None
+    return json.dumps(out, separators=(",", ":"))
+
+
+def _delete_archived(db, start: datetime, end: datetime, first_id: int, last_id: int) -> int:
+    deleted = 0
+    while True:
+        ids = [r[0] for r in db.query(AuditLog.id).filter(
+            AuditLog.id >= first_id, AuditLog.id <= last_id,
+            AuditLog.timestamp >= start, AuditLog.timestamp < end,
+        ).limit(ARCHIVE_CHUNK).all()]
+        if not ids:
+            return deleted
+        db.query(AuditLog).filter(AuditLog.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+
+
+def archive_month(db, start: datetime) -> AuditArchive | None:
+    """Move one month of rows into a gzip JSONL file, then drop them from audit_logs.
+
+    The manifest row is committed before rows are deleted, so a crash in between
+    only leaves rows that the next run deletes without writing them twice.
+    """
+    end = month_start(start, -1)
+    month = start.strftime("%Y-%m")
+    for arc in db.query(AuditArchive).filter(AuditArchive.month == month).all():
+        _delete_archived(db, start, end, arc.first_id, arc.last_id)
+    if not db.query(AuditLog.id).filter(AuditLog.timestamp >= start, AuditLog.timestamp < end).first():
+        return None
+    os.makedirs(ARCHIVE_DIR, exist_ok=True)
+    part = db.query(func.count(AuditArchive.id)).filter(AuditArchive.month == month).scalar() or 0
+    path = os.path.join(ARCHIVE_DIR, f"audit-{month}.{part}.jsonl.gz")
+    tmp = f"{path}.tmp"
+    count, first_id, last_id = 0, None, 0
+    with gzip.open(tmp, "wt", encoding="utf-8") as fh:
+        # Ascending id keyset so each chunk is an index range scan; plain tuples keep the session empty
+        while True:
+            rows = db.query(*[getattr(AuditLog, c) for c in _COLUMNS]).filter(
+                AuditLog.timestamp >= start, AuditLog.timestamp < end, AuditLog.id > last_id
+            ).order_by(AuditLog.id).limit(ARCHIVE_CHUNK).all()
+            if not rows:
+                break
+            for row in rows:
+                fh.write(_encode(row) + "\n")
+            count += len(rows)
+            first_id = rows[0].id if first_id is None else first_id
+            last_id = rows[-1].id
+    sha = hashlib.sha256()
+    with open(tmp, "rb") as fh:
+        for chunk in iter(lambda: fh.read(1024 * 1024), b""):
+            sha.update(chunk)
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    arc = AuditArchive(
+        month=month, path=path, row_count=count, first_id=first_id, last_id=last_id,
+        byte_size=os.path.getsize(path), sha256=sha.hexdigest(), created_at=datetime.utcnow(),
+    )
+    db.add(arc)
+    db.commit()
+    db.refresh(arc)
+    _delete_archived(db, start, end, first_id, last_id)
+    return arc
+
+
+def archive_old(db, now: datetime | None = None) -> list[AuditArchive]:
+    """Archive every whole month older than the hot window, oldest first."""
+    cutoff = hot_cutoff(now)
+    oldest = db.query(func.min(AuditLog.timestamp)).filter(AuditLog.timestamp < cutoff).scalar()
+    done = []
+    start = month_start(oldest) if oldest else cutoff
+    while start < cutoff:
+        arc = archive_month(db, start)
+        if arc is not None:
+            done.append(arc)
+        start = month_start(start, -1)
+    return done
+
+
+def _matches(row: dict, filters: dict) -> bool:
+    for key in ("category", "pc_id", "cafe_id", "target_id", "user_id"):
+        if filters.get(key) is not None and row.get(key) != filters[key]:
+            return False
+    if filters.get("user_ids") is not None and row.get("user_id") not in filters["user_ids"]:
+        return False
+    if filters.get("action_like") and filters["action_like"] not in (row.get("action") or "").lower():
+        return False
+    detail = (row.get("detail") or "").lower()
+    if any(term not in detail for term in filters.get("detail_like") or ()):
+        return False
+    ts = row.get("timestamp")
+    # A row without a timestamp is outside any time range (the SQL filter drops NULLs the same way)
+    if (filters.get("start") or filters.get("end")) and ts is None:
+        return False
+    if filters.get("start") and ts < filters["start"]:
+        return False
+    if filters.get("end") and ts > filters["end"]:
+        return False
+    text = filters.get("q")
+    if text:
+        haystack = f"{row.get('action') or ''} {row.get('detail') or ''}".lower()
+        if not all(term in haystack for term in text.lower().split()):
+            return False
+    return True
+
+
+def query_archives(db, filters: dict, cursor: int | None, limit: int) -> list[dict]:
+    """Newest-first matches from archive files; same id cursor as the hot table.
+
+    Files are streamed, keeping only the newest `limit` matches of each, so memory
+    stays bounded by the page size whatever the archive size.
+    """
+    q = db.query(AuditArchive)
+    if cursor:
+        q = q.filter(AuditArchive.first_id < cursor)
+    if filters.get("start"):
+        q = q.filter(AuditArchive.month >= filters["start"].strftime("%Y-%m"))
+    if filters.get("end"):
+        q = q.filter(AuditArchive.month <= filters["end"].strftime("%Y-%m"))
+    out: list[dict] = []
+    for arc in q.order_by(AuditArchive.last_id.desc()).all():
+        if not os.path.exists(arc.path):
+            continue
+        newest: deque = deque(maxlen=limit - len(out))
+        with gzip.open(arc.path, "rt", encoding="utf-8") as fh:
+            for line in fh:
+                row = json.loads(line)
+                if cursor and row["id"] >= cursor:
+                    break
+                row["timestamp"] = datetime.fromisoformat(row["timestamp"]) if row["timestamp"] else None
+                if _matches(row, filters):
+                    newest.append(row)
+        out.extend(reversed(newest))
+        if len(out) >= limit:
+            break
+    return out
+
+
+def _archive_once() -> None:
+    db = SessionLocal()
+    try:
+        archive_old(db)
+    finally:
+        db.close()
+
+
+async def archive_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_archive_once)
+        except Exception:
+            pass
+        await asyncio.sleep(ARCHIVE_INTERVAL_SEC)
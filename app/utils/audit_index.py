@@ -0,0 +1,140 @@
+import asyncio
+import os
+import re
+
+from sqlalchemy import text, update
+
+from app.database import SessionLocal
+from app.models import AuditLog, User
+
+BACKFILL_BATCH = int(os.getenv("AUDIT_BACKFILL_BATCH", "2000"))
+
+# Entity references written by log_action callers, e.g. "PC:12", "Booking:5", "Order:9 total:40"
+_REF = re.compile(r"\b([A-Z][A-Za-z]*):(\d+)\b")
+_CATEGORY_ALIASES = {"settings": "setting"}
+
+# "fts5", "tsvector" or None (falls back to LIKE)
+_search_mode: str | None = None
+
+
+def derive_fields(action: str | None, detail: str | None) -> dict:
+    """Structured columns for one event: category from the action prefix, ids from detail refs."""
+    category = re.split(r"[_:]", action or "", maxsplit=1)[0].lower() or "other"
+    category = _CATEGORY_ALIASES.get(category, category)
+    fields = {"category": category, "pc_id": None, "cafe_id": None, "target_id": None}
+    for kind, num in _REF.findall(detail or ""):
+        kind = kind.lower()
+        key = {"pc": "pc_id", "cafe": "cafe_id"}.get(kind, "target_id")
+        if fields[key] is None:
+            fields[key] = int(num)
+    return fields
+
+
+def cafe_ids_for(db, user_ids) -> dict[int, int]:
+    ids = {u for u in user_ids if u is not None}
+    if not ids:
+        return {}
+    return {uid: cafe for uid, cafe in db.query(User.id, User.cafe_id).filter(User.id.in_(ids)).all() if cafe is not None}
+
+
+def backfill(db) -> int:
+    """Fill structured columns of rows written before they existed, one batch per commit."""
+    total = 0
+    while True:
+        rows = db.query(AuditLog.id, AuditLog.user_id, AuditLog.action, AuditLog.detail).filter(
+            AuditLog.category.is_(None)
+        ).order_by(AuditLog.id).limit(BACKFILL_BATCH).all()
+        if not rows:
+            return total
+        cafes = cafe_ids_for(db, [r.user_id for r in rows])
+        params = []
+        for r in rows:
+            fields = derive_fields(r.action, r.detail)
+            if fields["cafe_id"] is None:
+                fields["cafe_id"] = cafes.get(r.user_id)
+            params.append({"id": r.id, **fields})
+        db.execute(update(AuditLog), params)
+        db.commit()
+        total += len(rows)
+
+
+def _backfill_once() -> int:
+    db = SessionLocal()
+    try:
+        return backfill(db)
+    finally:
+        db.close()
+
+
+async def backfill_task():
+    try:
+        await asyncio.to_thread(_backfill_once)
+    except Exception:
+        pass
+
+
+def ensure_search(engine) -> str | None:
+    """Create the full-text index for audit details if the backend supports one."""
+    global _search_mode
+    dialect = engine.dialect.name
+    with engine.connect() as conn:
+        if dialect == "sqlite":
+            exists = conn.execute(text(
+                "SELECT 1 FROM sqlite_master WHERE type='table' AND name='audit_logs_fts'"
+            )).first()
+            if not exists:
+                conn.execute(text(
+                    "CREATE VIRTUAL TABLE audit_logs_fts USING fts5("
+                    "action, detail, content='audit_logs', content_rowid='id')"
+                ))
+                conn.execute(text("INSERT INTO audit_logs_fts(audit_logs_fts) VALUES('rebuild')"))
+            # External-content table: keep it in step with audit_logs
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS audit_logs_fts_ai AFTER INSERT ON audit_logs BEGIN "
+                "INSERT INTO audit_logs_fts(rowid, action, detail) VALUES (new.id, new.action, new.detail); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS audit_logs_fts_ad AFTER DELETE ON audit_logs BEGIN "
+                "INSERT INTO audit_logs_fts(audit_logs_fts, rowid, action, detail) "
+                "VALUES ('delete', old.id, old.action, old.detail); END"
+            ))
+            conn.execute(text(
+                "CREATE TRIGGER IF NOT EXISTS audit_logs_fts_au AFTER UPDATE OF action, detail ON audit_logs BEGIN "
+                "INSERT INTO audit_logs_fts(audit_logs_fts, rowid, action, detail) "
+                "VALUES ('delete', old.id, old.action, old.detail); "
+                "INSERT INTO audit_logs_fts(rowid, action, detail) VALUES (new.id, new.action, new.detail); END"
+            ))
+            conn.commit()
+            _search_mode = "fts5"
+        elif dialect == "postgresql":
+            conn.execute(text(
+                "ALTER TABLE audit_logs ADD COLUMN IF NOT EXISTS search_tsv tsvector "
+                "GENERATED ALWAYS AS (to_tsvector('simple', coalesce(action, '') || ' ' || coalesce(detail, ''))) STORED"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_audit_logs_search_tsv ON audit_logs USING GIN (search_tsv)"
+            ))
+            conn.commit()
+            _search_mode = "tsvector"
+    return _search_mode
+
+
+def _fts5_query(q: str) -> str:
+    # Quote every term so user input is never parsed as FTS5 syntax; last term matches as a prefix
+    terms = ['"' + t.replace('"', '""') + '"' for t in q.split()]
+    if terms:
+        terms[-1] += "*"
+    return " ".join(terms)
+
+
+def apply_search(query, q: str):
+    """Restrict an AuditLog query to rows whose action/detail match the search text."""
+    if not q.strip():
+        return query
+    if _search_mode == "fts5":
+        return query.filter(text(
+            "audit_logs.id IN (SELECT rowid FROM audit_logs_fts WHERE audit_logs_fts MATCH :audit_q)"
+        )).params(audit_q=_fts5_query(q))
+    if _search_mode == "tsvector":
+        return query.filter(text("audit_logs.search_tsv @@ plainto_tsquery('simple', :audit_q)")).params(audit_q=q)
+    return query.filter(AuditLog.detail.ilike(f"%{q}%"))
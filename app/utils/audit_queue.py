@@ -0,0 +1,247 @@
+import asyncio
+import glob
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from sqlalchemy import insert
+
+from app.database import SessionLocal
+from app.models import AuditLog
+from app.utils.audit_index import derive_fields, cafe_ids_for
+
+# Flush when this many events are queued, or after this many ms, whichever comes first
+FLUSH_MAX_ROWS = int(os.getenv("AUDIT_FLUSH_ROWS", "200"))
+FLUSH_MAX_MS = int(os.getenv("AUDIT_FLUSH_MS", "1000"))
+# Upper bound kept in memory while the DB is unavailable; oldest events are dropped first
+MAX_QUEUED = int(os.getenv("AUDIT_MAX_QUEUED", "100000"))
+# Events that could not be written at shutdown are appended here and replayed on startup
+SPOOL_PATH = os.getenv("AUDIT_SPOOL_PATH", "./audit_spool.jsonl")
+# A claimed spool file untouched this long belongs to a worker that died mid-replay
+SPOOL_ORPHAN_SEC = int(os.getenv("AUDIT_SPOOL_ORPHAN_SEC", "600"))
+
+_queue: deque = deque()
+_lock = threading.Lock()
+_loop: asyncio.AbstractEventLoop | None = None
+_wakeup: asyncio.Event | None = None
+_stats = {
+    "enqueued": 0,
+    "written": 0,
+    "dropped": 0,
+    "spooled": 0,
+    "replayed": 0,
+    "failed_flushes": 0,
+    "high_water": 0,
+}
+_last_flush_ts = time.monotonic()
+
+
+def enqueue(user_id, action, detail, ip=None, timestamp: datetime | None = None, **fields) -> None:
+    """Queue one audit event; never touches the caller's DB session.
+
+    category/pc_id/cafe_id/target_id are derived from action and detail unless given.
+    """
+    row = {
+        "user_id": user_id,
+        "action": action,
+        "detail": detail,
+        "ip": ip,
+        "timestamp": timestamp or datetime.utcnow(),
+        **derive_fields(action, detail),
+    }
+    row.update({k: v for k, v in fields.items() if v is not None})
+    with _lock:
+        _queue.append(row)
+        _stats["enqueued"] += 1
+        if len(_queue) > MAX_QUEUED:
+            _queue.popleft()
+            _stats["dropped"] += 1
+        depth = len(_queue)
+        _stats["high_water"] = max(_stats["high_water"], depth)
+    if depth >= FLUSH_MAX_ROWS:
+        _request_flush()
+
+
+def _request_flush() -> None:
+    if _loop is not None and _wakeup is not None and _loop.is_running():
+        _loop.call_soon_threadsafe(_wakeup.set)
+    else:
+        # No background loop (scripts, CLI): write inline; failed rows stay queued
+        try:
+            flush()
+        except Exception:
+            pass
+
+
+def _drain() -> list[dict]:
+    with _lock:
+        rows = list(_queue)
+        _queue.clear()
+        return rows
+
+
+def _requeue(rows: list[dict]) -> None:
+    with _lock:
+        _queue.extendleft(reversed(rows))
+        while len(_queue) > MAX_QUEUED:
+            _queue.popleft()
+            _stats["dropped"] += 1
+
+
+def _insert(db, rows: list[dict]) -> None:
+    missing = [r["user_id"] for r in rows if r.get("cafe_id") is None and r["user_id"] is not None]
+    if missing:
+        cafes = cafe_ids_for(db, missing)
+        for r in rows:
+            if r.get("cafe_id") is None:
+                r["cafe_id"] = cafes.get(r["user_id"])
+    db.execute(insert(AuditLog), rows)
+    db.commit()
+
+
+def flush(db=None) -> int:
+    """Write every queued event with a single multi-row INSERT."""
+    global _last_flush_ts
+    with _lock:
+        if not _queue:
+            return 0
+    own = db is None
+    db = db or SessionLocal()
+    rows = _drain()
+    try:
+        _insert(db, rows)
+        with _lock:
+            _stats["written"] += len(rows)
+        _last_flush_ts = time.monotonic()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        _requeue(rows)
+        with _lock:
+            _stats["failed_flushes"] += 1
+        raise
+    finally:
+        if own:
+            db.close()
+
+
+def stats() -> dict:
+    with _lock:
+        out = dict(_stats, depth=len(_queue))
+    out["seconds_since_flush"] = round(time.monotonic() - _last_flush_ts, 3)
+    out["spool_pending"] = os.path.exists(SPOOL_PATH) or bool(glob.glob(f"{glob.escape(SPOOL_PATH)}.*.replaying"))
+    return out
+
+
+def _spool(rows: list[dict]) -> None:
+    if not rows:
+        return
+    with open(SPOOL_PATH, "a", encoding="utf-8") as fh:
+        for row in rows:
+            fh.write(json.dumps({**row, "timestamp": row["timestamp"].isoformat()}) + "\n")
+        fh.flush()
+        os.fsync(fh.fileno())
+    with _lock:
+        _stats["spooled"] += len(rows)
+
+
+def _claimed_path() -> str:
+    return f"{SPOOL_PATH}.{os.getpid()}.replaying"
+
+
+def _claim() -> str | None:
+    """Take ownership of a spool file by renaming it to this worker's name; None if there is none."""
+    claimed = _claimed_path()
+    if os.path.exists(claimed):
+        # An earlier replay in this worker failed; retry the same file
+        os.utime(claimed)
+        return claimed
+    now = time.time()
+    candidates = [SPOOL_PATH]
+    for path in glob.glob(f"{glob.escape(SPOOL_PATH)}.*.replaying"):
+        try:
+            if now - os.path.getmtime(path) > SPOOL_ORPHAN_SEC:
+                candidates.append(path)
+        except OSError:
+            continue
+    for path in candidates:
+        try:
+            # Atomic: of several workers starting together exactly one gets each file
+            os.replace(path, claimed)
+            return claimed
+        except FileNotFoundError:
+            continue
+    return None
+
+
+def replay_spool() -> int:
+    """Write events spooled by a previous shutdown; the file is deleted only once they are committed."""
+    claimed = _claim()
+    if claimed is None:
+        return 0
+    rows = []
+    with open(claimed, encoding="utf-8") as fh:
+        for line in fh:
+            try:
+                row = json.loads(line)
+                row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+                if "category" not in row:
+                    row.update(derive_fields(row.get("action"), row.get("detail")))
+                rows.append(row)
+            except (ValueError, KeyError):
+                continue
+    if rows:
+        db = SessionLocal()
+        try:
+            _insert(db, rows)
+        except Exception:
+            # Leave the claimed file in place; flush_loop retries it
+            db.rollback()
+            raise
+        finally:
+            db.close()
+    os.remove(claimed)
+    with _lock:
+        _stats["replayed"] += len(rows)
+        _stats["written"] += len(rows)
+    return len(rows)
+
+
+async def flush_loop():
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    try:
+        await asyncio.to_thread(replay_spool)
+    except Exception:
+        pass
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=FLUSH_MAX_MS / 1000.0)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await asyncio.to_thread(flush)
+        except Exception:
+            pass
+        if os.path.exists(_claimed_path()):
+            try:
+                await asyncio.to_thread(replay_spool)
+            except Exception:
+                pass
+
+
+def flush_on_shutdown() -> None:
+    """Last flush; whatever the DB refuses goes to the spool file."""
+    try:
+        flush()
+    except Exception:
+        pass
+    try:
+        _spool(_drain())
+    except Exception:
+        pass
@@ -0,0 +1,610 @@
+import asyncio
+import gzip
+import hashlib
+import os
+import sqlite3
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import create_engine
+from sqlalchemy import event as sa_event
+from sqlalchemy import exc as sa_exc
+from sqlalchemy.engine import make_url
+
+from app.database import SQLALCHEMY_DATABASE_URL, SessionLocal, engine
+from app.models import BackupEntry, ChatSummary, VersionCounter
+from app.utils import versions
+
+BACKUP_DIR = os.getenv("BACKUP_DIR", "./backups")
+# SQLite pages copied per step; the source is only locked while a step runs
+BACKUP_STEP_PAGES = int(os.getenv("BACKUP_STEP_PAGES", "1024"))
+BACKUP_STEP_SLEEP = float(os.getenv("BACKUP_STEP_SLEEP", "0.01"))
+GZIP_LEVEL = int(os.getenv("BACKUP_GZIP_LEVEL", "6"))
+CHUNK_SIZE = 1024 * 1024
+
+# Schedule: incrementals this often (0 disables the scheduler), a full backup at least this often
+INCREMENTAL_MINUTES = int(os.getenv("BACKUP_INCREMENTAL_MINUTES", "15"))
+FULL_HOURS = int(os.getenv("BACKUP_FULL_HOURS", "24"))
+# Backup chains (a full plus its incrementals) older than this are deleted; the newest full is always kept
+KEEP_DAYS = int(os.getenv("BACKUP_KEEP_DAYS", "7"))
+# A pending/running entry older than this belongs to a worker that died mid-backup and no longer blocks new runs
+STALE_HOURS = float(os.getenv("BACKUP_STALE_HOURS", "6"))
+# How long any worker holds new DB checkouts while another one swaps the file in
+RESTORE_WAIT_SEC = float(os.getenv("BACKUP_RESTORE_WAIT_SEC", "30"))
+
+_URL = make_url(SQLALCHEMY_DATABASE_URL)
+BACKEND = _URL.get_backend_name()
+# Live database file for SQLite, derived from DATABASE_URL instead of assuming ./lance.db
+DB_PATH = _URL.database if BACKEND == "sqlite" else None
+# Present while a restore is swapping the file; every worker's checkouts wait for it to go away
+RESTORE_MARKER = f"{DB_PATH}.restoring" if DB_PATH else None
+
+# Incremental file: magic, page size, page count of the new image, then (page number, page) records
+DELTA_MAGIC = b"PRIMUSDELTA1"
+_DELTA_HEADER = struct.Struct(">IQ")
+_PAGE_NO = struct.Struct(">Q")
+_DIGEST_SIZE = 16
+
+
+class BackupBusy(Exception):
+    pass
+
+
+class RestoreError(Exception):
+    pass
+
+
+# backup id -> live progress of a running job
+_progress: dict[int, dict] = {}
+_lock = threading.Lock()
+_running: int | None = None
+# Inode of the live file this worker has caught up with; a new one means another worker restored
+_seen_inode: int | None = None
+
+
+def progress(backup_id: int) -> dict | None:
+    with _lock:
+        p = _progress.get(backup_id)
+        return dict(p) if p else None
+
+
+def _set_progress(backup_id: int, **fields) -> None:
+    with _lock:
+        _progress.setdefault(backup_id, {}).update(fields)
+
+
+def file_sha256(path: str) -> str:
+    sha = hashlib.sha256()
+    with open(path, "rb") as fh:
+        for chunk in iter(lambda: fh.read(CHUNK_SIZE), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def pagemap_path(backup_path: str) -> str:
+    """Sidecar with one digest per page of a backup's image; incrementals diff against it."""
+    return backup_path + ".pages"
+
+
+def _read_pagemap(path: str) -> tuple[int, bytes] | None:
+    try:
+        with open(pagemap_path(path), "rb") as fh:
+            data = fh.read()
+    except OSError:
+        return None
+    return struct.unpack(">I", data[:4])[0], data[4:]
+
+
+def _sqlite_snapshot(backup_id: int, target: str) -> None:
+    """Consistent copy of the live DB via the online backup API, a few pages at a time."""
+    def _step(status, remaining, total):
+        _set_progress(backup_id, phase="copy", progress=round(1 - remaining / total, 4) if total else 1.0)
+
+    src = sqlite3.connect(DB_PATH)
+    dst = sqlite3.connect(target)
+    try:
+        src.backup(dst, pages=BACKUP_STEP_PAGES, progress=_step, sleep=BACKUP_STEP_SLEEP)
+    finally:
+        dst.close()
+        src.close()
+
+
+def _page_size(path: str) -> int:
+    con = sqlite3.connect(path)
+    try:
+        return con.execute("PRAGMA page_size").fetchone()[0]
+    finally:
+        con.close()
+
+
+def _sqlite_pages(backup_id: int, snap: str, target: str, parent_map: bytes | None) -> dict:
+    """Compress a snapshot into `target`: every page for a full, only changed pages for an incremental."""
+    page_size = _page_size(snap)
+    total = os.path.getsize(snap)
+    page_count = total // page_size
+    digests = bytearray(struct.pack(">I", page_size))
+    image = hashlib.sha256()
+    changed = 0
+    with open(snap, "rb") as src, open(target, "wb") as raw:
+        with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL) as gz:
+            if parent_map is not None:
+                gz.write(DELTA_MAGIC + _DELTA_HEADER.pack(page_size, page_count))
+            for no in range(page_count):
+                page = src.read(page_size)
+                image.update(page)
+                digest = hashlib.blake2b(page, digest_size=_DIGEST_SIZE).digest()
+                digests += digest
+                if parent_map is None:
+                    gz.write(page)
+                elif parent_map[no * _DIGEST_SIZE:(no + 1) * _DIGEST_SIZE] != digest:
+                    gz.write(_PAGE_NO.pack(no) + page)
+                    changed += 1
+                if no % 256 == 0:
+                    _set_progress(backup_id, phase="compress", bytes_in=no * page_size,
+                                  progress=round(no / page_count, 4) if page_count else 1.0)
+        raw.flush()
+        os.fsync(raw.fileno())
+    return {
+        "byte_size": os.path.getsize(target),
+        "sha256": file_sha256(target),
+        "image_sha256": image.hexdigest(),
+        "pagemap": bytes(digests),
+        "changed_pages": changed if parent_map is not None else page_count,
+    }
+
+
+def _pg_dump(backup_id: int, target: str) -> dict:
+    url = _URL.set(drivername="postgresql", password=None)
+    env = dict(os.environ)
+    if _URL.password:
+        # Keep the password out of the process list
+        env["PGPASSWORD"] = _URL.password
+    proc = subprocess.Popen(
+        ["pg_dump", "--no-owner", "--no-privileges", url.render_as_string(hide_password=False)],
+        stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=env,
+    )
+    read = 0
+    try:
+        with open(target, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=GZIP_LEVEL) as gz:
+                for chunk in iter(lambda: proc.stdout.read(CHUNK_SIZE), b""):
+                    gz.write(chunk)
+                    read += len(chunk)
+                    _set_progress(backup_id, phase="dump", bytes_in=read, progress=None)
+            raw.flush()
+            os.fsync(raw.fileno())
+    finally:
+        proc.stdout.close()
+    err = proc.stderr.read().decode(errors="replace")
+    if proc.wait() != 0:
+        raise RuntimeError(f"pg_dump failed: {err.strip()[:500]}")
+    return {"byte_size": os.path.getsize(target), "sha256": file_sha256(target)}
+
+
+def _run(backup_id: int, target: str, parent_path: str | None) -> dict:
+    if BACKEND == "sqlite":
+        fd, snap = tempfile.mkstemp(prefix=".snapshot-", suffix=".db", dir=BACKUP_DIR)
+        os.close(fd)
+        try:
+            _sqlite_snapshot(backup_id, snap)
+            parent_map = None
+            if parent_path:
+                parent = _read_pagemap(parent_path)
+                if parent is None or parent[0] != _page_size(snap):
+                    raise RuntimeError("Parent backup page map is missing or incompatible")
+                parent_map = parent[1]
+            return _sqlite_pages(backup_id, snap, target, parent_map)
+        finally:
+            os.remove(snap)
+    if BACKEND == "postgresql":
+        return _pg_dump(backup_id, target)
+    raise RuntimeError(f"Backups are not supported for {BACKEND}")
+
+
+def _job(backup_id: int, target: str, parent_path: str | None) -> None:
+    global _running
+    tmp = f"{target}.part"
+    started = time.monotonic()
+    db = SessionLocal()
+    try:
+        entry = db.get(BackupEntry, backup_id)
+        entry.status = "running"
+        db.commit()
+        try:
+            result = _run(backup_id, tmp, parent_path)
+            if "pagemap" in result:
+                with open(pagemap_path(target), "wb") as fh:
+                    fh.write(result["pagemap"])
+            os.replace(tmp, target)
+            entry.status = "done"
+            entry.byte_size, entry.sha256 = result["byte_size"], result["sha256"]
+            entry.image_sha256 = result.get("image_sha256")
+            _set_progress(backup_id, changed_pages=result.get("changed_pages"))
+        except Exception as e:
+            for leftover in (tmp, pagemap_path(target)):
+                try:
+                    os.remove(leftover)
+                except OSError:
+                    pass
+            entry.status, entry.error = "failed", str(e)[:1000]
+        entry.finished_at = datetime.utcnow()
+        db.commit()
+        _set_progress(backup_id, phase=entry.status, progress=1.0 if entry.status == "done" else None,
+                      seconds=round(time.monotonic() - started, 3))
+    finally:
+        db.close()
+        with _lock:
+            _running = None
+
+
+def _latest_parent(db) -> BackupEntry | None:
+    """Newest finished SQLite backup that still has its page map on disk."""
+    for entry in db.query(BackupEntry).filter(
+        BackupEntry.status == "done", BackupEntry.compression == "gzip"
+    ).order_by(BackupEntry.id.desc()).limit(20).populate_existing():
+        if entry.image_sha256 and os.path.exists(pagemap_path(entry.file_path)):
+            return entry
+    return None
+
+
+def _active(db, now: datetime, before_id: int | None = None) -> BackupEntry | None:
+    """Oldest pending/running entry from any worker; abandoned ones are marked failed on the way."""
+    stale = now - timedelta(hours=STALE_HOURS)
+    db.query(BackupEntry).filter(
+        BackupEntry.status.in_(("pending", "running")), BackupEntry.created_at < stale
+    ).update({"status": "failed", "error": "Abandoned", "finished_at": now}, synchronize_session=False)
+    q = db.query(BackupEntry).filter(BackupEntry.status.in_(("pending", "running")))
+    if before_id is not None:
+        q = q.filter(BackupEntry.id < before_id)
+    return q.order_by(BackupEntry.id).first()
+
+
+def start_backup(db, backup_type: str = "manual", note: str | None = None, kind: str = "full") -> BackupEntry:
+    """Record a pending backup and run it on a background thread. One job at a time across all workers.
+
+    The pending row is the claim: after committing it, the lowest pending/running id wins and any
+    later one is dropped again. An incremental falls back to a full backup when there is nothing
+    to diff against.
+    """
+    global _running
+    with _lock:
+        if _running is not None:
+            raise BackupBusy(f"Backup {_running} is still running")
+        busy = _active(db, datetime.utcnow())
+        db.commit()
+        if busy is not None:
+            raise BackupBusy(f"Backup {busy.id} is still {busy.status}")
+        parent = _latest_parent(db) if kind == "incremental" and BACKEND == "sqlite" else None
+        kind = "incremental" if parent is not None else "full"
+        os.makedirs(BACKUP_DIR, exist_ok=True)
+        now = datetime.utcnow()
+        ext = ("db.gz" if kind == "full" else "delta.gz") if BACKEND == "sqlite" else "sql.gz"
+        entry = BackupEntry(
+            backup_type=backup_type,
+            file_path=os.path.join(BACKUP_DIR, f"lance_backup_{now.strftime('%Y%m%d-%H%M%S-%f')}.{ext}"),
+            created_at=now,
+            note=note,
+            status="pending",
+            compression="gzip",
+            kind=kind,
+            parent_id=parent.id if parent else None,
+        )
+        db.add(entry)
+        db.commit()
+        # Another worker may have inserted its own claim between the check above and this commit
+        earlier = _active(db, now, before_id=entry.id)
+        if earlier is not None:
+            db.delete(entry)
+            db.commit()
+            raise BackupBusy(f"Backup {earlier.id} is still {earlier.status}")
+        db.refresh(entry)
+        _running = entry.id
+        _progress[entry.id] = {"phase": "pending", "progress": 0.0}
+    threading.Thread(
+        target=_job, args=(entry.id, entry.file_path, parent.file_path if parent else None),
+        daemon=True, name=f"backup-{entry.id}",
+    ).start()
+    return entry
+
+
+def open_backup(entry):
+    """Binary reader over the plain database image of a full backup."""
+    if entry.compression == "gzip":
+        return gzip.open(entry.file_path, "rb")
+    return open(entry.file_path, "rb")
+
+
+def chain_for(db, entry) -> list[BackupEntry]:
+    """The full backup an entry builds on, followed by each incremental up to the entry."""
+    chain = [entry]
+    while chain[0].parent_id is not None:
+        parent = db.get(BackupEntry, chain[0].parent_id)
+        if parent is None:
+            raise RestoreError(f"Backup {chain[0].id} is missing its parent {chain[0].parent_id}")
+        chain.insert(0, parent)
+    return chain
+
+
+def _apply_delta(path: str, out) -> None:
+    with gzip.open(path, "rb") as delta:
+        header = delta.read(len(DELTA_MAGIC) + _DELTA_HEADER.size)
+        if not header.startswith(DELTA_MAGIC):
+            raise RestoreError(f"{os.path.basename(path)} is not an incremental backup")
+        page_size, page_count = _DELTA_HEADER.unpack(header[len(DELTA_MAGIC):])
+        while True:
+            head = delta.read(_PAGE_NO.size)
+            if not head:
+                break
+            (no,) = _PAGE_NO.unpack(head)
+            out.seek(no * page_size)
+            out.write(delta.read(page_size))
+        out.truncate(page_count * page_size)
+
+
+def materialize(db, entry, target: str) -> None:
+    """Rebuild the database image of `entry` at `target`, verifying every checksum on the way."""
+    chain = chain_for(db, entry)
+    for item in chain:
+        if item.status not in (None, "done"):
+            raise RestoreError(f"Backup {item.id} is {item.status}")
+        if not os.path.exists(item.file_path):
+            raise RestoreError(f"Backup file for {item.id} is missing")
+        if item.sha256 and file_sha256(item.file_path) != item.sha256:
+            raise RestoreError(f"Checksum mismatch for backup {item.id}")
+    with open(target, "wb") as out, open_backup(chain[0]) as src:
+        for chunk in iter(lambda: src.read(CHUNK_SIZE), b""):
+            out.write(chunk)
+    with open(target, "r+b") as out:
+        for item in chain[1:]:
+            _apply_delta(item.file_path, out)
+        out.flush()
+        os.fsync(out.fileno())
+    if entry.image_sha256 and file_sha256(target) != entry.image_sha256:
+        raise RestoreError("Rebuilt database does not match the backup image checksum")
+    con = sqlite3.connect(target)
+    try:
+        result = con.execute("PRAGMA integrity_check").fetchone()[0]
+    finally:
+        con.close()
+    if result != "ok":
+        raise RestoreError(f"Integrity check failed: {result}")
+
+
+def _rewarm() -> None:
+    """Drop in-memory/shared caches that mirror the old database. Runs in every worker."""
+    from app.utils import hardware_latest, screenshots, game_search, notifications
+
+    hardware_latest.reset()
+    screenshots.reset_latest()
+    game_search.reset()
+    notifications.invalidate_all()
+
+
+def _rebuild_derived() -> None:
+    """Recompute tables derived from others in the restored file; runs once, in the restoring worker."""
+    from app.utils import audit_index, chat
+
+    # Backups taken before the summaries existed have no table for them
+    ChatSummary.__table__.create(bind=engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        chat.rebuild_summaries(db)
+    finally:
+        db.close()
+    # Audit rows from before the structured columns get them filled in the background, as at startup
+    threading.Thread(target=audit_index._backfill_once, daemon=True, name="restore-audit-backfill").start()
+
+
+def _file_inode() -> int | None:
+    try:
+        return os.stat(DB_PATH).st_ino
+    except OSError:
+        return None
+
+
+def _wait_for_restore() -> None:
+    deadline = time.monotonic() + RESTORE_WAIT_SEC
+    while time.monotonic() < deadline:
+        try:
+            # A marker older than the wait is left over from a restore that crashed
+            if time.time() - os.path.getmtime(RESTORE_MARKER) > RESTORE_WAIT_SEC:
+                return
+        except OSError:
+            return
+        time.sleep(0.05)
+
+
+def _on_connect(dbapi_conn, record) -> None:
+    record.info["inode"] = _file_inode()
+
+
+def _on_checkout(dbapi_conn, record, proxy) -> None:
+    """Hold checkouts during a swap and retire connections still open on a replaced file.
+
+    engine.dispose() only reaches the restoring worker's idle connections; this makes every
+    worker, including its audit/telemetry/webhook writers, reconnect to the restored file.
+    """
+    global _seen_inode
+    if os.path.exists(RESTORE_MARKER):
+        _wait_for_restore()
+    inode = _file_inode()
+    if record.info.setdefault("inode", inode) == inode:
+        return
+    with _lock:
+        changed, _seen_inode = _seen_inode != inode, inode
+    if changed:
+        # Off this thread: the caller may be holding a lock that _rewarm needs
+        threading.Thread(target=_rewarm, daemon=True, name="restore-rewarm").start()
+    raise sa_exc.DisconnectionError("Database file was replaced by a restore")
+
+
+if BACKEND == "sqlite":
+    _seen_inode = _file_inode()
+    sa_event.listen(engine, "connect", _on_connect)
+    sa_event.listen(engine, "checkout", _on_checkout)
+
+
+def _upgrade_image(path: str) -> None:
+    """Migrate a restored image to the current schema before it replaces the live file.
+
+    Backups taken before a column or table was added would otherwise come back without it.
+    """
+    from app.utils import schema
+
+    image = create_engine(f"sqlite:///{path}")
+    try:
+        schema.upgrade(image, strict=True)
+    except Exception as e:
+        raise RestoreError(f"Backup could not be upgraded to the current schema: {e}")
+    finally:
+        image.dispose()
+
+
+def restore(db, entry) -> None:
+    """Verify and rebuild next to the live DB, quiesce every worker's pool, then swap the file atomically."""
+    global _seen_inode
+    if BACKEND != "sqlite":
+        raise RestoreError("Restore is only supported for SQLite; use pg_restore/psql for Postgres dumps")
+    directory = os.path.dirname(os.path.abspath(DB_PATH))
+    fd, tmp = tempfile.mkstemp(prefix=".restore-", suffix=".db", dir=directory)
+    os.close(fd)
+    try:
+        materialize(db, entry, tmp)
+        _upgrade_image(tmp)
+        # The backup catalog lives in the database being replaced; carry it over
+        catalog = [
+            {c.name: getattr(b, c.name) for c in BackupEntry.__table__.columns}
+            for b in db.query(BackupEntry).all()
+        ]
+        counters = versions.snapshot(db)
+        # Pooled connections keep the old inode open; close them so the next checkout sees the new file.
+        # The marker holds new checkouts in every worker until the swap is done.
+        db.close()
+        with open(RESTORE_MARKER, "w") as fh:
+            fh.write(str(os.getpid()))
+        try:
+            engine.dispose()
+            os.replace(tmp, DB_PATH)
+            for suffix in ("-wal", "-shm", "-journal"):
+                try:
+                    os.remove(DB_PATH + suffix)
+                except OSError:
+                    pass
+            engine.dispose()
+            with _lock:
+                _seen_inode = _file_inode()
+        finally:
+            os.remove(RESTORE_MARKER)
+    except BaseException:
+        try:
+            os.remove(tmp)
+        except OSError:
+            pass
+        raise
+    _merge_catalog(catalog)
+    _carry_versions(counters)
+    _rebuild_derived()
+    _rewarm()
+
+
+def _carry_versions(counters: dict) -> None:
+    # Backups taken before the counters existed have no table for them
+    VersionCounter.__table__.create(bind=engine, checkfirst=True)
+    db = SessionLocal()
+    try:
+        versions.carry_over(db, counters)
+    finally:
+        db.close()
+
+
+def _merge_catalog(catalog: list[dict]) -> None:
+    db = SessionLocal()
+    try:
+        known = {i for (i,) in db.query(BackupEntry.id).all()}
+        for row in catalog:
+            if row["id"] in known:
+                db.query(BackupEntry).filter(BackupEntry.id == row["id"]).update(row)
+            else:
+                db.add(BackupEntry(**row))
+        db.commit()
+    finally:
+        db.close()
+
+
+def _delete_entry(db, entry) -> None:
+    for path in (entry.file_path, pagemap_path(entry.file_path)):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+    db.delete(entry)
+
+
+def apply_retention(db, now: datetime | None = None) -> int:
+    """Delete chains whose full backup is older than KEEP_DAYS, newest first within each chain.
+
+    Manual full backups are kept; only their incrementals are pruned.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=KEEP_DAYS)
+    entries = db.query(BackupEntry).filter(BackupEntry.status.in_(("done", "failed"))).all()
+    by_id = {e.id: e for e in entries}
+    fulls = sorted((e for e in entries if e.parent_id is None and e.status == "done"), key=lambda e: e.id)
+    newest_full = fulls[-1].id if fulls else None
+
+    def _root(e):
+        while e.parent_id is not None and e.parent_id in by_id:
+            e = by_id[e.parent_id]
+        return e
+
+    removed = 0
+    for e in sorted(entries, key=lambda e: e.id, reverse=True):
+        if e.status == "failed":
+            if e.created_at < cutoff:
+                _delete_entry(db, e)
+                removed += 1
+            continue
+        root = _root(e)
+        if root.id == newest_full or root.created_at >= cutoff:
+            continue
+        if e.parent_id is None and e.backup_type == "manual":
+            continue
+        _delete_entry(db, e)
+        removed += 1
+    db.commit()
+    return removed
+
+
+def _scheduled_tick(now: datetime | None = None) -> None:
+    now = now or datetime.utcnow()
+    db = SessionLocal()
+    try:
+        last = db.query(BackupEntry).filter(BackupEntry.status == "done").order_by(BackupEntry.id.desc()).first()
+        last_full = db.query(BackupEntry).filter(
+            BackupEntry.status == "done", BackupEntry.parent_id.is_(None)
+        ).order_by(BackupEntry.id.desc()).first()
+        try:
+            if last_full is None or last_full.created_at <= now - timedelta(hours=FULL_HOURS):
+                start_backup(db, "scheduled", None, "full")
+            elif BACKEND == "sqlite" and last.created_at <= now - timedelta(minutes=INCREMENTAL_MINUTES):
+                start_backup(db, "scheduled", None, "incremental")
+        except BackupBusy:
+            pass
+        apply_retention(db, now)
+    finally:
+        db.close()
+
+
+async def schedule_loop():
+    if INCREMENTAL_MINUTES <= 0:
+        return
+    while True:
+        await asyncio.sleep(60)
+        try:
+            await asyncio.to_thread(_scheduled_tick)
+        except Exception:
+            pass
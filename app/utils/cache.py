@@ -0,0 +1,124 @@
+import os
+import threading
+import time
+from typing import Any, Optional
+
+try:
+    from redis import Redis  # type: ignore
+except Exception:  # pragma: no cover
+    Redis = None  # type: ignore
+
+REDIS_URL = os.getenv("REDIS_URL", "redis://127.0.0.1:6379/0")
+CACHE_PREFIX = os.getenv("CACHE_PREFIX", "primus:")
+
+_cache: Optional[Any] = None
+_cache_lock = threading.Lock()
+
+
+class _InMemoryCache:
+    """Process-local stand-in for the subset of the Redis API used by the app."""
+
+    def __init__(self) -> None:
+        self._values: dict[str, tuple[Any, float | None]] = {}
+        self._lock = threading.Lock()
+
+    def _alive(self, key: str):
+        item = self._values.get(key)
+        if not item:
+            return None
+        value, exp = item
+        if exp is not None and time.time() > exp:
+            self._values.pop(key, None)
+            return None
+        return value
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._alive(key)
+            return value if isinstance(value, str) else None
+
+    def set(self, key: str, value: str, ex: int | None = None, nx: bool = False) -> bool:
+        with self._lock:
+            if nx and self._alive(key) is not None:
+                return False
+            self._values[key] = (str(value), time.time() + ex if ex else None)
+            return True
+
+    def delete(self, *keys: str) -> int:
+        with self._lock:
+            return sum(1 for k in keys if self._values.pop(k, None) is not None)
+
+    def incr(self, key: str, amount: int = 1) -> int:
+        with self._lock:
+            current = int(self._alive(key) or 0) + amount
+            exp = self._values.get(key, (None, None))[1]
+            self._values[key] = (str(current), exp)
+            return current
+
+    def hset(self, name: str, key: str | None = None, value: str | None = None, mapping: dict | None = None) -> int:
+        with self._lock:
+            h = self._alive(name)
+            if not isinstance(h, dict):
+                h = {}
+                self._values[name] = (h, None)
+            items = dict(mapping or {})
+            if key is not None:
+                items[key] = value
+            added = sum(1 for k in items if str(k) not in h)
+            h.update({str(k): str(v) for k, v in items.items()})
+            return added
+
+    def hget(self, name: str, key: str) -> Optional[str]:
+        with self._lock:
+            h = self._alive(name)
+            return h.get(str(key)) if isinstance(h, dict) else None
+
+    def hgetall(self, name: str) -> dict:
+        with self._lock:
+            h = self._alive(name)
+            return dict(h) if isinstance(h, dict) else {}
+
+    def hdel(self, name: str, *keys: str) -> int:
+        with self._lock:
+            h = self._alive(name)
+            if not isinstance(h, dict):
+                return 0
+            return sum(1 for k in keys if h.pop(str(k), None) is not None)
+
+    def hincrby(self, name: str, key: str, amount: int = 1) -> int:
+        with self._lock:
+            h = self._alive(name)
+            if not isinstance(h, dict):
+                h = {}
+                self._values[name] = (h, None)
+            current = int(h.get(str(key), 0)) + amount
+            h[str(key)] = str(current)
+            return current
+
+
+def get_cache() -> Any:
+    """Redis when reachable (shared by all workers), otherwise a per-process store."""
+    global _cache
+    if _cache is not None:
+        return _cache
+    with _cache_lock:
+        if _cache is not None:
+            return _cache
+        if Redis is not None:
+            try:
+                client = Redis.from_url(REDIS_URL, decode_responses=True, socket_timeout=1, socket_connect_timeout=1)
+                client.ping()
+                _cache = client
+                return _cache
+            except Exception:
+                pass
+        _cache = _InMemoryCache()
+        return _cache
+
+
+def is_shared(cache: Any) -> bool:
+    return not isinstance(cache, _InMemoryCache)
+
+
+def cache_key(*parts) -> str:
+    return CACHE_PREFIX + ":".join(str(p) for p in parts)
@@ -0,0 +1,104 @@
+import gzip
+import hashlib
+import json
+import threading
+
+from app.models import Game, GameTombstone
+from app.schemas import Game as GameOut
+from app.utils import versions
+
+try:
+    import brotli  # type: ignore
+except Exception:  # pragma: no cover - optional dependency
+    brotli = None
+
+COUNTER = "catalog"
+
+# Full catalog for one version, serialized and compressed once per worker
+_snapshot: dict = {}
+_lock = threading.Lock()
+
+
+def current_version(db) -> int:
+    return versions.current(db, COUNTER)
+
+
+def etag(version: int) -> str:
+    # Weak: the same version is served in several encodings
+    return f'W/"catalog-{version}"'
+
+
+def stamp(db, games) -> int:
+    """Give changed games the next catalog version; call before the commit."""
+    version = versions.bump(db, COUNTER)
+    db.flush()
+    ids = []
+    for game in games:
+        game.catalog_version = version
+        ids.append(game.id)
+    if ids:
+        # SQLite may hand a deleted id out again
+        db.query(GameTombstone).filter(GameTombstone.game_id.in_(ids)).delete(synchronize_session=False)
+    return version
+
+
+def tombstone(db, game_ids) -> int:
+    """Record deletions under the next catalog version; call before the commit."""
+    version = versions.bump(db, COUNTER)
+    for game_id in game_ids:
+        db.merge(GameTombstone(game_id=game_id, catalog_version=version))
+    return version
+
+
+def _serialize(games) -> list[dict]:
+    return [GameOut.model_validate(g).model_dump(mode="json") for g in games]
+
+
+def _build(db, version: int) -> dict:
+    # Version is read before the rows: a write racing the build is re-sent by the next delta
+    body = json.dumps(
+        {"version": version, "games": _serialize(db.query(Game).order_by(Game.id).all())},
+        separators=(",", ":"),
+    ).encode()
+    return {
+        "version": version,
+        "identity": body,
+        "gzip": gzip.compress(body, compresslevel=9),
+        "br": brotli.compress(body) if brotli else None,
+        "sha256": hashlib.sha256(body).hexdigest(),
+    }
+
+
+def snapshot(db) -> dict:
+    """Current full catalog, rebuilt only when the catalog version moved."""
+    global _snapshot
+    version = current_version(db)
+    with _lock:
+        if _snapshot.get("version") != version:
+            _snapshot = _build(db, version)
+        return _snapshot
+
+
+def pick_encoding(accept_encoding: str | None, snap: dict) -> str:
+    accepted = {p.split(";")[0].strip().lower() for p in (accept_encoding or "").split(",")}
+    if "br" in accepted and snap.get("br") is not None:
+        return "br"
+    if "gzip" in accepted:
+        return "gzip"
+    return "identity"
+
+
+def delta(db, since: int) -> dict:
+    """Games changed and ids deleted after `since`, up to the current version.
+
+    `reset` means `since` predates a database restore; the client should fetch
+    the full snapshot instead.
+    """
+    version = current_version(db)
+    if since < versions.current(db, versions.floor_name(COUNTER)) or since > version:
+        return {"version": version, "since": since, "reset": True, "games": [], "deleted": []}
+    if since == version:
+        return {"version": version, "since": since, "reset": False, "games": [], "deleted": []}
+    changed = db.query(Game).filter(Game.catalog_version > since).order_by(Game.id).all()
+    deleted = [i for (i,) in db.query(GameTombstone.game_id).filter(GameTombstone.catalog_version > since).all()]
+    return {"version": version, "since": since, "reset": False, "games": _serialize(changed), "deleted": deleted}
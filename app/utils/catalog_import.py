@@ -0,0 +1,193 @@
+import csv
+import json
+import os
+from datetime import datetime
+from typing import Iterable, Iterator
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.models import Game, GameTombstone
+from app.utils import catalog, game_search, versions
+
+BATCH_SIZE = int(os.getenv("GAME_IMPORT_BATCH", "500"))
+MAX_ERRORS = 100
+
+_FIELDS = tuple(c.name for c in Game.__table__.columns if c.name not in ("id", "last_updated", "catalog_version"))
+_JSON_FIELDS = ("tags", "pc_groups", "user_groups", "launchers")
+_BOOL_FIELDS = ("enabled", "is_free", "never_use_parent_license")
+_INT_FIELDS = ("min_age", "age_rating")
+_TRUE = {"1", "true", "yes", "y", "on"}
+_FALSE = {"0", "false", "no", "n", "off", ""}
+
+
+class ImportFormatError(ValueError):
+    pass
+
+
+def normalize_name(name) -> str:
+    """Dedupe key: case-folded with whitespace collapsed, so 'DOTA  2' and 'Dota 2' are one game."""
+    return " ".join(str(name).split()).casefold()
+
+
+def detect_format(filename: str | None, fmt: str | None = None) -> str:
+    fmt = (fmt or os.path.splitext(filename or "")[1].lstrip(".")).lower()
+    if fmt in ("jsonl", "ndjson", "json"):
+        return "jsonl"
+    if fmt == "csv":
+        return "csv"
+    raise ImportFormatError("Use a .jsonl or .csv file (or pass format=jsonl|csv)")
+
+
+def read_rows(stream, fmt: str) -> Iterator[tuple[int, dict | None, str | None]]:
+    """Yield (line, row, error) from a text stream without loading it whole."""
+    if fmt == "csv":
+        reader = csv.DictReader(stream)
+        for row in reader:
+            # Empty cells mean "not provided", not "clear the field"
+            yield reader.line_num, {k.strip(): v for k, v in row.items() if k and v not in (None, "")}, None
+        return
+    for line_no, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            row = json.loads(line)
+        except ValueError:
+            yield line_no, None, "invalid JSON"
+            continue
+        if not isinstance(row, dict):
+            yield line_no, None, "expected a JSON object"
+            continue
+        yield line_no, row, None
+
+
+def _coerce(row: dict) -> tuple[dict | None, str | None]:
+    name = row.get("name")
+    if not isinstance(name, str) or not name.strip():
+        return None, "missing name"
+    values = {"name": " ".join(name.split())}
+    for field in _FIELDS:
+        if field == "name" or field not in row:
+            continue
+        value = row[field]
+        if field in _JSON_FIELDS and isinstance(value, (list, dict)):
+            value = json.dumps(value)
+        elif field in _BOOL_FIELDS and isinstance(value, str):
+            if value.strip().lower() not in _TRUE | _FALSE:
+                return None, f"{field}: expected a boolean"
+            value = value.strip().lower() in _TRUE
+        elif field in _INT_FIELDS and value is not None:
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                return None, f"{field}: expected an integer"
+        values[field] = value
+    return values, None
+
+
+def _prefetch(db) -> dict[str, dict]:
+    """Every current game by normalized name, in one query."""
+    cols = [Game.id, *[getattr(Game, f) for f in _FIELDS]]
+    out = {}
+    for row in db.execute(select(*cols)).mappings():
+        out.setdefault(normalize_name(row["name"]), dict(row))
+    return out
+
+
+def _upsert(db, rows: list[dict]) -> None:
+    table = Game.__table__
+    update_cols = [c for c in rows[0] if c != "name"]
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialect == "sqlite" else pg_insert)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.name], set_={c: stmt.excluded[c] for c in update_cols}
+        )
+        db.execute(stmt, rows)
+        return
+    # Other dialects: split on the unique name and write each half in bulk
+    names = [r["name"] for r in rows]
+    ids = dict(db.execute(select(table.c.name, table.c.id).where(table.c.name.in_(names))).all())
+    updates = [{**r, "id": ids[r["name"]]} for r in rows if r["name"] in ids]
+    inserts = [r for r in rows if r["name"] not in ids]
+    if updates:
+        db.execute(update(Game), updates)
+    if inserts:
+        db.execute(insert(table), inserts)
+
+
+def _flush(db, batch: list[tuple[int, str, dict]], result: dict, dry_run: bool) -> None:
+    if not dry_run:
+        try:
+            version = versions.bump(db, catalog.COUNTER)
+            now = datetime.utcnow()
+            # One statement per column set; files usually have a single shape
+            shapes: dict[tuple, list[dict]] = {}
+            for _, _, values in batch:
+                row = {**values, "last_updated": now, "catalog_version": version}
+                shapes.setdefault(tuple(sorted(row)), []).append(row)
+            for rows in shapes.values():
+                _upsert(db, rows)
+            # SQLite may hand out the id of a deleted game again
+            db.query(GameTombstone).filter(
+                GameTombstone.game_id.in_(select(Game.id).where(Game.catalog_version == version))
+            ).delete(synchronize_session=False)
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            result["skipped"] += len(batch)
+            _error(result, batch[0][0], f"batch of {len(batch)} rows failed: {exc.__class__.__name__}: {exc}")
+            return
+    for _, kind, _ in batch:
+        result[kind] += 1
+
+
+def _error(result: dict, line: int, message: str) -> None:
+    if len(result["errors"]) < MAX_ERRORS:
+        result["errors"].append({"line": line, "error": message})
+
+
+def import_rows(db, rows: Iterable[tuple[int, dict | None, str | None]],
+                batch_size: int = BATCH_SIZE, dry_run: bool = False) -> dict:
+    """Upsert games from (line, row, error) tuples in batches; each batch is its own transaction.
+
+    Rows match existing games by normalized name and keep the stored spelling.
+    Only the fields a row provides are written. Rows equal to what is stored,
+    repeats of an earlier row and invalid rows are skipped.
+    """
+    existing = _prefetch(db)
+    seen: set[str] = set()
+    result = {"created": 0, "updated": 0, "skipped": 0, "errors": [], "dry_run": dry_run}
+    batch: list[tuple[int, str, dict]] = []
+    for line, row, error in rows:
+        values = None
+        if error is None:
+            values, error = _coerce(row)
+        if error is not None:
+            result["skipped"] += 1
+            _error(result, line, error)
+            continue
+        key = normalize_name(values["name"])
+        if key in seen:
+            result["skipped"] += 1
+            _error(result, line, f"duplicate of an earlier row: {values['name']}")
+            continue
+        seen.add(key)
+        current = existing.get(key)
+        if current is not None:
+            values["name"] = current["name"]
+            if all(current.get(f) == v for f, v in values.items()):
+                result["skipped"] += 1
+                continue
+        batch.append((line, "updated" if current is not None else "created", values))
+        if len(batch) >= batch_size:
+            _flush(db, batch, result, dry_run)
+            batch = []
+    if batch:
+        _flush(db, batch, result, dry_run)
+    if not dry_run and (result["created"] or result["updated"]):
+        game_search.reset()
+    result["catalog_version"] = catalog.current_version(db)
+    return result
@@ -0,0 +1,185 @@
+import asyncio
+from datetime import datetime
+
+from sqlalchemy import func, insert, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from app.models import ChatMessage, ChatSummary
+
+BROADCAST = "broadcast"
+BACKFILL_BATCH = 2000
+
+
+def conversation_for(from_user_id: int, to_user_id: int | None) -> str:
+    if to_user_id is None:
+        return BROADCAST
+    low, high = sorted((int(from_user_id), int(to_user_id)))
+    return f"dm:{low}:{high}"
+
+
+def participants(conversation_id: str) -> tuple[int, int] | None:
+    if not conversation_id.startswith("dm:"):
+        return None
+    try:
+        _, low, high = conversation_id.split(":")
+        return int(low), int(high)
+    except ValueError:
+        return None
+
+
+def _summary(db, user_id: int, conversation_id: str) -> ChatSummary:
+    row = db.query(ChatSummary).filter_by(user_id=user_id, conversation_id=conversation_id).first()
+    if row is not None:
+        return row
+    try:
+        with db.begin_nested():
+            row = ChatSummary(user_id=user_id, conversation_id=conversation_id, unread_count=0, last_read_id=0)
+            db.add(row)
+        return row
+    except IntegrityError:
+        # Created concurrently by another request
+        return db.query(ChatSummary).filter_by(user_id=user_id, conversation_id=conversation_id).one()
+
+
+def record_message(db, cm: ChatMessage) -> None:
+    """Assign the conversation and bump summary rows in the caller's transaction (after flush)."""
+    cm.conversation_id = conversation_for(cm.from_user_id, cm.to_user_id)
+    db.flush()
+    now = datetime.utcnow()
+    sender = _summary(db, cm.from_user_id, cm.conversation_id)
+    sender.last_message_id = cm.id
+    sender.last_read_id = cm.id
+    sender.updated_at = now
+    if cm.to_user_id is not None and cm.to_user_id != cm.from_user_id:
+        recipient = _summary(db, cm.to_user_id, cm.conversation_id)
+        recipient.unread_count = ChatSummary.unread_count + 1
+        recipient.last_message_id = cm.id
+        recipient.updated_at = now
+
+
+def _broadcast_unread(db, user_id: int, last_read_id: int) -> int:
+    # Range scan on (conversation_id, id); broadcasts are never fanned out per user
+    return db.query(func.count(ChatMessage.id)).filter(
+        ChatMessage.conversation_id == BROADCAST,
+        ChatMessage.id > last_read_id,
+        ChatMessage.from_user_id != user_id,
+    ).scalar() or 0
+
+
+def conversations(db, user_id: int) -> list[dict]:
+    rows = db.query(ChatSummary).filter(ChatSummary.user_id == user_id).all()
+    out = {r.conversation_id: {
+        "conversation_id": r.conversation_id,
+        "unread_count": r.unread_count or 0,
+        "last_message_id": r.last_message_id,
+        "last_read_id": r.last_read_id or 0,
+    } for r in rows}
+    last_broadcast = db.query(func.max(ChatMessage.id)).filter(ChatMessage.conversation_id == BROADCAST).scalar()
+    if last_broadcast is not None:
+        b = out.setdefault(BROADCAST, {"conversation_id": BROADCAST, "last_read_id": 0})
+        b["last_message_id"] = last_broadcast
+        b["unread_count"] = _broadcast_unread(db, user_id, b["last_read_id"])
+    return sorted(out.values(), key=lambda c: c["last_message_id"] or 0, reverse=True)
+
+
+def mark_read(db, user_id: int, conversation_id: str, up_to_id: int | None = None) -> int:
+    """Advance the read position; returns the id read up to."""
+    latest = db.query(func.max(ChatMessage.id)).filter(ChatMessage.conversation_id == conversation_id).scalar() or 0
+    # Never read past the newest message, or later ones would arrive already read
+    up_to_id = latest if up_to_id is None else max(0, min(up_to_id, latest))
+    row = _summary(db, user_id, conversation_id)
+    row.last_read_id = max(row.last_read_id or 0, up_to_id)
+    if conversation_id != BROADCAST:
+        db.query(ChatMessage).filter(
+            ChatMessage.conversation_id == conversation_id,
+            ChatMessage.to_user_id == user_id,
+            ChatMessage.id <= up_to_id,
+            ChatMessage.read == False,  # noqa: E712
+        ).update({ChatMessage.read: True}, synchronize_session=False)
+        row.unread_count = db.query(func.count(ChatMessage.id)).filter(
+            ChatMessage.conversation_id == conversation_id,
+            ChatMessage.to_user_id == user_id,
+            ChatMessage.id > row.last_read_id,
+        ).scalar() or 0
+    row.updated_at = datetime.utcnow()
+    db.commit()
+    return row.last_read_id
+
+
+def backfill_conversations(db) -> int:
+    """Assign conversation ids to messages written before they existed and seed unread counters."""
+    total = 0
+    while True:
+        rows = db.query(ChatMessage.id, ChatMessage.from_user_id, ChatMessage.to_user_id).filter(
+            ChatMessage.conversation_id.is_(None)
+        ).order_by(ChatMessage.id).limit(BACKFILL_BATCH).all()
+        if not rows:
+            break
+        db.execute(update(ChatMessage), [
+            {"id": r.id, "conversation_id": conversation_for(r.from_user_id, r.to_user_id)} for r in rows
+        ])
+        db.commit()
+        total += len(rows)
+    if total:
+        unread = db.query(
+            ChatMessage.to_user_id, ChatMessage.conversation_id,
+            func.count(ChatMessage.id), func.max(ChatMessage.id),
+        ).filter(
+            ChatMessage.to_user_id.isnot(None), ChatMessage.read == False,  # noqa: E712
+        ).group_by(ChatMessage.to_user_id, ChatMessage.conversation_id).all()
+        for user_id, conversation_id, count, last_id in unread:
+            row = _summary(db, user_id, conversation_id)
+            row.unread_count = count
+            row.last_message_id = max(row.last_message_id or 0, last_id)
+        db.commit()
+    return total
+
+
+def rebuild_summaries(db) -> int:
+    """Recompute direct-message summaries from the messages themselves (e.g. after a restore).
+
+    Read positions that survive in the table are kept; broadcast rows only hold a read
+    position and are left alone.
+    """
+    backfill_conversations(db)
+    read_pos = {
+        (u, c): r or 0 for u, c, r in db.query(ChatSummary.user_id, ChatSummary.conversation_id, ChatSummary.last_read_id)
+        .filter(ChatSummary.conversation_id != BROADCAST)
+    }
+    last: dict[tuple[int, str], int] = {}
+    for col in (ChatMessage.from_user_id, ChatMessage.to_user_id):
+        for user_id, conversation_id, last_id in db.query(col, ChatMessage.conversation_id, func.max(ChatMessage.id)).filter(
+            col.isnot(None), ChatMessage.conversation_id != BROADCAST,
+        ).group_by(col, ChatMessage.conversation_id):
+            last[(user_id, conversation_id)] = max(last.get((user_id, conversation_id), 0), last_id)
+    unread = {
+        (u, c): n for u, c, n in db.query(ChatMessage.to_user_id, ChatMessage.conversation_id, func.count(ChatMessage.id))
+        .filter(ChatMessage.to_user_id.isnot(None), ChatMessage.read == False)  # noqa: E712
+        .group_by(ChatMessage.to_user_id, ChatMessage.conversation_id)
+    }
+    now = datetime.utcnow()
+    db.query(ChatSummary).filter(ChatSummary.conversation_id != BROADCAST).delete(synchronize_session=False)
+    if last:
+        db.execute(insert(ChatSummary), [
+            {"user_id": u, "conversation_id": c, "last_message_id": last_id, "last_read_id": read_pos.get((u, c), 0),
+             "unread_count": unread.get((u, c), 0), "updated_at": now}
+            for (u, c), last_id in last.items()
+        ])
+    db.commit()
+    return len(last)
+
+
+def _backfill_once() -> int:
+    db = SessionLocal()
+    try:
+        return backfill_conversations(db)
+    finally:
+        db.close()
+
+
+async def backfill_task():
+    try:
+        await asyncio.to_thread(_backfill_once)
+    except Exception:
+        pass
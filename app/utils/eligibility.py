@@ -0,0 +1,173 @@
+import bisect
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import date, datetime
+
+from app.models import Game, PCGroup, PCToGroup, UserGroup, VersionCounter
+from app.utils import catalog, versions
+
+# Bumped by PC group / user group changes; games are covered by the catalog counter
+GROUPS_COUNTER = "groups"
+RESULT_CACHE_SIZE = 4096
+# Other workers' changes are picked up within this long; this worker's own writes immediately
+CHECK_INTERVAL_SEC = float(os.getenv("ELIGIBILITY_CHECK_SEC", "1"))
+
+_lock = threading.Lock()
+_state: dict = {"key": None}
+_checked = {"at": 0.0, "bumps": -1}
+# (pc group ids, user group id, age bucket) -> visible game ids; cleared on rebuild
+_results: OrderedDict = OrderedDict()
+
+
+def _parse_groups(raw, by_name: dict[str, int]) -> set[int] | None:
+    """Group ids a game is limited to, or None when it is open to every group."""
+    if not raw:
+        return None
+    try:
+        values = json.loads(raw)
+    except (TypeError, ValueError):
+        values = raw.split(",")
+    if not isinstance(values, list):
+        values = [values]
+    if not values:
+        return None
+    out = set()
+    for v in values:
+        if isinstance(v, dict):
+            v = v.get("id", v.get("name"))
+        if isinstance(v, bool) or v is None:
+            continue
+        if isinstance(v, int) or (isinstance(v, str) and v.strip().isdigit()):
+            out.add(int(v))
+        elif isinstance(v, str) and v.strip().lower() in by_name:
+            out.add(by_name[v.strip().lower()])
+    # Unresolvable names restrict to nobody rather than to everybody
+    return out
+
+
+def required_age(game) -> int:
+    return max(game.min_age or 0, game.age_rating or 0)
+
+
+def age_on(birthdate, today: date | None = None) -> int | None:
+    if not birthdate:
+        return None
+    today = today or date.today()
+    born = birthdate.date() if isinstance(birthdate, datetime) else birthdate
+    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+
+
+def _version_key(db) -> tuple:
+    rows = dict(db.query(VersionCounter.name, VersionCounter.value).filter(
+        VersionCounter.name.in_([catalog.COUNTER, GROUPS_COUNTER])
+    ).all())
+    return rows.get(catalog.COUNTER) or 0, rows.get(GROUPS_COUNTER) or 0
+
+
+def _build(db, key: tuple) -> dict:
+    """Parse the JSON group columns once into bitsets over enabled games (bit i = game_ids[i])."""
+    pc_names = {(n or "").lower(): i for i, n in db.query(PCGroup.id, PCGroup.name).all()}
+    user_names = {(n or "").lower(): i for i, n in db.query(UserGroup.id, UserGroup.name).all()}
+    games = db.query(
+        Game.id, Game.pc_groups, Game.user_groups, Game.min_age, Game.age_rating
+    ).filter(Game.enabled == True).order_by(Game.id).all()  # noqa: E712
+    open_pc = open_user = 0
+    by_pc: dict[int, int] = {}
+    by_user: dict[int, int] = {}
+    by_age: dict[int, int] = {}
+    for i, g in enumerate(games):
+        bit = 1 << i
+        pcs = _parse_groups(g.pc_groups, pc_names)
+        if pcs is None:
+            open_pc |= bit
+        else:
+            for gid in pcs:
+                by_pc[gid] = by_pc.get(gid, 0) | bit
+        users = _parse_groups(g.user_groups, user_names)
+        if users is None:
+            open_user |= bit
+        else:
+            for gid in users:
+                by_user[gid] = by_user.get(gid, 0) | bit
+        age = required_age(g)
+        by_age[age] = by_age.get(age, 0) | bit
+    # Cumulative: age_masks[k] = games whose required age <= age_steps[k]
+    age_steps, age_masks, acc = [], [], 0
+    for age in sorted(by_age):
+        acc |= by_age[age]
+        age_steps.append(age)
+        age_masks.append(acc)
+    pc_groups: dict[int, frozenset] = {}
+    for pc_id, gid in db.query(PCToGroup.pc_id, PCToGroup.group_id).all():
+        pc_groups[pc_id] = pc_groups.get(pc_id, frozenset()) | {gid}
+    return {
+        "key": key, "game_ids": [g.id for g in games],
+        "open_pc": open_pc, "open_user": open_user, "by_pc": by_pc, "by_user": by_user,
+        "age_steps": age_steps, "age_masks": age_masks, "pc_groups": pc_groups,
+    }
+
+
+def ensure(db) -> dict:
+    global _state
+    now = time.monotonic()
+    bumps = versions.local_bumps()
+    if now - _checked["at"] < CHECK_INTERVAL_SEC and bumps == _checked["bumps"]:
+        return _state
+    key = _version_key(db)
+    _checked.update(at=now, bumps=bumps)
+    if _state["key"] != key:
+        state = _build(db, key)
+        with _lock:
+            _state = state
+            _results.clear()
+    return _state
+
+
+def bump_groups(db) -> None:
+    """Call in the transaction that changes groups or group assignments."""
+    versions.bump(db, GROUPS_COUNTER)
+
+
+def _decode(mask: int, game_ids: list[int]) -> list[int]:
+    out = []
+    while mask:
+        low = mask & -mask
+        i = low.bit_length() - 1
+        out.append(game_ids[i])
+        mask ^= low
+    return out
+
+
+def visible_games(db, pc_id: int | None, user) -> list[int]:
+    """Enabled game ids the user may see on this PC (pcs.id, as in pc_to_group).
+
+    Empty group lists mean no restriction and a None pc_id skips the PC check.
+    A user without a known birthdate only sees games with no age requirement.
+    """
+    state = ensure(db)
+    pc_groups = state["pc_groups"].get(pc_id, frozenset()) if pc_id is not None else None
+    user_group = getattr(user, "user_group_id", None) if user is not None else None
+    age = age_on(getattr(user, "birthdate", None)) if user is not None else None
+    bucket = bisect.bisect_right(state["age_steps"], age if age is not None else 0) - 1
+    cache_key = (state["key"], pc_groups, user_group, bucket)
+    with _lock:
+        hit = _results.get(cache_key)
+        if hit is not None:
+            _results.move_to_end(cache_key)
+            return hit
+    mask = state["age_masks"][bucket] if bucket >= 0 else 0
+    if pc_groups is not None:
+        allowed = state["open_pc"]
+        for gid in pc_groups:
+            allowed |= state["by_pc"].get(gid, 0)
+        mask &= allowed
+    mask &= state["open_user"] | state["by_user"].get(user_group, 0)
+    ids = _decode(mask, state["game_ids"])
+    with _lock:
+        _results[cache_key] = ids
+        if len(_results) > RESULT_CACHE_SIZE:
+            _results.popitem(last=False)
+    return ids
@@ -0,0 +1,328 @@
+import asyncio
+import base64
+import bisect
+import json
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass, field
+
+from app.database import SessionLocal
+from app.models import Game
+from app.utils import catalog
+from app.utils.cache import get_cache, cache_key, is_shared
+
+# Full reload at least this often, to pick up rows written outside the API (scripts, restores elsewhere)
+MAX_AGE_SEC = int(os.getenv("GAME_SEARCH_MAX_AGE_SEC", "600"))
+# Share of a term's trigrams a name must contain to count as a fuzzy match
+TRIGRAM_THRESHOLD = 0.5
+
+# Bumped by every catalog write; a worker whose copy is older rebuilds before answering.
+# Without a shared cache the catalog version in the DB plays the same role.
+_VERSION_KEY = cache_key("games", "search", "version")
+
+_WORD_RE = re.compile(r"[0-9a-z]+")
+
+
+@dataclass
+class _Doc:
+    id: int
+    name: str
+    category: str | None
+    enabled: bool
+    tags: tuple[str, ...]
+    words: tuple[str, ...] = ()
+    grams: frozenset = field(default_factory=frozenset)
+    # Trigrams of the whole name, spaces and punctuation included, for substring lookups
+    subgrams: frozenset = field(default_factory=frozenset)
+
+
+_docs: dict[int, _Doc] = {}
+_by_word: dict[str, set[int]] = {}
+_by_gram: dict[str, set[int]] = {}
+_by_sub: dict[str, set[int]] = {}
+_vocab: list[str] = []  # sorted keys of _by_word, for prefix ranges
+_lock = threading.Lock()
+_built = False
+_built_at = 0.0
+_version = 0
+
+
+def _words(text: str) -> list[str]:
+    return _WORD_RE.findall(text.lower())
+
+
+def _grams(word: str, pad: bool = True) -> set[str]:
+    w = f" {word} " if pad else word
+    return {w[i:i + 3] for i in range(len(w) - 2)}
+
+
+def _parse_tags(raw) -> tuple[str, ...]:
+    if not raw:
+        return ()
+    try:
+        tags = json.loads(raw)
+    except (TypeError, ValueError):
+        tags = raw.split(",")
+    if isinstance(tags, str):
+        tags = [tags]
+    if not isinstance(tags, list):
+        return ()
+    return tuple(sorted({str(t).strip().lower() for t in tags if str(t).strip()}))
+
+
+def _doc(game) -> _Doc:
+    words = tuple(dict.fromkeys(_words(game.name or "")))
+    grams = frozenset(g for w in words for g in _grams(w))
+    name = (game.name or "").lower()
+    return _Doc(
+        id=game.id, name=name, category=game.category,
+        enabled=bool(game.enabled), tags=_parse_tags(game.tags), words=words, grams=grams,
+        subgrams=frozenset(_grams(name, pad=False)),
+    )
+
+
+def _add(doc: _Doc) -> None:
+    _docs[doc.id] = doc
+    for w in doc.words:
+        ids = _by_word.get(w)
+        if ids is None:
+            ids = _by_word[w] = set()
+            bisect.insort(_vocab, w)
+        ids.add(doc.id)
+    for g in doc.grams:
+        _by_gram.setdefault(g, set()).add(doc.id)
+    for g in doc.subgrams:
+        _by_sub.setdefault(g, set()).add(doc.id)
+
+
+def _drop(game_id: int) -> None:
+    doc = _docs.pop(game_id, None)
+    if doc is None:
+        return
+    for w in doc.words:
+        ids = _by_word.get(w)
+        if ids is not None:
+            ids.discard(game_id)
+            if not ids:
+                del _by_word[w]
+                _vocab.pop(bisect.bisect_left(_vocab, w))
+    for g in doc.grams:
+        ids = _by_gram.get(g)
+        if ids is not None:
+            ids.discard(game_id)
+            if not ids:
+                del _by_gram[g]
+    for g in doc.subgrams:
+        ids = _by_sub.get(g)
+        if ids is not None:
+            ids.discard(game_id)
+            if not ids:
+                del _by_sub[g]
+
+
+def _shared_version(db) -> int:
+    try:
+        cache = get_cache()
+        if is_shared(cache):
+            return int(cache.get(_VERSION_KEY) or 0)
+    except Exception:
+        return _version
+    # Per-process cache: other workers' writes are only visible through the DB
+    return catalog.current_version(db)
+
+
+def _bump(version: int | None = None) -> None:
+    """Advance the local copy's version after this worker applied a write itself.
+
+    `version` is the catalog version the write was stamped with, used when there is no shared cache.
+    """
+    global _version
+    try:
+        cache = get_cache()
+        new = cache.incr(_VERSION_KEY) if is_shared(cache) else version
+    except Exception:
+        return
+    # Keep the local copy current unless another worker wrote in between
+    if new is not None and new == _version + 1:
+        _version = new
+
+
+def rebuild(db) -> int:
+    """Load the whole catalog; only the columns the index needs are read."""
+    global _built, _built_at, _version
+    version = _shared_version(db)
+    rows = db.query(Game.id, Game.name, Game.category, Game.enabled, Game.tags).all()
+    with _lock:
+        _docs.clear()
+        _by_word.clear()
+        _by_gram.clear()
+        _by_sub.clear()
+        _vocab.clear()
+        for row in rows:
+            _add(_doc(row))
+        _built = True
+        _built_at = time.monotonic()
+        _version = version
+    return len(rows)
+
+
+def ensure(db) -> None:
+    if not _built or time.monotonic() - _built_at > MAX_AGE_SEC or _shared_version(db) != _version:
+        rebuild(db)
+
+
+def upsert(games) -> None:
+    """Re-index games after their write is committed."""
+    if _built:
+        with _lock:
+            for game in games:
+                _drop(game.id)
+                _add(_doc(game))
+    _bump(max((g.catalog_version or 0 for g in games), default=None))
+
+
+def remove(game_ids, version: int | None = None) -> None:
+    """Drop deleted games; `version` is what catalog.tombstone returned for the delete."""
+    if _built:
+        with _lock:
+            for game_id in game_ids:
+                _drop(game_id)
+    _bump(version)
+
+
+def reset() -> None:
+    """Forget the index (e.g. after a database restore); the next search rebuilds it."""
+    global _built
+    with _lock:
+        _built = False
+    _bump()
+
+
+def _term_scores(term: str) -> dict[int, float]:
+    """Best score per game for one query term: exact word > word prefix > fuzzy trigram."""
+    scores: dict[int, float] = {}
+    start = bisect.bisect_left(_vocab, term)
+    for w in _vocab[start:]:
+        if not w.startswith(term):
+            break
+        weight = 12.0 if w == term else 10.0
+        for game_id in _by_word[w]:
+            if scores.get(game_id, 0) < weight:
+                scores[game_id] = weight
+    if len(term) >= 3:
+        grams = _grams(term, pad=False)
+        hits: dict[int, int] = {}
+        for g in grams:
+            for game_id in _by_gram.get(g, ()):
+                hits[game_id] = hits.get(game_id, 0) + 1
+        for game_id, n in hits.items():
+            similarity = n / len(grams)
+            if similarity >= TRIGRAM_THRESHOLD:
+                weight = 6.0 if term in _docs[game_id].name else 5.0 * similarity
+                if scores.get(game_id, 0) < weight:
+                    scores[game_id] = weight
+    return scores
+
+
+def _match(text: str | None) -> dict[int, float]:
+    if not text or not text.strip():
+        return {game_id: 0.0 for game_id in _docs}
+    phrase = text.strip().lower()
+    terms = list(dict.fromkeys(_words(phrase)))
+    matched: dict[int, float] | None = None
+    for term in terms:
+        scores = _term_scores(term)
+        if matched is None:
+            matched = scores
+        else:
+            matched = {i: s + scores[i] for i, s in matched.items() if i in scores}
+        if not matched:
+            break
+    matched = matched or {}
+    # Everything the old ILIKE '%search%' found still matches. Candidates are the games whose
+    # name holds every trigram of the phrase; one- and two-letter phrases match most of the
+    # catalog anyway, so those are checked against every name.
+    if len(phrase) >= 3:
+        postings = sorted((_by_sub.get(g, set()) for g in _grams(phrase, pad=False)), key=len)
+        candidates = set.intersection(*postings) if postings[0] else set()
+    else:
+        candidates = _docs.keys()
+    for game_id in candidates:
+        doc = _docs[game_id]
+        if phrase in doc.name:
+            bonus = 100.0 if doc.name == phrase else 50.0 if doc.name.startswith(phrase) else 8.0
+            matched[game_id] = matched.get(game_id, 0.0) + bonus
+    return matched
+
+
+def _encode_cursor(key: tuple) -> str:
+    return base64.urlsafe_b64encode(json.dumps(list(key)).encode()).decode()
+
+
+def _decode_cursor(cursor: str | None) -> tuple | None:
+    if not cursor:
+        return None
+    try:
+        score, name, game_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return (float(score), str(name), int(game_id))
+    except (ValueError, TypeError):
+        return None
+
+
+def search(db, text: str | None = None, category: str | None = None, enabled: bool | None = None,
+           tag: str | None = None, cursor: str | None = None, limit: int = 100, offset: int = 0) -> dict:
+    """Ranked ids, total and facets in one pass.
+
+    Order is relevance, then name, then id; `next_cursor` is the sort key of the
+    last row so the next page starts after it even if the catalog changed.
+    Facet counts cover the text/enabled matches before category and tag filters.
+    """
+    ensure(db)
+    tag = tag.strip().lower() if tag else None
+    with _lock:
+        matched = _match(text)
+        facets = {"category": {}, "tags": {}}
+        keys = []
+        for game_id, score in matched.items():
+            doc = _docs[game_id]
+            if enabled is not None and doc.enabled != enabled:
+                continue
+            facets["category"][doc.category] = facets["category"].get(doc.category, 0) + 1
+            for t in doc.tags:
+                facets["tags"][t] = facets["tags"].get(t, 0) + 1
+            if category and doc.category != category:
+                continue
+            if tag and tag not in doc.tags:
+                continue
+            keys.append((-round(score, 3), doc.name, game_id))
+    keys.sort()
+    total = len(keys)
+    after = _decode_cursor(cursor)
+    if after is not None:
+        keys = keys[bisect.bisect_right(keys, after):]
+    elif offset:
+        keys = keys[offset:]
+    page = keys[:limit]
+    return {
+        "ids": [k[2] for k in page],
+        "total": total,
+        "facets": facets,
+        "next_cursor": _encode_cursor(page[-1]) if page and len(keys) > limit else None,
+    }
+
+
+def _warm_once() -> None:
+    db = SessionLocal()
+    try:
+        rebuild(db)
+    finally:
+        db.close()
+
+
+async def warm_task():
+    try:
+        await asyncio.to_thread(_warm_once)
+    except Exception:
+        pass
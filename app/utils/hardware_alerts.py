@@ -0,0 +1,147 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from app.database import SessionLocal
+from app.models import Notification, User
+from app.utils import notifications
+
+EWMA_ALPHA = float(os.getenv("HW_ALERT_EWMA_ALPHA", "0.3"))
+# Samples needed before a PC can trip a rule, so one noisy first reading is ignored
+MIN_SAMPLES = int(os.getenv("HW_ALERT_MIN_SAMPLES", "3"))
+# Same rule on the same PC re-alerts at most this often, even if it flaps across the band
+COOLDOWN_SEC = int(os.getenv("HW_ALERT_COOLDOWN_SEC", "900"))
+FLUSH_INTERVAL_SEC = float(os.getenv("HW_ALERT_FLUSH_SEC", "2"))
+MAX_PENDING_EVENTS = 1000
+ADMIN_ROLES = ("admin", "owner", "superadmin")
+
+
+def _env_float(name: str, default: float) -> float:
+    return float(os.getenv(name, str(default)))
+
+
+# metric -> (trip when EWMA >= high, clear when EWMA <= low, label)
+RULES = {
+    "temp": (_env_float("HW_ALERT_TEMP_HIGH", 85), _env_float("HW_ALERT_TEMP_CLEAR", 78), "overheating"),
+    "cpu_percent": (_env_float("HW_ALERT_CPU_HIGH", 97), _env_float("HW_ALERT_CPU_CLEAR", 85), "CPU pegged"),
+    "ram_percent": (_env_float("HW_ALERT_RAM_HIGH", 95), _env_float("HW_ALERT_RAM_CLEAR", 85), "memory exhausted"),
+    "disk_percent": (_env_float("HW_ALERT_DISK_HIGH", 95), _env_float("HW_ALERT_DISK_CLEAR", 90), "disk almost full"),
+}
+
+
+class _MetricState:
+    __slots__ = ("ewma", "count", "active", "announced", "last_alert")
+
+    def __init__(self) -> None:
+        self.ewma: float | None = None
+        self.count = 0
+        self.active = False
+        self.announced = False
+        self.last_alert: float | None = None
+
+
+# (pc_id, metric) -> rolling state
+_state: dict[tuple[int, str], _MetricState] = {}
+_lock = threading.Lock()
+_events: deque = deque(maxlen=MAX_PENDING_EVENTS)
+
+
+def observe(rows: list[dict]) -> None:
+    """Update rolling statistics for each sample; O(1) per sample, no DB access."""
+    now = time.monotonic()
+    with _lock:
+        for row in rows:
+            pc_id = row["pc_id"]
+            for metric, (high, low, label) in RULES.items():
+                value = row.get(metric)
+                if value is None:
+                    continue
+                st = _state.get((pc_id, metric))
+                if st is None:
+                    st = _state[(pc_id, metric)] = _MetricState()
+                st.ewma = value if st.ewma is None else EWMA_ALPHA * value + (1 - EWMA_ALPHA) * st.ewma
+                st.count += 1
+                if not st.active and st.count >= MIN_SAMPLES and st.ewma >= high:
+                    st.active = True
+                    st.announced = st.last_alert is None or now - st.last_alert >= COOLDOWN_SEC
+                    if st.announced:
+                        st.last_alert = now
+                        _events.append(_event("alert", pc_id, metric, label, st.ewma, value, high, row))
+                elif st.active and st.ewma <= low:
+                    st.active = False
+                    if st.announced:
+                        _events.append(_event("resolved", pc_id, metric, label, st.ewma, value, low, row))
+
+
+def _event(kind: str, pc_id: int, metric: str, label: str, ewma: float, value: float, threshold: float, row: dict) -> dict:
+    ts = row.get("timestamp")
+    return {
+        "type": "hardware_alert",
+        "state": kind,
+        "pc_id": pc_id,
+        "metric": metric,
+        "label": label,
+        "ewma": round(ewma, 2),
+        "value": value,
+        "threshold": threshold,
+        "timestamp": ts.isoformat() if isinstance(ts, datetime) else ts,
+    }
+
+
+def active_alerts() -> list[dict]:
+    with _lock:
+        return [
+            {"pc_id": pc_id, "metric": metric, "ewma": round(st.ewma, 2), "label": RULES[metric][2]}
+            for (pc_id, metric), st in _state.items() if st.active
+        ]
+
+
+def _drain() -> list[dict]:
+    events = []
+    while _events:
+        try:
+            events.append(_events.popleft())
+        except IndexError:
+            break
+    return events
+
+
+def _persist(events: list[dict]) -> None:
+    """One Notification per admin per new alert, written in a single transaction."""
+    alerts = [e for e in events if e["state"] == "alert"]
+    if not alerts:
+        return
+    db = SessionLocal()
+    try:
+        admin_ids = [uid for (uid,) in db.query(User.id).filter(User.role.in_(ADMIN_ROLES)).all()]
+        now = datetime.utcnow()
+        for e in alerts:
+            content = f"PC {e['pc_id']}: {e['label']} ({e['metric']} {e['ewma']} >= {e['threshold']})"
+            for uid in admin_ids:
+                db.add(Notification(user_id=uid, pc_id=e["pc_id"], type="alert", content=content, created_at=now, seen=False))
+        db.commit()
+        notifications.invalidate(admin_ids)
+    finally:
+        db.close()
+
+
+async def alert_loop():
+    from app.ws import admin as ws_admin
+
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SEC)
+        events = _drain()
+        if not events:
+            continue
+        try:
+            await asyncio.to_thread(_persist, events)
+        except Exception:
+            pass
+        try:
+            await ws_admin.broadcast_admin(json.dumps({"type": "hardware_alerts", "alerts": events}))
+        except Exception:
+            pass
@@ -0,0 +1,215 @@
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app.database import SessionLocal
+from app.models import HardwareStat
+from app.utils.cache import get_cache, cache_key, is_shared
+
+PUSH_INTERVAL_MS = int(os.getenv("HARDWARE_PUSH_MS", "1000"))
+# Without Redis each worker only sees other workers' samples once they are flushed to the DB;
+# rows written since the last look are read this often (a range scan on the primary key)
+FALLBACK_REFRESH_SEC = float(os.getenv("HARDWARE_FALLBACK_REFRESH_SEC", "2"))
+
+_FIELDS = ("id", "pc_id", "cpu_percent", "ram_percent", "disk_percent", "gpu_percent", "temp")
+_HASH = cache_key("hardware", "latest")
+
+# pc_id -> latest sample; mirrors the shared cache hash for this worker's own writes
+_latest: dict[int, dict] = {}
+# pc_id -> encoded sample not yet written to the shared hash; published off the event loop
+_dirty: dict[str, str] = {}
+_lock = threading.Lock()
+# The newest-row-per-PC baseline is loaded once per process, and again after reset()
+_baseline_loaded = False
+# Highest hardware_stats id this worker has read from the DB
+_seen_id = 0
+_tail_at = 0.0
+
+
+def _encode(row: dict) -> str:
+    out = {f: row.get(f) for f in _FIELDS}
+    ts = row.get("timestamp")
+    out["timestamp"] = ts.isoformat() if isinstance(ts, datetime) else ts
+    return json.dumps(out)
+
+
+def _decode(raw: str) -> dict:
+    row = json.loads(raw)
+    if row.get("timestamp"):
+        row["timestamp"] = datetime.fromisoformat(row["timestamp"])
+    return row
+
+
+def update(rows: list[dict]) -> int:
+    """Record samples as the latest per PC when newer than what is stored. Returns PCs changed.
+
+    Only touches memory, so it is safe on the event loop; publish() writes to the shared cache.
+    """
+    newest: dict[int, dict] = {}
+    for row in rows:
+        current = newest.get(row["pc_id"])
+        if current is None or row["timestamp"] >= current["timestamp"]:
+            newest[row["pc_id"]] = row
+    changed = 0
+    with _lock:
+        for pc_id, row in newest.items():
+            current = _latest.get(pc_id)
+            if current is None or row["timestamp"] >= current["timestamp"]:
+                _latest[pc_id] = dict(row)
+                _dirty[str(pc_id)] = _encode(row)
+                changed += 1
+    return changed
+
+
+def publish() -> int:
+    """Write pending samples to the shared hash in one HSET. Blocking; call from a thread."""
+    global _dirty
+    with _lock:
+        batch, _dirty = _dirty, {}
+    if not batch:
+        return 0
+    try:
+        get_cache().hset(_HASH, mapping=batch)
+    except Exception:
+        with _lock:
+            for k, v in batch.items():
+                _dirty.setdefault(k, v)
+        return 0
+    return len(batch)
+
+
+def _load_baseline() -> tuple[list[dict], int]:
+    """Newest row per PC via the (pc_id, timestamp) index, and the highest id at that point."""
+    db = SessionLocal()
+    try:
+        # Read first: rows written while the baseline loads are picked up by the tail
+        top = db.query(func.max(HardwareStat.id)).scalar() or 0
+        subq = db.query(
+            HardwareStat.pc_id,
+            func.max(HardwareStat.timestamp).label('max_ts')
+        ).group_by(HardwareStat.pc_id).subquery()
+        stats = db.query(HardwareStat).join(
+            subq,
+            (HardwareStat.pc_id == subq.c.pc_id) &
+            (HardwareStat.timestamp == subq.c.max_ts)
+        ).all()
+        return [{f: getattr(s, f) for f in _FIELDS + ("timestamp",)} for s in stats], top
+    finally:
+        db.close()
+
+
+def _load_tail(after_id: int) -> list[dict]:
+    """Rows flushed since `after_id`, by any worker."""
+    db = SessionLocal()
+    try:
+        cols = [getattr(HardwareStat, f) for f in _FIELDS + ("timestamp",)]
+        return [dict(r._mapping) for r in db.query(*cols).filter(HardwareStat.id > after_id).order_by(HardwareStat.id)]
+    finally:
+        db.close()
+
+
+def _merge_baseline(cache) -> None:
+    global _baseline_loaded, _seen_id
+    rows, top = _load_baseline()
+    if is_shared(cache):
+        # Entries already in the hash come from live ingest and are at least as new as the DB
+        known = set(cache.hkeys(_HASH))
+        rows = [r for r in rows if str(r["pc_id"]) not in known]
+    update(rows)
+    with _lock:
+        _seen_id = max(_seen_id, top)
+        _baseline_loaded = True
+
+
+def _merge_tail() -> None:
+    global _seen_id
+    rows = _load_tail(_seen_id)
+    if rows:
+        update(rows)
+        with _lock:
+            _seen_id = max(_seen_id, rows[-1]["id"])
+
+
+def snapshot() -> list[dict]:
+    """Latest sample of every PC, O(#PCs) from the cache.
+
+    The DB baseline is read once; without a shared cache only rows flushed since the last
+    look are read, so other workers' samples still show up.
+    """
+    global _tail_at
+    cache = get_cache()
+    try:
+        if not _baseline_loaded:
+            _merge_baseline(cache)
+        elif not is_shared(cache) and time.monotonic() - _tail_at >= FALLBACK_REFRESH_SEC:
+            _tail_at = time.monotonic()
+            _merge_tail()
+    except Exception:
+        pass
+    publish()
+    try:
+        rows = [_decode(v) for v in cache.hgetall(_HASH).values()]
+    except Exception:
+        with _lock:
+            rows = [dict(r) for r in _latest.values()]
+    return sorted(rows, key=lambda r: r["pc_id"])
+
+
+def forget(pc_id: int) -> None:
+    with _lock:
+        _latest.pop(pc_id, None)
+        _dirty.pop(str(pc_id), None)
+    try:
+        get_cache().hdel(_HASH, str(pc_id))
+    except Exception:
+        pass
+
+
+def reset() -> None:
+    """Forget every cached sample (e.g. after a restore); the next snapshot() reloads the baseline."""
+    global _baseline_loaded, _seen_id
+    with _lock:
+        _latest.clear()
+        _dirty.clear()
+        _baseline_loaded = False
+        _seen_id = 0
+    try:
+        get_cache().delete(_HASH)
+    except Exception:
+        pass
+
+
+async def push_loop():
+    """Publish this worker's samples, then push changed PCs to /ws/admin.
+
+    Diffing the shared hash also picks up other workers' ingest.
+    """
+    from app.ws import admin as ws_admin
+
+    pushed: dict[int, str] = {}
+    while True:
+        await asyncio.sleep(PUSH_INTERVAL_MS / 1000.0)
+        if _dirty:
+            try:
+                await asyncio.to_thread(publish)
+            except Exception:
+                pass
+        if not ws_admin.has_admin_connections():
+            continue
+        try:
+            rows = await asyncio.to_thread(snapshot)
+            deltas = []
+            for row in rows:
+                stamp = row["timestamp"].isoformat() if isinstance(row["timestamp"], datetime) else str(row["timestamp"])
+                if pushed.get(row["pc_id"]) != stamp:
+                    pushed[row["pc_id"]] = stamp
+                    deltas.append({**row, "timestamp": stamp})
+            if deltas:
+                await ws_admin.broadcast_admin(json.dumps({"type": "hardware_latest", "stats": deltas}))
+        except Exception:
+            pass
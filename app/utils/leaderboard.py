@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+import threading
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database import SessionLocal
+from app.models import Leaderboard, LeaderboardEntry, LeaderboardArchive
+
+# Metrics a leaderboard can rank on. Increments are fed from server-side events only.
+METRIC_PLAY_MINUTES = "play_minutes"
+METRIC_COINS_EARNED = "coins_earned"
+METRIC_ORDERS = "orders"
+METRIC_SPEND = "spend"
+
+FLUSH_INTERVAL_SEC = int(os.getenv("LEADERBOARD_FLUSH_SEC", "30"))
+ROLLOVER_INTERVAL_SEC = int(os.getenv("LEADERBOARD_ROLLOVER_SEC", "60"))
+# A period is archived this long after it ends; increments for it that are still pending by then are dropped
+ROLLOVER_GRACE_SEC = int(os.getenv("LEADERBOARD_ROLLOVER_GRACE_SEC", "300"))
+
+UNIQUE_INDEX = "uq_leaderboard_entries_lb_user_period"
+
+log = logging.getLogger(__name__)
+
+# (metric, user_id, day the increment happened) -> pending increment, shared by request threads and the
+# flush loop. Every scope's periods start at midnight, so the day is enough to pick the right period.
+# Kept unrounded (spend is fractional) and rounded once per entry on flush.
+_pending: dict[tuple[str, int, datetime], float] = defaultdict(float)
+_lock = threading.Lock()
+
+
+def record_metric(user_id: int | None, metric: str, amount: int | float, at: datetime | None = None) -> None:
+    """Queue a leaderboard increment for the period containing `at` (default now); written on the next flush."""
+    amount = float(amount or 0)
+    if not user_id or amount <= 0:
+        return
+    day = (at or datetime.utcnow()).replace(hour=0, minute=0, second=0, microsecond=0)
+    with _lock:
+        _pending[(metric, user_id, day)] += amount
+
+
+def prepare_unique_index(engine) -> int:
+    """One-time migration before uq_leaderboard_entries_lb_user_period is built; returns rows merged away.
+
+    Does nothing once the index exists. Duplicate (leaderboard, user, period) rows are
+    folded into the oldest one by summing their values, so no standing changes.
+    """
+    insp = inspect(engine)
+    if not insp.has_table(LeaderboardEntry.__tablename__):
+        return 0
+    if any(ix["name"] == UNIQUE_INDEX for ix in insp.get_indexes(LeaderboardEntry.__tablename__)):
+        return 0
+    t = LeaderboardEntry.__table__
+    merged = 0
+    with engine.begin() as conn:
+        dupes = conn.execute(
+            select(t.c.leaderboard_id, t.c.user_id, t.c.period_start, func.min(t.c.id), func.sum(t.c.value))
+            .group_by(t.c.leaderboard_id, t.c.user_id, t.c.period_start)
+            .having(func.count(t.c.id) > 1)
+        ).all()
+        for lb_id, user_id, period_start, keep, total in dupes:
+            conn.execute(t.update().where(t.c.id == keep).values(value=total))
+            merged += conn.execute(t.delete().where(
+                t.c.leaderboard_id == lb_id, t.c.user_id == user_id, t.c.period_start == period_start, t.c.id != keep,
+            )).rowcount
+        # Build the index in the same transaction so this never runs again
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_INDEX} ON leaderboard_entries (leaderboard_id, user_id, period_start)"
+        ))
+    if merged:
+        log.warning("Merged %d duplicate leaderboard entries before building %s", merged, UNIQUE_INDEX)
+    return merged
+
+
+def upsert_entries(db, rows: list[dict]) -> None:
+    """Add each row's value to its (leaderboard, user, period) entry, creating it if needed. The caller commits."""
+    if not rows:
+        return
+    table = LeaderboardEntry.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialect == "sqlite" else pg_insert)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.leaderboard_id, table.c.user_id, table.c.period_start],
+            set_={"value": table.c.value + stmt.excluded.value},
+        )
+        db.execute(stmt, rows)
+        return
+    for row in rows:
+        entry = db.query(LeaderboardEntry).filter_by(
+            leaderboard_id=row["leaderboard_id"], user_id=row["user_id"], period_start=row["period_start"]
+        ).first()
+        if entry:
+            # Relative update so concurrent workers never lose increments
+            entry.value = LeaderboardEntry.value + row["value"]
+        else:
+            db.add(LeaderboardEntry(**row))
+
+
+def _drain() -> dict[tuple[str, int, datetime], float]:
+    global _pending
+    with _lock:
+        batch, _pending = _pending, defaultdict(float)
+    return batch
+
+
+def flush_metrics(db, now: datetime | None = None) -> int:
+    """Apply all pending increments to the period each one happened in, for every matching leaderboard."""
+    from app.api.endpoints.leaderboard import period_bounds
+
+    batch = _drain()
+    if not batch:
+        return 0
+    now = now or datetime.utcnow()
+    archived_before = now - timedelta(seconds=ROLLOVER_GRACE_SEC)
+    try:
+        metrics = {metric for metric, _, _ in batch}
+        boards = db.query(Leaderboard).filter(Leaderboard.active == True, Leaderboard.metric.in_(metrics)).all()
+        rows: dict[tuple[int, int, datetime], dict] = {}
+        for lb in boards:
+            for (metric, uid, day), amount in batch.items():
+                if metric != lb.metric:
+                    continue
+                start, end = period_bounds(lb.scope, day)
+                if end <= archived_before:
+                    # That period has already been archived
+                    continue
+                row = rows.setdefault((lb.id, uid, start), {
+                    "leaderboard_id": lb.id, "user_id": uid, "period_start": start, "period_end": end, "value": 0,
+                })
+                row["value"] += amount
+        for row in rows.values():
+            row["value"] = int(round(row["value"]))
+        upsert_entries(db, [row for row in rows.values() if row["value"] > 0])
+        db.commit()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        # Put the batch back so the next flush retries it
+        with _lock:
+            for key, amount in batch.items():
+                _pending[key] += amount
+        raise
+
+
+def rollover_periods(db, now: datetime | None = None) -> int:
+    """Freeze standings of finished periods into the archive and clear them from the live table.
+
+    Periods are archived ROLLOVER_GRACE_SEC after they end, so increments still buffered
+    when the period closed land first. Each period is claimed by deleting exactly the
+    entries that were read; if another worker got there first the delete comes up short
+    and the archive rows are rolled back, so a period is never archived twice.
+    """
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=ROLLOVER_GRACE_SEC)
+    archived = 0
+    boards = db.query(Leaderboard.id).all()
+    for (lb_id,) in boards:
+        periods = db.query(LeaderboardEntry.period_start, LeaderboardEntry.period_end).filter(
+            LeaderboardEntry.leaderboard_id == lb_id,
+            LeaderboardEntry.period_end <= cutoff,
+        ).distinct().all()
+        for period_start, period_end in periods:
+            entries = db.query(LeaderboardEntry).filter_by(
+                leaderboard_id=lb_id, period_start=period_start
+            ).order_by(LeaderboardEntry.value.desc(), LeaderboardEntry.user_id.asc()).all()
+            claimed = db.query(LeaderboardEntry).filter(
+                LeaderboardEntry.id.in_([e.id for e in entries])
+            ).delete(synchronize_session=False)
+            if claimed != len(entries):
+                db.rollback()
+                continue
+            for rank, e in enumerate(entries, start=1):
+                db.add(LeaderboardArchive(
+                    leaderboard_id=lb_id,
+                    user_id=e.user_id,
+                    period_start=period_start,
+                    period_end=period_end,
+                    rank=rank,
+                    value=e.value,
+                    archived_at=now,
+                ))
+            db.commit()
+            archived += len(entries)
+    return archived
+
+
+def pending_count() -> int:
+    with _lock:
+        return len(_pending)
+
+
+def _flush_once() -> None:
+    db = SessionLocal()
+    try:
+        flush_metrics(db)
+    finally:
+        db.close()
+
+
+def _rollover_once() -> None:
+    db = SessionLocal()
+    try:
+        rollover_periods(db)
+    finally:
+        db.close()
+
+
+async def flush_loop():
+    while True:
+        await asyncio.sleep(FLUSH_INTERVAL_SEC)
+        try:
+            await asyncio.to_thread(_flush_once)
+        except Exception:
+            pass
+
+
+async def rollover_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_rollover_once)
+        except Exception:
+            pass
+        await asyncio.sleep(ROLLOVER_INTERVAL_SEC)
+
+
+def flush_on_shutdown() -> None:
+    try:
+        _flush_once()
+    except Exception:
+        pass
@@ -0,0 +1,179 @@
+import asyncio
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+
+from app.database import SessionLocal
+from app.models import ClientPC, Game, PCGame, User, VersionCounter
+from app.utils import catalog, eligibility, versions
+
+# Bumped by PC game assignments
+COUNTER = "pc_games"
+# Bumped when a client PC's signed-in user or its pcs link changes
+PCS_COUNTER = "client_pcs"
+PUSH_INTERVAL_SEC = float(os.getenv("MANIFEST_PUSH_SEC", "2"))
+CACHE_SIZE = 2048
+
+_cache: OrderedDict = OrderedDict()
+_lock = threading.Lock()
+# pc_id -> manifest version last pushed to its socket
+_pushed: dict[int, str] = {}
+# Sockets opened since the last push, which get the current manifest without waiting for a change
+_fresh: set[int] = set()
+
+
+def bump_assignments(db) -> None:
+    """Call in the transaction that changes pc_games."""
+    versions.bump(db, COUNTER)
+
+
+def bump_pcs(db) -> None:
+    """Call in the transaction that signs a user in or out of a client PC or relinks it."""
+    versions.bump(db, PCS_COUNTER)
+
+
+def _version_key(db) -> tuple:
+    names = (catalog.COUNTER, eligibility.GROUPS_COUNTER, COUNTER, PCS_COUNTER)
+    rows = dict(db.query(VersionCounter.name, VersionCounter.value).filter(VersionCounter.name.in_(names)).all())
+    return tuple(rows.get(n) or 0 for n in names)
+
+
+def _launchers(raw):
+    if not raw:
+        return []
+    try:
+        return json.loads(raw)
+    except (TypeError, ValueError):
+        return []
+
+
+def _build(db, pc_id: int, machine_id: int | None, user, key: tuple) -> dict:
+    if machine_id is None:
+        # Not linked to a pcs row: no assignments, and in no PC group (0 is never a pcs id)
+        assigned = set()
+        visible = set(eligibility.visible_games(db, 0, user))
+    else:
+        assigned = {gid for (gid,) in db.query(PCGame.game_id).filter(PCGame.pc_id == machine_id).all()}
+        visible = set(eligibility.visible_games(db, machine_id, user))
+    age = eligibility.age_on(user.birthdate) if user is not None else None
+    games = []
+    for g in db.query(Game).filter(Game.id.in_(assigned | visible)).order_by(Game.name, Game.id).all():
+        # Explicit assignment overrides groups and the enabled flag, never the age limit
+        if g.id not in visible and eligibility.required_age(g) > (age or 0):
+            continue
+        games.append({
+            "id": g.id,
+            "name": g.name,
+            "category": g.category,
+            "exe_path": g.exe_path,
+            "launchers": _launchers(g.launchers),
+            "version": g.version,
+            "icon_url": g.icon_url,
+            "image_600x900": g.image_600x900,
+            "assigned": g.id in assigned,
+        })
+    body = json.dumps(games, separators=(",", ":"), sort_keys=True)
+    return {
+        "pc_id": pc_id,
+        "user_id": user.id if user is not None else None,
+        "catalog_version": key[0],
+        "version": hashlib.sha256(body.encode()).hexdigest()[:16],
+        "games": games,
+    }
+
+
+def manifest_for(db, pc_id: int, key: tuple | None = None) -> dict | None:
+    """Manifest for a PC and whoever is signed in on it; None for an unknown PC.
+
+    pc_id is the client_pcs id (the /ws/pc id); sessions record the signed-in
+    user there, and client_pcs.pc_id links the machine's pcs row for groups and assignments.
+    """
+    pc = db.query(ClientPC.id, ClientPC.pc_id, ClientPC.current_user_id).filter(ClientPC.id == pc_id).first()
+    if pc is None:
+        return None
+    user = db.query(User).filter(User.id == pc.current_user_id).first() if pc.current_user_id else None
+    return _manifest(db, pc_id, pc.pc_id, user, key or _version_key(db))
+
+
+def _manifest(db, pc_id: int, machine_id: int | None, user, key: tuple) -> dict:
+    # Everything the manifest depends on; user fields are read live, so no invalidation is needed for them
+    cache_key = (
+        pc_id, machine_id, key, user.id if user else None, user.user_group_id if user else None,
+        eligibility.age_on(user.birthdate) if user else None,
+    )
+    with _lock:
+        hit = _cache.get(cache_key)
+        if hit is not None:
+            _cache.move_to_end(cache_key)
+            return hit
+    manifest = _build(db, pc_id, machine_id, user, key)
+    with _lock:
+        _cache[cache_key] = manifest
+        if len(_cache) > CACHE_SIZE:
+            _cache.popitem(last=False)
+    return manifest
+
+
+def forget_pushed(pc_id: int) -> None:
+    """A fresh socket gets the current manifest on the next push tick."""
+    _pushed.pop(pc_id, None)
+    _fresh.add(pc_id)
+
+
+def _changed(pc_ids: list[int], key: tuple) -> list[dict]:
+    """Manifests of these PCs that differ from what was last pushed; three queries plus cache misses."""
+    db = SessionLocal()
+    try:
+        pcs = db.query(ClientPC.id, ClientPC.pc_id, ClientPC.current_user_id).filter(ClientPC.id.in_(pc_ids)).all()
+        user_ids = {pc.current_user_id for pc in pcs if pc.current_user_id}
+        users = {u.id: u for u in db.query(User).filter(User.id.in_(user_ids)).all()} if user_ids else {}
+        out = []
+        for pc in pcs:
+            manifest = _manifest(db, pc.id, pc.pc_id, users.get(pc.current_user_id), key)
+            if _pushed.get(pc.id) != manifest["version"]:
+                out.append(manifest)
+        return out
+    finally:
+        db.close()
+
+
+def _current_key() -> tuple:
+    db = SessionLocal()
+    try:
+        return _version_key(db)
+    finally:
+        db.close()
+
+
+async def push_loop():
+    """Push manifests when the catalog, eligibility, assignment or sign-in version moves, and to new sockets.
+
+    Each tick reads only the version counters; manifests are rebuilt just for the PCs affected.
+    """
+    from app.ws import pc as ws_pc
+
+    pushed_key = None
+    while True:
+        await asyncio.sleep(PUSH_INTERVAL_SEC)
+        try:
+            connected = set(ws_pc.connected_pc_ids())
+            if not connected:
+                _fresh.clear()
+                continue
+            key = await asyncio.to_thread(_current_key)
+            if key == pushed_key:
+                pc_ids = sorted(_fresh & connected)
+            else:
+                pc_ids = sorted(connected)
+            _fresh.clear()
+            pushed_key = key
+            if not pc_ids:
+                continue
+            changed = await asyncio.to_thread(_changed, pc_ids, key)
+            for manifest in changed:
+                await ws_pc.notify_pc(manifest["pc_id"], json.dumps({"type": "manifest", "manifest": manifest}, default=str))
+                _pushed[manifest["pc_id"]] = manifest["version"]
+        except Exception:
+            pass
@@ -0,0 +1,114 @@
+import json
+import os
+from datetime import datetime
+
+from sqlalchemy import func
+
+from app.models import Notification, NotificationReadMark
+from app.utils.cache import get_cache, cache_key
+
+# Per-user {"personal": n, "broadcast": m}, dropped on every change and rebuilt on the next read.
+# Keys carry a generation that a broadcast bumps, so one INCR retires every user's entry.
+# A count computed just before an invalidate can still be written back after it (read-then-set);
+# the TTL bounds how long such a stale count, or one left in another worker's in-memory
+# fallback cache, can be served.
+UNREAD_TTL_SEC = int(os.getenv("NOTIFICATION_UNREAD_TTL_SEC", "60"))
+_UNREAD_GEN = cache_key("notifications", "unread", "gen")
+
+
+def _unread_key(cache, user_id: int) -> str:
+    return cache_key("notifications", "unread", cache.get(_UNREAD_GEN) or 0, user_id)
+
+
+def broadcast_watermark(db, user_id: int) -> int:
+    mark = db.get(NotificationReadMark, user_id)
+    return (mark.broadcast_read_id or 0) if mark else 0
+
+
+def _count(db, user_id: int) -> dict:
+    personal = db.query(func.count(Notification.id)).filter(
+        Notification.user_id == user_id, Notification.seen == False,  # noqa: E712
+    ).scalar() or 0
+    broadcast = db.query(func.count(Notification.id)).filter(
+        Notification.user_id.is_(None), Notification.id > broadcast_watermark(db, user_id),
+    ).scalar() or 0
+    return {"personal": personal, "broadcast": broadcast}
+
+
+def unread_counts(db, user_id: int) -> dict:
+    cache = get_cache()
+    key = None
+    try:
+        # Generation read before counting: a broadcast landing meanwhile retires this entry too
+        key = _unread_key(cache, user_id)
+        raw = cache.get(key)
+        if raw:
+            counts = json.loads(raw)
+            return {**counts, "total": counts["personal"] + counts["broadcast"]}
+    except Exception:
+        pass
+    counts = _count(db, user_id)
+    if key is not None:
+        try:
+            cache.set(key, json.dumps(counts), ex=UNREAD_TTL_SEC)
+        except Exception:
+            pass
+    return {**counts, "total": counts["personal"] + counts["broadcast"]}
+
+
+def invalidate(user_ids) -> None:
+    """Call after notifications for these users are written or read."""
+    ids = [u for u in user_ids if u is not None]
+    if not ids:
+        return
+    try:
+        cache = get_cache()
+        gen = cache.get(_UNREAD_GEN) or 0
+        cache.delete(*(cache_key("notifications", "unread", gen, u) for u in ids))
+    except Exception:
+        pass
+
+
+def invalidate_all() -> None:
+    """A broadcast changes every user's count."""
+    try:
+        get_cache().incr(_UNREAD_GEN)
+    except Exception:
+        pass
+
+
+def with_seen(rows, watermark: int) -> list[dict]:
+    """Serialize rows with `seen` resolved per user for broadcasts."""
+    out = []
+    for n in rows:
+        out.append({
+            "id": n.id,
+            "user_id": n.user_id,
+            "pc_id": n.pc_id,
+            "type": n.type,
+            "content": n.content,
+            "created_at": n.created_at,
+            "seen": bool(n.seen) if n.user_id is not None else n.id <= watermark,
+        })
+    return out
+
+
+def mark_read(db, user_id: int, up_to_id: int | None = None) -> int:
+    """Mark personal notifications seen and advance the broadcast watermark, up to an id."""
+    latest = db.query(func.max(Notification.id)).filter(
+        (Notification.user_id == user_id) | (Notification.user_id.is_(None))
+    ).scalar() or 0
+    # Never move the watermark past what exists, or later broadcasts would arrive already read
+    up_to_id = latest if up_to_id is None else max(0, min(up_to_id, latest))
+    db.query(Notification).filter(
+        Notification.user_id == user_id, Notification.id <= up_to_id, Notification.seen == False,  # noqa: E712
+    ).update({Notification.seen: True}, synchronize_session=False)
+    mark = db.get(NotificationReadMark, user_id)
+    if mark is None:
+        mark = NotificationReadMark(user_id=user_id, broadcast_read_id=0)
+        db.add(mark)
+    mark.broadcast_read_id = max(mark.broadcast_read_id or 0, up_to_id)
+    mark.updated_at = datetime.utcnow()
+    db.commit()
+    invalidate([user_id])
+    return up_to_id
@@ -0,0 +1,177 @@
+from datetime import datetime
+
+from sqlalchemy import func, insert, select, update
+
+from app.models import Coupon, CouponRedemption, Order, OrderItem, Product, User, WalletTransaction
+from app.utils import leaderboard as leaderboard_feed
+from app.utils import webhooks
+
+MAX_PAGE = 200
+
+
+class OrderError(ValueError):
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def price_items(db, items: list[dict]) -> tuple[list[dict], float]:
+    """Order lines at current prices (one product query) and their subtotal."""
+    if not items:
+        raise OrderError("No items")
+    wanted = []
+    for item in items:
+        if not isinstance(item, dict) or "product_id" not in item:
+            raise OrderError("Each item needs a product_id")
+        try:
+            qty = int(item.get("quantity", 1))
+        except (TypeError, ValueError):
+            raise OrderError(f"Invalid quantity for product {item['product_id']}")
+        if qty < 1:
+            raise OrderError(f"Invalid quantity for product {item['product_id']}")
+        wanted.append((item["product_id"], qty))
+    products = {
+        p.id: p for p in db.query(Product.id, Product.name, Product.price)
+        .filter(Product.id.in_({pid for pid, _ in wanted}), Product.active.isnot(False)).all()
+    }
+    lines, subtotal = [], 0.0
+    for pid, qty in wanted:
+        prod = products.get(pid)
+        if prod is None:
+            raise OrderError(f"Product {pid} not found", 404)
+        price = prod.price or 0.0
+        lines.append({"product_id": prod.id, "name": prod.name, "quantity": qty, "price": price})
+        subtotal += price * qty
+    return lines, round(subtotal, 2)
+
+
+def _claim_redemption(db, coupon_id: int, user_id: int, order_id: int) -> bool:
+    # A use already counted by /api/coupon/redeem and not yet spent; conditional so only one order gets it
+    open_use = (
+        select(func.min(CouponRedemption.id))
+        .where(CouponRedemption.coupon_id == coupon_id, CouponRedemption.user_id == user_id,
+               CouponRedemption.order_id.is_(None))
+        .scalar_subquery()
+    )
+    res = db.execute(
+        update(CouponRedemption)
+        .where(CouponRedemption.id == open_use, CouponRedemption.order_id.is_(None))
+        .values(order_id=order_id)
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount == 1
+
+
+def _redeem(db, coupon_id: int) -> bool:
+    # Conditional UPDATE: the last use of a limited coupon goes to exactly one order
+    res = db.execute(
+        update(Coupon)
+        .where(Coupon.id == coupon_id, (Coupon.max_uses.is_(None)) | (Coupon.max_uses == 0)
+               | (func.coalesce(Coupon.times_used, 0) < Coupon.max_uses))
+        .values(times_used=func.coalesce(Coupon.times_used, 0) + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount == 1
+
+
+def apply_coupon(db, code: str, user_id: int, order_id: int, total: float, now: datetime) -> tuple[float, int]:
+    """Discounted total and the coupon id, spending one use of the coupon on the order.
+
+    A use the user already redeemed is spent first; otherwise a new one is counted against
+    max_uses and per_user_limit. Raises OrderError when the coupon cannot be applied.
+    """
+    cp = db.query(Coupon).filter_by(code=code).first()
+    if cp is None or cp.applies_to not in ("*", "product"):
+        raise OrderError("Invalid coupon code")
+    if cp.expires_at and cp.expires_at < now:
+        raise OrderError("Coupon expired")
+    if not _claim_redemption(db, cp.id, user_id, order_id):
+        if cp.per_user_limit:
+            used = db.query(func.count(CouponRedemption.id)).filter(
+                CouponRedemption.coupon_id == cp.id, CouponRedemption.user_id == user_id
+            ).scalar()
+            if used >= cp.per_user_limit:
+                raise OrderError("Coupon per-user limit reached")
+        if not _redeem(db, cp.id):
+            raise OrderError("Coupon max uses reached")
+        db.add(CouponRedemption(coupon_id=cp.id, user_id=user_id, timestamp=now, order_id=order_id))
+    return max(0.0, round(total * (100.0 - (cp.discount_percent or 0.0)) / 100.0, 2)), cp.id
+
+
+def _debit(db, user_id: int, amount: float) -> None:
+    # Conditional UPDATE: two concurrent orders cannot both spend the same balance
+    res = db.execute(
+        update(User)
+        .where(User.id == user_id, func.coalesce(User.wallet_balance, 0.0) >= amount)
+        .values(wallet_balance=func.coalesce(User.wallet_balance, 0.0) - amount)
+        .execution_options(synchronize_session=False)
+    )
+    if res.rowcount != 1:
+        raise OrderError("Insufficient wallet balance")
+
+
+def place_order(db, user_id: int, items: list[dict], coupon_code: str | None = None) -> dict:
+    """Price, discount, redeem the coupon, debit the wallet and write the order, its items and the wallet entry in one commit.
+
+    Any failure, including a coupon that cannot be applied, rolls the whole order back; nothing is deducted without items.
+    """
+    now = datetime.utcnow()
+    try:
+        lines, subtotal = price_items(db, items)
+        order = Order(user_id=user_id, total=subtotal, created_at=now)
+        db.add(order)
+        db.flush()
+        total, coupon_id = subtotal, None
+        if coupon_code:
+            total, coupon_id = apply_coupon(db, coupon_code, user_id, order.id, subtotal, now)
+            order.total = total
+        _debit(db, user_id, total)
+        db.execute(insert(OrderItem), [
+            {"order_id": order.id, "product_id": line["product_id"], "quantity": line["quantity"], "price": line["price"]}
+            for line in lines
+        ])
+        db.add(WalletTransaction(user_id=user_id, amount=-total, timestamp=now, type="deduct", description=f"Order #{order.id}"))
+        webhooks.emit(db, webhooks.ORDER_CREATED, {
+            "order_id": order.id, "user_id": user_id, "total": total, "subtotal": subtotal,
+            "coupon_id": coupon_id, "created_at": now,
+            "items": [{"product_id": line["product_id"], "quantity": line["quantity"], "price": line["price"]} for line in lines],
+        })
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    leaderboard_feed.record_metric(user_id, leaderboard_feed.METRIC_ORDERS, 1)
+    leaderboard_feed.record_metric(user_id, leaderboard_feed.METRIC_SPEND, total)
+    return {"order_id": order.id, "total": total, "subtotal": subtotal, "coupon_id": coupon_id, "items": lines}
+
+
+def list_orders(db, cursor: int | None = None, limit: int = 50, user_id: int | None = None) -> list[dict]:
+    """Newest orders first, keyset on id, with username and item count from one grouped query."""
+    limit = max(1, min(limit, MAX_PAGE))
+    stmt = (
+        select(Order.id, Order.created_at, Order.total, User.name.label("username"),
+               func.count(OrderItem.id).label("item_count"))
+        .outerjoin(User, User.id == Order.user_id)
+        .outerjoin(OrderItem, OrderItem.order_id == Order.id)
+        .group_by(Order.id, Order.created_at, Order.total, User.name)
+        .order_by(Order.id.desc())
+        .limit(limit)
+    )
+    if cursor:
+        stmt = stmt.where(Order.id < cursor)
+    if user_id is not None:
+        stmt = stmt.where(Order.user_id == user_id)
+    return [
+        {
+            "id": r.id,
+            "datetime": r.created_at.isoformat() if r.created_at else None,
+            "status": "paid",  # placeholder; extend later
+            "username": r.username,
+            "action": "purchase",
+            "details": f"{r.item_count} items",
+            "amount": r.total,
+            "source": "wallet",
+        }
+        for r in db.execute(stmt)
+    ]
@@ -0,0 +1,301 @@
+import asyncio
+import hashlib
+import json
+import os
+import random
+import time
+from urllib.parse import urlencode
+
+import httpx
+
+from app import config
+from app.utils.cache import cache_key, get_cache
+
+CONNECT_TIMEOUT_SEC = float(os.getenv("PAYMENT_CONNECT_TIMEOUT_SEC", "3"))
+READ_TIMEOUT_SEC = float(os.getenv("PAYMENT_READ_TIMEOUT_SEC", "10"))
+MAX_RETRIES = int(os.getenv("PAYMENT_MAX_RETRIES", "2"))
+RETRY_BASE_SEC = float(os.getenv("PAYMENT_RETRY_BASE_SEC", "0.25"))
+# A repeated identical cart within this window returns the checkout already created for it
+CHECKOUT_TTL_SEC = int(os.getenv("PAYMENT_CHECKOUT_TTL_SEC", "1800"))
+
+_RETRY_STATUS = {409, 429, 500, 502, 503, 504}
+# Gateway statuses in which a checkout can still be paid, and so may be handed out again
+_OPEN_STATUS = {"stripe": {"open"}, "razorpay": {"created", "partially_paid"}}
+# Statuses in which it never can be again; only these start a successor checkout
+_CLOSED_STATUS = {"stripe": {"complete", "expired"}, "razorpay": {"paid", "expired", "cancelled"}}
+
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+# idempotency key -> in-flight creation, so a double click in this worker waits for the first call
+_inflight: dict[str, asyncio.Future] = {}
+
+
+class GatewayError(Exception):
+    def __init__(self, detail: str, status_code: int = 400):
+        super().__init__(detail)
+        self.detail = detail
+        self.status_code = status_code
+
+
+def client() -> httpx.AsyncClient:
+    """Pooled client shared by all gateway calls on the running loop."""
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(READ_TIMEOUT_SEC, connect=CONNECT_TIMEOUT_SEC),
+            limits=httpx.Limits(max_connections=20, max_keepalive_connections=10),
+        )
+        _client_loop = loop
+    return _client
+
+
+async def close() -> None:
+    global _client
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
+
+
+def cart_digest(user_id: int, gateway: str, currency: str, lines: list[dict]) -> str:
+    """Stable hash of who is paying for what: same cart in any order gives the same digest."""
+    qty: dict[int, int] = {}
+    for line in lines:
+        qty[line["product_id"]] = qty.get(line["product_id"], 0) + line["quantity"]
+    unit = {line["product_id"]: line["price"] for line in lines}
+    cart = [[pid, qty[pid], round(unit[pid], 2)] for pid in sorted(qty)]
+    raw = json.dumps([user_id, gateway, currency.lower(), cart], separators=(",", ":"))
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def idempotency_key(digest: str, now: float | None = None) -> tuple[str, int]:
+    """Gateway idempotency key for this cart in the current window, and seconds left in it."""
+    now = time.time() if now is None else now
+    window = int(now // CHECKOUT_TTL_SEC)
+    return f"{digest[:24]}-{window}", max(1, int((window + 1) * CHECKOUT_TTL_SEC - now))
+
+
+def _successor(base_key: str, previous_id: str) -> str:
+    """Key for the next checkout of a cart whose checkout under the current key was paid or expired.
+
+    Derived from the spent checkout's id, so concurrent retries still agree on it. Razorpay caps
+    reference_id at 40 characters.
+    """
+    return f"{base_key}-{hashlib.sha256(str(previous_id).encode()).hexdigest()[:6]}"
+
+
+def _pending_key(gateway: str, user_id: int, digest: str) -> str:
+    return cache_key("checkout", gateway, user_id, digest)
+
+
+def pending_checkout(gateway: str, user_id: int, digest: str) -> dict | None:
+    raw = get_cache().get(_pending_key(gateway, user_id, digest))
+    if not raw:
+        return None
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return None
+
+
+def remember_checkout(gateway: str, user_id: int, digest: str, checkout: dict, ttl: int) -> None:
+    try:
+        get_cache().set(_pending_key(gateway, user_id, digest), json.dumps(checkout), ex=ttl)
+    except Exception:
+        pass
+
+
+def forget_checkout(gateway: str, user_id: int, digest: str) -> None:
+    try:
+        get_cache().delete(_pending_key(gateway, user_id, digest))
+    except Exception:
+        pass
+
+
+async def _request(method: str, url: str, **kwargs) -> httpx.Response:
+    """Send with retries on timeouts, connection errors, 429 and 5xx; callers pass an idempotency key."""
+    for attempt in range(MAX_RETRIES + 1):
+        try:
+            resp = await client().request(method, url, **kwargs)
+        except httpx.TransportError as e:
+            if attempt == MAX_RETRIES:
+                raise GatewayError(f"Payment gateway unreachable: {e.__class__.__name__}", 502)
+        else:
+            if resp.status_code not in _RETRY_STATUS or attempt == MAX_RETRIES:
+                return resp
+        await asyncio.sleep(RETRY_BASE_SEC * (2 ** attempt) * (1 + random.random() / 2))
+    raise GatewayError("Payment gateway unreachable", 502)
+
+
+def _form(data, prefix: str = "") -> list[tuple[str, str]]:
+    """Flatten nested dicts/lists into Stripe's bracketed form fields."""
+    out = []
+    items = data.items() if isinstance(data, dict) else enumerate(data)
+    for k, v in items:
+        name = f"{prefix}[{k}]" if prefix else str(k)
+        if isinstance(v, (dict, list)):
+            out.extend(_form(v, name))
+        elif v is not None:
+            out.append((name, str(v).lower() if isinstance(v, bool) else str(v)))
+    return out
+
+
+def _error_detail(resp: httpx.Response) -> str:
+    try:
+        body = resp.json()
+    except ValueError:
+        return resp.text[:200]
+    err = body.get("error") if isinstance(body, dict) else None
+    if isinstance(err, dict):
+        return err.get("message") or err.get("description") or json.dumps(err)[:200]
+    return str(body)[:200]
+
+
+async def _stripe_session(user_id: int, lines: list[dict], currency: str, key: str) -> dict:
+    payload = {
+        "mode": "payment",
+        "success_url": config.STRIPE_SUCCESS_URL,
+        "cancel_url": config.STRIPE_CANCEL_URL,
+        "client_reference_id": str(user_id),
+        "metadata": {"user_id": str(user_id)},
+        "line_items": [
+            {
+                "price_data": {
+                    "currency": currency,
+                    "product_data": {"name": line["name"]},
+                    "unit_amount": int(round(line["price"] * 100)),
+                },
+                "quantity": line["quantity"],
+            }
+            for line in lines
+        ],
+    }
+    resp = await _request(
+        "POST", f"{config.STRIPE_API_BASE}/v1/checkout/sessions",
+        content=urlencode(_form(payload)),
+        headers={
+            "Authorization": f"Bearer {config.STRIPE_SECRET}",
+            "Idempotency-Key": f"primus-{key}",
+            "Content-Type": "application/x-www-form-urlencoded",
+        },
+    )
+    if resp.status_code >= 400:
+        raise GatewayError(f"Stripe error: {_error_detail(resp)}")
+    body = resp.json()
+    # A replayed key returns the original session, which may since have been paid
+    return {"id": body.get("id"), "url": body.get("url"), "status": body.get("status") or "open"}
+
+
+async def _razorpay_link(user, lines: list[dict], currency: str, key: str) -> dict:
+    auth = (config.RAZORPAY_KEY_ID, config.RAZORPAY_KEY_SECRET)
+    base = f"{config.RAZORPAY_API_BASE}/v1/payment_links"
+    payload = {
+        "amount": int(round(sum(line["price"] * line["quantity"] for line in lines) * 100)),
+        "currency": currency,
+        "description": ", ".join(f"{line['name']}x{line['quantity']}" for line in lines) or "Purchase",
+        # Razorpay has no idempotency header; a unique reference_id makes a retried create fail instead of duplicating
+        "reference_id": key,
+        "customer": {"name": getattr(user, "name", None) or "Customer", "email": getattr(user, "email", None)},
+        "notify": {"email": True},
+        "notes": {"user_id": str(user.id)},
+        "callback_url": config.RAZORPAY_SUCCESS_URL,
+        "callback_method": "get",
+    }
+    resp = await _request("POST", base, json=payload, auth=auth)
+    if resp.status_code == 400 and "reference_id" in resp.text:
+        # An earlier attempt went through; fetch the link it created (the caller checks its status)
+        found = await _request("GET", base, params={"reference_id": key}, auth=auth)
+        if found.status_code < 400:
+            links = found.json().get("payment_links") or []
+            if links:
+                link = links[0]
+                return {"id": link.get("id"), "url": link.get("short_url") or link.get("url"),
+                        "status": link.get("status") or "created"}
+    if resp.status_code >= 400:
+        raise GatewayError(f"Razorpay error: {_error_detail(resp)}")
+    body = resp.json()
+    return {"id": body.get("id"), "url": body.get("short_url") or body.get("url"), "status": body.get("status") or "created"}
+
+
+async def _status(gateway: str, checkout_id: str) -> str | None:
+    """Current gateway status of a checkout, or None when it cannot be fetched."""
+    if gateway == "stripe":
+        resp = await _request(
+            "GET", f"{config.STRIPE_API_BASE}/v1/checkout/sessions/{checkout_id}",
+            headers={"Authorization": f"Bearer {config.STRIPE_SECRET}"},
+        )
+    else:
+        resp = await _request(
+            "GET", f"{config.RAZORPAY_API_BASE}/v1/payment_links/{checkout_id}",
+            auth=(config.RAZORPAY_KEY_ID, config.RAZORPAY_KEY_SECRET),
+        )
+    if resp.status_code >= 400:
+        return None
+    return resp.json().get("status")
+
+
+async def _once(key: str, make):
+    pending = _inflight.get(key)
+    if pending is not None:
+        return await asyncio.shield(pending)
+    fut = asyncio.get_running_loop().create_future()
+    _inflight[key] = fut
+    try:
+        result = await make()
+        fut.set_result(result)
+        return result
+    except BaseException as e:
+        fut.set_exception(e)
+        # Mark retrieved so an unawaited failure is not logged
+        fut.exception()
+        raise
+    finally:
+        _inflight.pop(key, None)
+
+
+async def checkout(gateway: str, user, lines: list[dict]) -> dict:
+    """Create (or reuse) a hosted checkout for priced order lines; returns {"id", "url", "reused"}."""
+    if gateway == "stripe":
+        if not config.STRIPE_SECRET:
+            raise GatewayError("Stripe not configured")
+        currency = config.STRIPE_CURRENCY.lower()
+    elif gateway == "razorpay":
+        if not config.RAZORPAY_KEY_ID or not config.RAZORPAY_KEY_SECRET:
+            raise GatewayError("Razorpay not configured")
+        currency = config.RAZORPAY_CURRENCY.upper()
+    else:
+        raise GatewayError(f"Unknown gateway {gateway}")
+    digest = cart_digest(user.id, gateway, currency, lines)
+    base, ttl = idempotency_key(digest)
+    key = base
+    existing = await asyncio.to_thread(pending_checkout, gateway, user.id, digest)
+    if existing and existing.get("url"):
+        # Only hand out a checkout the customer can still pay; a paid one must not be reused
+        status = await _status(gateway, existing["id"])
+        if status in _OPEN_STATUS[gateway]:
+            return {"id": existing["id"], "url": existing["url"], "reused": True}
+        if status not in _CLOSED_STATUS[gateway]:
+            # Unknown (gateway error): it may still be open or already paid, so neither reuse nor replace it
+            raise GatewayError("Could not check the pending checkout with the payment gateway", 502)
+        await asyncio.to_thread(forget_checkout, gateway, user.id, digest)
+        key = _successor(base, existing["id"])
+
+    async def make(key: str):
+        if gateway == "stripe":
+            return await _stripe_session(user.id, lines, currency, key)
+        return await _razorpay_link(user, lines, currency, key)
+
+    for _ in range(3):
+        result = await _once(key, lambda: make(key))
+        if result.get("status") in _OPEN_STATUS[gateway]:
+            break
+        if result.get("status") not in _CLOSED_STATUS[gateway]:
+            raise GatewayError(f"Payment gateway returned a checkout in status {result.get('status')}", 502)
+        # The key already produced a checkout that was paid or expired (e.g. its cache entry was lost)
+        key = _successor(base, result.get("id"))
+    else:
+        raise GatewayError("Payment gateway keeps returning closed checkouts", 502)
+    created = {"id": result.get("id"), "url": result.get("url")}
+    if created["url"]:
+        await asyncio.to_thread(remember_checkout, gateway, user.id, digest, created, ttl)
+    return {**created, "reused": False}
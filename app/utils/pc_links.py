@@ -0,0 +1,32 @@
+from datetime import datetime
+
+from app.models import ClientPC, PC
+
+
+def link(db, client_pc) -> int | None:
+    """Attach a client PC to the pcs row with its name, creating that row if the name is free.
+
+    Leaves the client PC unlinked (None) when the row already belongs to another client PC;
+    an admin links it explicitly then. Call before the commit.
+    """
+    if client_pc.pc_id is not None or not client_pc.name:
+        return client_pc.pc_id
+    pc = db.query(PC).filter(PC.name == client_pc.name).first()
+    if pc is None:
+        pc = PC(name=client_pc.name, status="idle", last_seen=datetime.utcnow())
+        db.add(pc)
+        db.flush()
+    elif db.query(ClientPC.id).filter(ClientPC.pc_id == pc.id, ClientPC.id != client_pc.id).first() is not None:
+        return None
+    client_pc.pc_id = pc.id
+    return pc.id
+
+
+def backfill(db) -> int:
+    """Link client PCs registered before the mapping existed; returns how many were linked."""
+    linked = 0
+    for client_pc in db.query(ClientPC).filter(ClientPC.pc_id.is_(None)).order_by(ClientPC.id).all():
+        if link(db, client_pc) is not None:
+            linked += 1
+    db.commit()
+    return linked
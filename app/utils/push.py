@@ -0,0 +1,53 @@
+import json
+
+from app.models import ClientPC, User
+
+# Users whose clients listen on /ws/admin rather than on a PC socket
+ADMIN_ROLES = ("admin", "owner", "superadmin", "staff")
+
+
+def user_pc_ids(db, user_id: int) -> list[int]:
+    """Client PCs a user is currently signed in on."""
+    return [pc_id for (pc_id,) in db.query(ClientPC.id).filter(ClientPC.current_user_id == user_id).all()]
+
+
+def is_admin_user(db, user_id: int) -> bool:
+    role = db.query(User.role).filter(User.id == user_id).scalar()
+    return role in ADMIN_ROLES
+
+
+def route_for(db, user_id: int | None) -> dict:
+    """Where a payload for `user_id` (None = everyone) should be pushed; resolved while a session is open."""
+    if user_id is None:
+        return {"all": True}
+    return {"pcs": user_pc_ids(db, user_id), "admin": is_admin_user(db, user_id)}
+
+
+async def deliver(routes: list[dict], payload: dict) -> None:
+    """Push one payload along resolved routes; delivery is best effort and never raises."""
+    from app.ws import pc as ws_pc
+    from app.ws import admin as ws_admin
+
+    text = json.dumps(payload, default=str)
+    pcs: set[int] = set()
+    admin = False
+    for route in routes:
+        if route.get("all"):
+            try:
+                await ws_pc.broadcast(text)
+            except Exception:
+                pass
+            admin = True
+            continue
+        pcs.update(route.get("pcs", ()))
+        admin = admin or route.get("admin", False)
+    for pc_id in pcs:
+        try:
+            await ws_pc.notify_pc(pc_id, text)
+        except Exception:
+            pass
+    if admin:
+        try:
+            await ws_admin.broadcast_admin(text)
+        except Exception:
+            pass
@@ -0,0 +1,165 @@
+import logging
+
+from sqlalchemy import text
+
+from app.database import Base
+
+log = logging.getLogger(__name__)
+
+# Columns added to existing tables after they were first created, oldest first.
+# SQLite only: PostgreSQL deployments use Alembic for proper migrations.
+COLUMNS = {
+    "users": (
+        ("wallet_balance", "FLOAT DEFAULT 0.0"),
+        ("coins_balance", "INTEGER DEFAULT 0"),
+        ("user_group_id", "INTEGER"),
+        ("birthdate", "DATETIME"),
+        ("two_factor_secret", "TEXT"),
+        ("is_email_verified", "BOOLEAN DEFAULT 0"),
+        ("email_verification_sent_at", "DATETIME"),
+        ("first_name", "TEXT"),
+        ("last_name", "TEXT"),
+        ("phone", "TEXT"),
+        ("tos_accepted", "BOOLEAN DEFAULT 0"),
+        ("tos_accepted_at", "DATETIME"),
+    ),
+    "games": (
+        ("min_age", "INTEGER"),
+        ("catalog_version", "INTEGER DEFAULT 0"),
+    ),
+    "client_pcs": (
+        ("current_user_id", "INTEGER"),
+        ("device_id", "TEXT"),
+        ("bound", "BOOLEAN DEFAULT 0"),
+        ("bound_at", "DATETIME"),
+        ("grace_until", "DATETIME"),
+        ("suspended", "BOOLEAN DEFAULT 0"),
+        ("pc_id", "INTEGER"),
+    ),
+    # Content hash, size and dimensions
+    "screenshots": (
+        ("sha256", "TEXT"),
+        ("byte_size", "INTEGER"),
+        ("width", "INTEGER"),
+        ("height", "INTEGER"),
+    ),
+    # Structured columns (filled for old rows by audit_index.backfill)
+    "audit_logs": (
+        ("category", "TEXT"),
+        ("pc_id", "INTEGER"),
+        ("cafe_id", "INTEGER"),
+        ("target_id", "INTEGER"),
+    ),
+    # Conversation ids (existing rows are backfilled by chat.backfill_conversations)
+    "chat_messages": (
+        ("conversation_id", "TEXT"),
+    ),
+    # Order a coupon use was spent on
+    "coupon_redemptions": (
+        ("order_id", "INTEGER"),
+    ),
+    # Per-claim lease token
+    "webhook_deliveries": (
+        ("lease_token", "TEXT"),
+    ),
+    # Background job state and checksum
+    "backup_entries": (
+        ("status", "TEXT DEFAULT 'done'"),
+        ("compression", "TEXT"),
+        ("byte_size", "INTEGER"),
+        ("sha256", "TEXT"),
+        ("error", "TEXT"),
+        ("finished_at", "DATETIME"),
+        ("kind", "TEXT DEFAULT 'full'"),
+        ("parent_id", "INTEGER"),
+        ("image_sha256", "TEXT"),
+    ),
+}
+
+
+def add_missing_columns(engine) -> list[str]:
+    """ALTER in every column of COLUMNS a SQLite table lacks; returns the ones added."""
+    if engine.dialect.name != "sqlite":
+        return []
+    added = []
+    with engine.connect() as conn:
+        for table, columns in COLUMNS.items():
+            existing = {row[1] for row in conn.execute(text(f"PRAGMA table_info({table})"))}
+            if not existing:
+                continue
+            for col, ddl in columns:
+                if col not in existing:
+                    conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {col} {ddl}"))
+                    conn.commit()
+                    added.append(f"{table}.{col}")
+    return added
+
+
+def _link_client_pcs(engine) -> None:
+    from sqlalchemy.orm import Session
+
+    from app.utils import pc_links
+
+    with Session(bind=engine) as db:
+        pc_links.backfill(db)
+
+
+def upgrade(engine, strict: bool = False) -> None:
+    """Bring a database up to the current models: at startup, and on a restored copy before it is swapped in.
+
+    With `strict`, a table or column that cannot be created raises instead of being skipped.
+    """
+    from app import models  # noqa: F401  (registers every table on Base.metadata)
+    from app.utils import audit_index, settings_registry, telemetry_rollup
+    from app.utils import leaderboard as leaderboard_feed
+
+    Base.metadata.create_all(bind=engine)
+    try:
+        added = add_missing_columns(engine)
+    except Exception:
+        if strict:
+            raise
+        log.exception("Adding missing columns failed")
+    else:
+        if added:
+            log.info("Added columns: %s", ", ".join(added))
+
+    # Client PCs registered before they were linked to their pcs row
+    try:
+        _link_client_pcs(engine)
+    except Exception:
+        pass
+
+    # Settings upsert on (category, key): one-time check for duplicate pairs before the unique index is built.
+    # Without SETTINGS_DEDUPE_ON_START duplicates are only exported and the index is left out; settings
+    # are then written by id until they are resolved.
+    try:
+        settings_registry.prepare_unique_index(engine)
+    except Exception:
+        log.exception("Building the settings unique index failed; continuing without it")
+
+    # Leaderboard flushes upsert on (leaderboard, user, period); duplicate rows are summed into one first
+    try:
+        leaderboard_feed.prepare_unique_index(engine)
+    except Exception:
+        pass
+
+    # Telemetry rollups upsert on (pc, tier, metric, bucket); duplicate buckets are dropped first
+    try:
+        telemetry_rollup.prepare_unique_index(engine)
+    except Exception:
+        pass
+
+    # Ensure indexes declared on models also exist on tables created before the index was added
+    try:
+        for table in Base.metadata.tables.values():
+            for index in table.indexes:
+                index.create(bind=engine, checkfirst=True)
+    except Exception:
+        pass
+
+    # Full-text search over audit details (FTS5 on SQLite, tsvector on Postgres)
+    try:
+        audit_index.ensure_search(engine)
+    except Exception:
+        pass
@@ -0,0 +1,134 @@
+import asyncio
+import io
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    from PIL import Image, ImageDraw, features  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # type: ignore
+
+WORKERS = int(os.getenv("SCREENSHOT_WORKERS", "2"))
+# A failed generation is retried by a later request for the image, at most this often
+RETRY_SEC = int(os.getenv("SCREENSHOT_VARIANT_RETRY_SEC", "60"))
+
+# variant -> longest edge in pixels
+VARIANTS = {
+    "thumb": int(os.getenv("SCREENSHOT_THUMB_PX", "320")),
+    "preview": int(os.getenv("SCREENSHOT_PREVIEW_PX", "1280")),
+}
+CONTACT_CELL = (320, 200)
+CONTACT_LABEL_PX = 18
+
+_pool: ProcessPoolExecutor | None = None
+# The loop only keeps weak references to tasks; hold scheduled ones until they finish
+_tasks: set[asyncio.Task] = set()
+# originals with generation in flight, and originals whose last attempt failed -> monotonic time
+_scheduled: set[str] = set()
+_failed: dict[str, float] = {}
+
+
+def available() -> bool:
+    return Image is not None
+
+
+def _variant_format() -> tuple[str, str]:
+    if Image is not None and features.check("webp"):
+        return "WEBP", "webp"
+    return "JPEG", "jpg"
+
+
+def variant_path(original: str, variant: str) -> str:
+    """Variants live next to the original: <sha>.png -> <sha>.thumb.webp"""
+    _, ext = _variant_format()
+    base, _ = os.path.splitext(original)
+    return f"{base}.{variant}.{ext}"
+
+
+def make_variants(original: str) -> dict[str, str]:
+    """Runs in a worker process: write every missing variant of one screenshot."""
+    fmt, _ = _variant_format()
+    out = {}
+    with Image.open(original) as im:
+        im = im.convert("RGB")
+        for variant, edge in VARIANTS.items():
+            target = variant_path(original, variant)
+            out[variant] = target
+            if os.path.exists(target):
+                continue
+            copy = im.copy()
+            copy.thumbnail((edge, edge))
+            tmp = f"{target}.tmp"
+            copy.save(tmp, fmt, quality=80)
+            os.replace(tmp, target)
+    return out
+
+
+def render_contact_sheet(tiles: list[tuple[str, str]]) -> bytes:
+    """Runs in a worker process: composite (label, image path) tiles into one JPEG."""
+    cols = max(1, math.ceil(math.sqrt(len(tiles))))
+    rows = max(1, math.ceil(len(tiles) / cols))
+    cell_w, cell_h = CONTACT_CELL
+    sheet = Image.new("RGB", (cols * cell_w, rows * (cell_h + CONTACT_LABEL_PX)), (24, 24, 24))
+    draw = ImageDraw.Draw(sheet)
+    for i, (label, path) in enumerate(tiles):
+        x = (i % cols) * cell_w
+        y = (i // cols) * (cell_h + CONTACT_LABEL_PX)
+        try:
+            with Image.open(path) as im:
+                im = im.convert("RGB")
+                im.thumbnail(CONTACT_CELL)
+                sheet.paste(im, (x + (cell_w - im.width) // 2, y + (cell_h - im.height) // 2))
+        except Exception:
+            draw.rectangle([x, y, x + cell_w - 1, y + cell_h - 1], outline=(90, 90, 90))
+        draw.text((x + 4, y + cell_h + 2), label, fill=(230, 230, 230))
+    buf = io.BytesIO()
+    sheet.save(buf, "JPEG", quality=75)
+    return buf.getvalue()
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=WORKERS)
+    return _pool
+
+
+async def run_in_pool(fn, *args):
+    return await asyncio.wrap_future(_get_pool().submit(fn, *args))
+
+
+def schedule_variants(original: str) -> None:
+    """Fire-and-forget variant generation, after an upload or when a request finds a variant missing.
+
+    Call from the event loop. Skipped while one is already running for the original,
+    and for RETRY_SEC after one failed.
+    """
+    if not available() or original in _scheduled:
+        return
+    failed_at = _failed.get(original)
+    if failed_at is not None and time.monotonic() - failed_at < RETRY_SEC:
+        return
+
+    async def _run():
+        try:
+            await run_in_pool(make_variants, original)
+            _failed.pop(original, None)
+        except Exception:
+            _failed[original] = time.monotonic()
+        finally:
+            _scheduled.discard(original)
+
+    _scheduled.add(original)
+    task = asyncio.get_running_loop().create_task(_run())
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
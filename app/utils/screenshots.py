@@ -0,0 +1,398 @@
+import asyncio
+import hashlib
+import json
+import os
+import struct
+import tempfile
+from datetime import datetime, timedelta
+
+from sqlalchemy import func
+
+from app.utils.cache import get_cache, cache_key
+
+try:
+    from PIL import Image  # type: ignore
+except Exception:  # pragma: no cover
+    Image = None  # type: ignore
+
+UPLOAD_DIR = os.getenv("SCREENSHOT_DIR", "./screenshots")
+MAX_BYTES = int(os.getenv("SCREENSHOT_MAX_BYTES", str(10 * 1024 * 1024)))
+CHUNK_SIZE = 256 * 1024
+# Room for the multipart boundaries and part headers around the image itself
+MULTIPART_OVERHEAD = 64 * 1024
+
+
+class ScreenshotTooLarge(Exception):
+    pass
+
+
+class UnsupportedImage(Exception):
+    pass
+
+
+def _sniff_ext(head: bytes) -> str | None:
+    if head.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if head.startswith(b"\xff\xd8\xff"):
+        return "jpg"
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    return None
+
+
+def _png_size(head: bytes) -> tuple[int, int] | None:
+    # IHDR is always the first chunk: width/height are at bytes 16..24
+    if len(head) >= 24 and head[12:16] == b"IHDR":
+        return struct.unpack(">II", head[16:24])
+    return None
+
+
+def image_size(path: str, head: bytes = b"") -> tuple[int | None, int | None]:
+    if Image is not None:
+        try:
+            with Image.open(path) as im:  # reads the header only
+                return im.size
+        except Exception:
+            pass
+    size = _png_size(head)
+    return size if size else (None, None)
+
+
+def content_path(digest: str, ext: str) -> str:
+    """Content-addressed location: <dir>/ab/cd/<sha256>.<ext>"""
+    return os.path.join(UPLOAD_DIR, digest[:2], digest[2:4], f"{digest}.{ext}")
+
+
+def _finalize(tmp_path: str, digest: str, ext: str) -> tuple[str, bool]:
+    final = content_path(digest, ext)
+    if os.path.exists(final):
+        os.remove(tmp_path)
+        return final, False
+    os.makedirs(os.path.dirname(final), exist_ok=True)
+    os.replace(tmp_path, final)  # atomic on the same filesystem
+    return final, True
+
+
+async def store_upload(upload, max_bytes: int = MAX_BYTES) -> dict:
+    """Stream an UploadFile to disk without blocking the event loop.
+
+    Chunks are hashed while they are written to a temp file in UPLOAD_DIR, so the
+    final rename is atomic and identical images share one file. The size check here
+    is exact; UploadLimit stops oversized requests before they are spooled at all.
+    """
+    os.makedirs(UPLOAD_DIR, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix=".upload-", dir=UPLOAD_DIR)
+    out = os.fdopen(fd, "wb")
+    sha = hashlib.sha256()
+    size = 0
+    head = b""
+    try:
+        while True:
+            chunk = await upload.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise ScreenshotTooLarge(f"Screenshot exceeds {max_bytes} bytes")
+            if len(head) < 64:
+                head += chunk[:64 - len(head)]
+            sha.update(chunk)
+            await asyncio.to_thread(out.write, chunk)
+        await asyncio.to_thread(out.close)
+        ext = _sniff_ext(head)
+        if ext is None:
+            raise UnsupportedImage("Unsupported image format")
+        digest = sha.hexdigest()
+        final, created = await asyncio.to_thread(_finalize, tmp_path, digest, ext)
+        width, height = await asyncio.to_thread(image_size, final, head)
+        return {
+            "path": final,
+            "sha256": digest,
+            "byte_size": size,
+            "width": width,
+            "height": height,
+            "format": ext,
+            "created": created,
+        }
+    except BaseException:
+        try:
+            out.close()
+        except Exception:
+            pass
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+class UploadLimit:
+    """ASGI middleware capping request bodies under `path_prefix` before the form parser spools them.
+
+    A declared Content-Length over the cap is refused outright; otherwise the body is counted as
+    it streams in and the request is cut off with 413 as soon as it passes the cap.
+    """
+
+    def __init__(self, app, path_prefix: str, max_bytes: int = MAX_BYTES + MULTIPART_OVERHEAD):
+        self.app = app
+        self.path_prefix = path_prefix
+        self.max_bytes = max_bytes
+
+    async def _reject(self, send) -> None:
+        body = json.dumps({"detail": f"Screenshot exceeds {MAX_BYTES} bytes"}).encode()
+        await send({"type": "http.response.start", "status": 413, "headers": [
+            (b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()),
+            (b"connection", b"close"),
+        ]})
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not scope["path"].startswith(self.path_prefix):
+            await self.app(scope, receive, send)
+            return
+        for name, value in scope.get("headers") or []:
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    declared = 0
+                if declared > self.max_bytes:
+                    await self._reject(send)
+                    return
+        received = 0
+        rejected = False
+
+        async def limited_receive():
+            nonlocal received, rejected
+            if rejected:
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_bytes:
+                    rejected = True
+                    await self._reject(send)
+                    # The app sees a client disconnect and stops reading
+                    return {"type": "http.disconnect"}
+            return message
+
+        async def guarded_send(message):
+            if not rejected:
+                await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            if not rejected:
+                raise
+
+
+# ---- Latest screenshot per PC ----
+
+RETENTION_DAYS = int(os.getenv("SCREENSHOT_RETENTION_DAYS", "14"))
+MAX_PER_PC = int(os.getenv("SCREENSHOT_MAX_PER_PC", "500"))
+RETENTION_BATCH = int(os.getenv("SCREENSHOT_RETENTION_BATCH", "500"))
+RETENTION_INTERVAL_SEC = int(os.getenv("SCREENSHOT_RETENTION_INTERVAL_SEC", "3600"))
+# The cached index is reconciled with the DB this often, for rows written or removed outside the API
+LATEST_TTL_SEC = int(os.getenv("SCREENSHOT_LATEST_TTL_SEC", "300"))
+
+_LATEST_HASH = cache_key("screenshots", "latest")
+# Set when the hash has been loaded from the DB, so uploads alone never leave it partial; expires
+# after LATEST_TTL_SEC so the next read reloads it
+_LATEST_WARM = cache_key("screenshots", "latest", "warm")
+
+
+def _latest_entry(ss) -> dict:
+    return {"id": ss.id, "pc_id": ss.pc_id, "image_url": ss.image_url, "timestamp": ss.timestamp}
+
+
+def _encode_latest(ss) -> str:
+    return json.dumps({**_latest_entry(ss), "timestamp": ss.timestamp.isoformat()})
+
+
+def remember_latest(ss) -> None:
+    """Called on upload: the new row is the latest for its PC."""
+    try:
+        get_cache().hset(_LATEST_HASH, str(ss.pc_id), _encode_latest(ss))
+    except Exception:
+        pass
+
+
+def _warm_latest(db) -> None:
+    """Newest row per PC in one grouped query over the (pc_id, timestamp) index."""
+    from app.models import Screenshot, PC
+
+    # Read first: anything uploaded while the load runs has a higher id and is left alone
+    newest_id = db.query(func.max(Screenshot.id)).scalar() or 0
+    subq = db.query(
+        Screenshot.pc_id, func.max(Screenshot.timestamp).label("max_ts")
+    ).group_by(Screenshot.pc_id).subquery()
+    rows = db.query(Screenshot).join(
+        subq, (Screenshot.pc_id == subq.c.pc_id) & (Screenshot.timestamp == subq.c.max_ts)
+    ).join(PC, PC.id == Screenshot.pc_id).order_by(Screenshot.pc_id, Screenshot.id.desc()).all()
+    latest = {}
+    for ss in rows:
+        latest.setdefault(ss.pc_id, ss)
+    cache = get_cache()
+    cached = {}
+    for pc_id, raw in cache.hgetall(_LATEST_HASH).items():
+        try:
+            cached[pc_id] = json.loads(raw)["id"]
+        except (ValueError, KeyError, TypeError):
+            cached[pc_id] = 0
+    # Keep entries that came from uploads racing this load; drop PCs the DB no longer has
+    fresh = {str(pc_id): _encode_latest(ss) for pc_id, ss in latest.items()
+             if cached.get(str(pc_id), 0) <= ss.id}
+    stale = [pc_id for pc_id, ss_id in cached.items()
+             if ss_id <= newest_id and not (pc_id.isdigit() and int(pc_id) in latest)]
+    if fresh:
+        cache.hset(_LATEST_HASH, mapping=fresh)
+    if stale:
+        cache.hdel(_LATEST_HASH, *stale)
+    cache.set(_LATEST_WARM, "1", ex=LATEST_TTL_SEC)
+
+
+def latest_all(db) -> list[dict]:
+    """Latest screenshot of every PC, O(#PCs) from the cache."""
+    try:
+        cache = get_cache()
+        if not cache.get(_LATEST_WARM):
+            _warm_latest(db)
+        rows = [json.loads(v) for v in cache.hgetall(_LATEST_HASH).values()]
+    except Exception:
+        from app.models import Screenshot, PC
+
+        rows = []
+        # Cache unavailable: same grouped query, answered directly
+        subq = db.query(
+            Screenshot.pc_id, func.max(Screenshot.id).label("max_id")
+        ).group_by(Screenshot.pc_id).subquery()
+        for ss in db.query(Screenshot).join(subq, Screenshot.id == subq.c.max_id).join(PC, PC.id == Screenshot.pc_id).all():
+            rows.append({**_latest_entry(ss), "timestamp": ss.timestamp.isoformat()})
+    for r in rows:
+        r["timestamp"] = datetime.fromisoformat(r["timestamp"])
+    return sorted(rows, key=lambda r: r["pc_id"])
+
+
+def _forget_latest(db, pc_ids) -> None:
+    """Drop cache entries of PCs that have no screenshots left after pruning."""
+    from app.models import Screenshot
+
+    if not pc_ids:
+        return
+    remaining = {p for (p,) in db.query(Screenshot.pc_id).filter(
+        Screenshot.pc_id.in_(list(pc_ids))
+    ).distinct().all()}
+    gone = [str(p) for p in pc_ids if p not in remaining]
+    try:
+        if gone:
+            get_cache().hdel(_LATEST_HASH, *gone)
+    except Exception:
+        pass
+
+
+def reset_latest() -> None:
+    """Drop the cached index; the next latest_all() rebuilds it from the DB."""
+    try:
+        get_cache().delete(_LATEST_HASH, _LATEST_WARM)
+    except Exception:
+        pass
+
+
+# ---- Retention ----
+
+def _remove_files(db, digests_to_paths: dict[str, str]) -> int:
+    """Delete files (and variants) whose content hash is no longer referenced by any row."""
+    from app.models import Screenshot
+    from app.utils import screenshot_images
+
+    if not digests_to_paths:
+        return 0
+    still_used = {d for (d,) in db.query(Screenshot.sha256).filter(
+        Screenshot.sha256.in_(list(digests_to_paths.keys()))
+    ).distinct().all()}
+    removed = 0
+    for digest, path in digests_to_paths.items():
+        if digest in still_used:
+            continue
+        candidates = [path] + [screenshot_images.variant_path(path, v) for v in screenshot_images.VARIANTS]
+        for p in candidates:
+            try:
+                os.remove(p)
+                removed += 1
+            except OSError:
+                pass
+    return removed
+
+
+def _delete_rows(db, rows) -> tuple[int, int]:
+    from app.models import Screenshot
+
+    if not rows:
+        return 0, 0
+    ids = [r.id for r in rows]
+    # Legacy rows without a hash own their file exclusively
+    digests = {(r.sha256 or f"path:{r.image_url}"): r.image_url for r in rows}
+    db.query(Screenshot).filter(Screenshot.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    legacy = {d: p for d, p in digests.items() if d.startswith("path:")}
+    files = _remove_files(db, {d: p for d, p in digests.items() if d not in legacy})
+    for path in legacy.values():
+        try:
+            os.remove(path)
+            files += 1
+        except OSError:
+            pass
+    return len(ids), files
+
+
+def prune(db, now: datetime | None = None) -> dict:
+    """Drop rows older than RETENTION_DAYS or beyond MAX_PER_PC per PC, in batches."""
+    from app.models import Screenshot
+
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=RETENTION_DAYS)
+    rows_deleted = files_deleted = 0
+    touched_pcs: set[int] = set()
+    while True:
+        batch = db.query(Screenshot).filter(Screenshot.timestamp < cutoff).order_by(Screenshot.id).limit(RETENTION_BATCH).all()
+        if not batch:
+            break
+        touched_pcs.update(r.pc_id for r in batch)
+        r, f = _delete_rows(db, batch)
+        rows_deleted += r
+        files_deleted += f
+    if MAX_PER_PC > 0:
+        over = db.query(Screenshot.pc_id).group_by(Screenshot.pc_id).having(func.count(Screenshot.id) > MAX_PER_PC).all()
+        for (pc_id,) in over:
+            while True:
+                batch = db.query(Screenshot).filter(Screenshot.pc_id == pc_id).order_by(
+                    Screenshot.timestamp.desc(), Screenshot.id.desc()
+                ).offset(MAX_PER_PC).limit(RETENTION_BATCH).all()
+                if not batch:
+                    break
+                r, f = _delete_rows(db, batch)
+                rows_deleted += r
+                files_deleted += f
+    # Age pruning can only remove a PC's newest row when it removed all of them
+    _forget_latest(db, touched_pcs)
+    return {"rows": rows_deleted, "files": files_deleted}
+
+
+def _prune_once() -> None:
+    from app.database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        prune(db)
+    finally:
+        db.close()
+
+
+async def retention_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_prune_once)
+        except Exception:
+            pass
+        await asyncio.sleep(RETENTION_INTERVAL_SEC)
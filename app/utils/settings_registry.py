@@ -0,0 +1,285 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+from sqlalchemy import inspect, insert, text, tuple_, update
+from sqlalchemy.exc import OperationalError, ProgrammingError
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database import SessionLocal
+from app.models import Setting
+from app.utils import versions
+
+COUNTER = "settings"
+UNIQUE_INDEX = "uq_settings_category_key"
+# Startup only removes duplicate (category, key) rows when this is set; otherwise it refuses to start
+DEDUPE_ON_START = os.getenv("SETTINGS_DEDUPE_ON_START", "").lower() in ("1", "true", "yes")
+DEDUPE_EXPORT_DIR = os.getenv("SETTINGS_DEDUPE_EXPORT_DIR", ".")
+# Other workers' writes are seen within this long; this worker's own writes immediately
+CHECK_INTERVAL_SEC = float(os.getenv("SETTINGS_CHECK_SEC", "1"))
+PUSH_INTERVAL_SEC = float(os.getenv("SETTINGS_PUSH_SEC", "1"))
+
+_FIELDS = ("id", "category", "key", "value_type", "description", "updated_by", "updated_at", "is_public")
+
+log = logging.getLogger(__name__)
+
+_lock = threading.Lock()
+_state: dict = {"version": None, "by_key": {}, "by_id": {}}
+_checked = {"at": 0.0, "bumps": -1}
+# Set once an upsert finds uq_settings_category_key missing (its migration failed); writes then go by id
+_unindexed = {"missing": False}
+
+
+def parse_value(value: str | int | float | bool | dict | list | None, value_type: str):
+    """Parse string value to appropriate type"""
+    # If already parsed or None, return as-is
+    if value is None or isinstance(value, (bool, int, float, dict, list)):
+        return value
+    if value_type == "boolean":
+        return value.lower() in ("true", "1", "yes")
+    elif value_type == "number":
+        try:
+            return int(value)
+        except ValueError:
+            try:
+                return float(value)
+            except ValueError:
+                return value
+    elif value_type == "json":
+        try:
+            return json.loads(value)
+        except json.JSONDecodeError:
+            return value
+    return value
+
+
+def serialize_value(value, value_type: str) -> str:
+    """Convert value to string for storage"""
+    if value_type == "json" and isinstance(value, (dict, list)):
+        return json.dumps(value)
+    return str(value)
+
+
+def _has_unique_index(bind) -> bool:
+    return any(ix["name"] == UNIQUE_INDEX for ix in inspect(bind).get_indexes(Setting.__tablename__))
+
+
+def prepare_unique_index(engine) -> int:
+    """One-time migration before uq_settings_category_key is built; returns rows removed.
+
+    Does nothing once the index exists. Duplicate pairs are exported to a JSONL
+    file first; they are only deleted (keeping the newest row of each pair) when
+    SETTINGS_DEDUPE_ON_START is set, otherwise this raises with the export path
+    (startup logs it and runs without the index, see _upsert).
+    """
+    if not inspect(engine).has_table(Setting.__tablename__) or _has_unique_index(engine):
+        return 0
+    with engine.begin() as conn:
+        dupes = [dict(r) for r in conn.execute(text(
+            "SELECT * FROM settings WHERE id NOT IN (SELECT MAX(id) FROM settings GROUP BY category, key) ORDER BY id"
+        )).mappings()]
+        if not dupes:
+            return 0
+        path = os.path.join(DEDUPE_EXPORT_DIR, f"settings_duplicates_{datetime.utcnow():%Y%m%d%H%M%S}.jsonl")
+        with open(path, "w", encoding="utf-8") as fh:
+            for row in dupes:
+                fh.write(json.dumps(row, default=str) + "\n")
+        if not DEDUPE_ON_START:
+            raise RuntimeError(
+                f"{len(dupes)} duplicate settings rows block the {UNIQUE_INDEX} index; they were exported to "
+                f"{path}. Resolve them, or set SETTINGS_DEDUPE_ON_START=1 to keep the newest row of each pair."
+            )
+        conn.execute(Setting.__table__.delete().where(Setting.__table__.c.id.in_([r["id"] for r in dupes])))
+        # Build the index in the same transaction so this never runs again
+        conn.execute(text(f"CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_INDEX} ON settings (category, key)"))
+    log.warning("Removed %d duplicate settings rows before building %s; exported to %s", len(dupes), UNIQUE_INDEX, path)
+    return len(dupes)
+
+
+def changed(db) -> int:
+    """Call in the transaction that writes settings; other workers reload on the new version."""
+    return versions.bump(db, COUNTER)
+
+
+def _upsert(db, rows: list[dict]) -> None:
+    table = Setting.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql") and not _unindexed["missing"]:
+        stmt = (sqlite_insert if dialect == "sqlite" else pg_insert)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.category, table.c.key],
+            set_={c: stmt.excluded[c] for c in ("value", "value_type", "description", "updated_by", "updated_at")},
+        )
+        try:
+            # ON CONFLICT needs the unique index; a savepoint keeps the transaction usable if it is missing
+            with db.begin_nested():
+                db.execute(stmt, [{k: v for k, v in r.items() if k != "id"} for r in rows])
+            return
+        except (OperationalError, ProgrammingError):
+            if _has_unique_index(db.connection()):
+                raise
+            log.warning("%s is missing; settings are written by id until restart", UNIQUE_INDEX)
+            _unindexed["missing"] = True
+    updates = [r for r in rows if r.get("id")]
+    inserts = [{k: v for k, v in r.items() if k != "id"} for r in rows if not r.get("id")]
+    if updates:
+        db.execute(update(Setting), updates)
+    if inserts:
+        db.execute(insert(table), inserts)
+
+
+def bulk_upsert(db, items: list[dict], user_id: int | None) -> tuple[list[dict], dict]:
+    """Write many settings in one transaction: one read, one upsert, one version bump.
+
+    Items are {category, key, value, value_type, description}; a repeated pair
+    keeps its last occurrence and unchanged pairs are not rewritten. Returns
+    the stored rows (typed) and {"created": [...], "updated": [(name, old, new)]}
+    for the caller's single audit entry. The caller commits.
+    """
+    wanted = {(i["category"], i["key"]): i for i in items}
+    if not wanted:
+        return [], {"created": [], "updated": []}
+    pairs = list(wanted)
+    current = {
+        (r.category, r.key): r
+        for r in db.query(Setting.id, Setting.category, Setting.key, Setting.value, Setting.value_type, Setting.description)
+        .filter(tuple_(Setting.category, Setting.key).in_(pairs)).all()
+    }
+    now = datetime.utcnow()
+    rows, changes = [], {"created": [], "updated": []}
+    for pair, item in wanted.items():
+        stored = serialize_value(item["value"], item["value_type"])
+        old = current.get(pair)
+        name = f"{pair[0]}.{pair[1]}"
+        if old is not None and (old.value, old.value_type, old.description) == (stored, item["value_type"], item.get("description")):
+            continue
+        rows.append({
+            "id": old.id if old is not None else None,
+            "category": pair[0], "key": pair[1], "value": stored, "value_type": item["value_type"],
+            "description": item.get("description"), "updated_by": user_id, "updated_at": now,
+        })
+        if old is None:
+            changes["created"].append(name)
+        else:
+            changes["updated"].append((name, parse_value(old.value, old.value_type), parse_value(stored, item["value_type"])))
+    if rows:
+        _upsert(db, rows)
+        changed(db)
+    saved = []
+    for s in db.query(Setting).filter(tuple_(Setting.category, Setting.key).in_(pairs)).all():
+        row = {f: getattr(s, f) for f in _FIELDS}
+        row["value"] = parse_value(s.value, s.value_type)
+        saved.append(row)
+    order = {pair: n for n, pair in enumerate(pairs)}
+    saved.sort(key=lambda r: order[(r["category"], r["key"])])
+    return saved, changes
+
+
+def _load(db, version: int) -> dict:
+    by_key, by_id = {}, {}
+    for s in db.query(Setting).all():
+        row = {f: getattr(s, f) for f in _FIELDS}
+        row["value"] = parse_value(s.value, s.value_type)
+        by_key[(s.category, s.key)] = row
+        by_id[s.id] = row
+    return {"version": version, "by_key": by_key, "by_id": by_id}
+
+
+def _current(db) -> dict:
+    global _state
+    now = time.monotonic()
+    bumps = versions.local_bumps()
+    if now - _checked["at"] < CHECK_INTERVAL_SEC and bumps == _checked["bumps"] and _state["version"] is not None:
+        return _state
+    version = versions.current(db, COUNTER)
+    _checked.update(at=now, bumps=bumps)
+    if version != _state["version"]:
+        state = _load(db, version)
+        with _lock:
+            _state = state
+    return _state
+
+
+def version(db) -> int:
+    return _current(db)["version"]
+
+
+def get(db, category: str, key: str, default=None):
+    """Typed value of one setting."""
+    row = _current(db)["by_key"].get((category, key))
+    return default if row is None else row["value"]
+
+
+def get_row(db, setting_id: int) -> dict | None:
+    return _current(db)["by_id"].get(setting_id)
+
+
+def rows(db, category: str | None = None, key: str | None = None, public_only: bool = False) -> list[dict]:
+    out = []
+    for row in _current(db)["by_id"].values():
+        if category and row["category"] != category:
+            continue
+        if key and row["key"] != key:
+            continue
+        if public_only and not row["is_public"]:
+            continue
+        out.append(row)
+    return sorted(out, key=lambda r: r["id"])
+
+
+def _public(state: dict) -> dict:
+    return {f"{r['category']}.{r['key']}": r["value"] for r in state["by_id"].values() if r["is_public"]}
+
+
+def public_values(db) -> dict:
+    """{"category.key": value} for settings clients may read."""
+    return _public(_current(db))
+
+
+def reset() -> None:
+    """Forget the loaded settings (e.g. after a database restore)."""
+    global _state
+    with _lock:
+        _state = {"version": None, "by_key": {}, "by_id": {}}
+    _checked.update(at=0.0)
+
+
+def _public_snapshot() -> tuple[int, dict]:
+    db = SessionLocal()
+    try:
+        state = _current(db)
+        return state["version"], _public(state)
+    finally:
+        db.close()
+
+
+async def push_loop():
+    """Push changed public settings to connected PCs whenever the settings version moves."""
+    from app.ws import pc as ws_pc
+
+    pushed_version = None
+    pushed: dict = {}
+    while True:
+        await asyncio.sleep(PUSH_INTERVAL_SEC)
+        try:
+            current_version, values = await asyncio.to_thread(_public_snapshot)
+            if pushed_version is None:
+                pushed_version, pushed = current_version, values
+                continue
+            if current_version == pushed_version:
+                continue
+            diff = {k: v for k, v in values.items() if k not in pushed or pushed[k] != v}
+            removed = [k for k in pushed if k not in values]
+            pushed_version, pushed = current_version, values
+            if (diff or removed) and ws_pc.connected_pc_ids():
+                await ws_pc.broadcast(json.dumps(
+                    {"type": "settings", "version": current_version, "changed": diff, "removed": removed},
+                    default=str,
+                ))
+        except Exception:
+            pass
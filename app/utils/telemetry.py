@@ -0,0 +1,185 @@
+import asyncio
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+
+from app.database import SessionLocal
+from app.models import ClientPC, HardwareStat
+from app.utils import hardware_latest, hardware_alerts
+
+# Flush when this many samples are buffered, or after this many ms, whichever comes first
+FLUSH_MAX_ROWS = int(os.getenv("TELEMETRY_FLUSH_ROWS", "500"))
+FLUSH_MAX_MS = int(os.getenv("TELEMETRY_FLUSH_MS", "2000"))
+MAX_SAMPLES_PER_BATCH = int(os.getenv("TELEMETRY_MAX_BATCH", "1000"))
+# Upper bound kept in memory while the DB is unavailable; oldest samples are dropped first
+MAX_BUFFERED_ROWS = int(os.getenv("TELEMETRY_MAX_BUFFERED", "50000"))
+# Agent timestamps in the future are clamped to now; samples older than this are rejected
+MAX_SAMPLE_AGE_SEC = int(os.getenv("TELEMETRY_MAX_SAMPLE_AGE_SEC", "3600"))
+
+METRIC_FIELDS = ("cpu_percent", "ram_percent", "disk_percent", "gpu_percent", "temp")
+
+
+class TelemetryBuffer:
+    """Thread-safe in-memory buffer of pending hardware_stats rows."""
+
+    def __init__(self, max_rows: int = FLUSH_MAX_ROWS) -> None:
+        self.max_rows = max_rows
+        self._rows: list[dict] = []
+        self._lock = threading.Lock()
+        self.total_written = 0
+        self.total_rejected = 0
+        self.last_flush_ts = time.monotonic()
+
+    def add(self, rows: list[dict]) -> bool:
+        """Append rows; returns True when the size threshold is reached."""
+        with self._lock:
+            self._rows.extend(rows)
+            return len(self._rows) >= self.max_rows
+
+    def drain(self) -> list[dict]:
+        with self._lock:
+            rows, self._rows = self._rows, []
+            return rows
+
+    def requeue(self, rows: list[dict]) -> None:
+        with self._lock:
+            self._rows[:0] = rows
+            if len(self._rows) > MAX_BUFFERED_ROWS:
+                del self._rows[:len(self._rows) - MAX_BUFFERED_ROWS]
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._rows)
+
+
+_buffer = TelemetryBuffer()
+_loop: asyncio.AbstractEventLoop | None = None
+_wakeup: asyncio.Event | None = None
+
+
+def _to_row(pc_id: int, sample: dict, now: datetime) -> dict | None:
+    try:
+        row = {"pc_id": int(pc_id)}
+        for field in METRIC_FIELDS:
+            value = sample.get(field)
+            row[field] = float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+    if row["cpu_percent"] is None or row["ram_percent"] is None or row["disk_percent"] is None:
+        return None
+    ts = sample.get("timestamp")
+    if isinstance(ts, str):
+        try:
+            ts = datetime.fromisoformat(ts)
+        except ValueError:
+            ts = None
+    if isinstance(ts, datetime) and ts.tzinfo is not None:
+        ts = ts.replace(tzinfo=None)
+    # Agent clocks drift: nothing from the future; a backlog older than the replay window is dropped
+    if not isinstance(ts, datetime) or ts > now:
+        ts = now
+    if ts < now - timedelta(seconds=MAX_SAMPLE_AGE_SEC):
+        return None
+    row["timestamp"] = ts
+    return row
+
+
+def can_report(db, user, pc_id: int) -> bool:
+    """Whether a user token may send telemetry for a PC: admins, or the user signed in on that PC."""
+    if user is None:
+        return False
+    if user.role in hardware_alerts.ADMIN_ROLES:
+        return True
+    return db.query(ClientPC.id).filter(ClientPC.id == pc_id, ClientPC.current_user_id == user.id).first() is not None
+
+
+def observe(rows: list[dict]) -> None:
+    """Feed accepted samples to the in-memory consumers (latest snapshot, anomaly detector)."""
+    hardware_latest.update(rows)
+    hardware_alerts.observe(rows)
+
+
+def ingest_samples(pc_id: int, samples: list[dict]) -> int:
+    """Validate and buffer samples for one PC. Returns the number accepted; the rest count as rejected."""
+    now = datetime.utcnow()
+    samples = samples[:MAX_SAMPLES_PER_BATCH]
+    rows = []
+    for sample in samples:
+        row = _to_row(pc_id, sample, now)
+        if row is not None:
+            rows.append(row)
+    _buffer.total_rejected += len(samples) - len(rows)
+    if not rows:
+        return 0
+    observe(rows)
+    if _buffer.add(rows):
+        _request_flush()
+    return len(rows)
+
+
+def _request_flush() -> None:
+    if _loop is not None and _wakeup is not None and _loop.is_running():
+        _loop.call_soon_threadsafe(_wakeup.set)
+    else:
+        # No background loop (scripts, tests): write inline; failed rows stay buffered
+        try:
+            flush()
+        except Exception:
+            pass
+
+
+def flush(db=None) -> int:
+    """Write all buffered samples with a single multi-row INSERT."""
+    rows = _buffer.drain()
+    if not rows:
+        return 0
+    own = db is None
+    db = db or SessionLocal()
+    try:
+        db.execute(insert(HardwareStat), rows)
+        db.commit()
+        _buffer.total_written += len(rows)
+        _buffer.last_flush_ts = time.monotonic()
+        return len(rows)
+    except Exception:
+        db.rollback()
+        _buffer.requeue(rows)
+        raise
+    finally:
+        if own:
+            db.close()
+
+
+def stats() -> dict:
+    return {
+        "buffered": len(_buffer),
+        "written": _buffer.total_written,
+        "rejected": _buffer.total_rejected,
+        "seconds_since_flush": round(time.monotonic() - _buffer.last_flush_ts, 3),
+    }
+
+
+async def flush_loop():
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=FLUSH_MAX_MS / 1000.0)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            await asyncio.to_thread(flush)
+        except Exception:
+            pass
+
+
+def flush_on_shutdown() -> None:
+    try:
+        flush()
+    except Exception:
+        pass
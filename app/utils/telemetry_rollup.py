@@ -0,0 +1,282 @@
+import asyncio
+import logging
+import math
+import os
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from sqlalchemy import func, inspect, insert, text
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+
+from app.database import SessionLocal
+from app.models import HardwareStat, HardwareRollup
+from app.utils.telemetry import METRIC_FIELDS
+
+# Raw samples are kept this long; older data is only available from the rollup tiers
+RAW_RETENTION_HOURS = int(os.getenv("TELEMETRY_RAW_RETENTION_HOURS", "24"))
+
+# (name, bucket seconds, retention days)
+TIERS = [
+    ("1m", 60, int(os.getenv("TELEMETRY_1M_RETENTION_DAYS", "7"))),
+    ("15m", 900, int(os.getenv("TELEMETRY_15M_RETENTION_DAYS", "90"))),
+    ("1h", 3600, int(os.getenv("TELEMETRY_1H_RETENTION_DAYS", "730"))),
+]
+
+# Buckets are only closed this long after they end, so late batched samples still count
+ROLLUP_GRACE_SEC = int(os.getenv("TELEMETRY_ROLLUP_GRACE_SEC", "300"))
+ROLLUP_INTERVAL_SEC = int(os.getenv("TELEMETRY_ROLLUP_INTERVAL_SEC", "60"))
+# Raw window processed per chunk while catching up on history
+ROLLUP_CHUNK = timedelta(hours=int(os.getenv("TELEMETRY_ROLLUP_CHUNK_HOURS", "2")))
+PRUNE_BATCH = int(os.getenv("TELEMETRY_PRUNE_BATCH", "5000"))
+
+UNIQUE_INDEX = "uq_hardware_rollups_pc_tier_metric_bucket"
+
+_EPOCH = datetime(1970, 1, 1)
+
+log = logging.getLogger(__name__)
+
+# Highest hardware_stats id this worker has checked for samples that landed behind a watermark.
+# Starts at the current max on the first run; late rows written while no worker was running are not re-rolled.
+_raw_seen: int | None = None
+
+
+def floor_bucket(ts: datetime, seconds: int) -> datetime:
+    offset = int((ts - _EPOCH).total_seconds())
+    return _EPOCH + timedelta(seconds=offset - offset % seconds)
+
+
+def _p95(values: list[float]) -> float:
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(0.95 * len(ordered)) - 1)]
+
+
+def _watermark(db, tier_seconds: int) -> datetime | None:
+    """Start of the first bucket of this tier that has not been rolled up yet."""
+    last = db.query(func.max(HardwareRollup.bucket_start)).filter(HardwareRollup.tier == tier_seconds).scalar()
+    if last is not None:
+        return last + timedelta(seconds=tier_seconds)
+    first_raw = db.query(func.min(HardwareStat.timestamp)).scalar()
+    return floor_bucket(first_raw, tier_seconds) if first_raw else None
+
+
+def prepare_unique_index(engine) -> int:
+    """One-time migration before uq_hardware_rollups_pc_tier_metric_bucket is built; returns rows removed.
+
+    Does nothing once the index exists. Duplicates come from overlapping rollups of the same
+    raw samples, so the newest row of each bucket is kept.
+    """
+    insp = inspect(engine)
+    if not insp.has_table(HardwareRollup.__tablename__):
+        return 0
+    if any(ix["name"] == UNIQUE_INDEX for ix in insp.get_indexes(HardwareRollup.__tablename__)):
+        return 0
+    with engine.begin() as conn:
+        removed = conn.execute(text(
+            "DELETE FROM hardware_rollups WHERE id NOT IN "
+            "(SELECT MAX(id) FROM hardware_rollups GROUP BY pc_id, tier, metric, bucket_start)"
+        )).rowcount
+        # Build the index in the same transaction so this never runs again
+        conn.execute(text(
+            f"CREATE UNIQUE INDEX IF NOT EXISTS {UNIQUE_INDEX} ON hardware_rollups (pc_id, tier, metric, bucket_start)"
+        ))
+    if removed:
+        log.warning("Removed %d duplicate hardware rollups before building %s", removed, UNIQUE_INDEX)
+    return removed
+
+
+def _upsert(db, rows: list[dict]) -> None:
+    """Write rollups, replacing buckets that were already rolled up (a re-roll recomputes them whole)."""
+    table = HardwareRollup.__table__
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        stmt = (sqlite_insert if dialect == "sqlite" else pg_insert)(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[table.c.pc_id, table.c.tier, table.c.metric, table.c.bucket_start],
+            set_={c: stmt.excluded[c] for c in ("count", "min", "avg", "max", "p95")},
+        )
+        db.execute(stmt, rows)
+        return
+    db.execute(insert(table), rows)
+
+
+def _rollup_range(db, tier_seconds: int, start: datetime, end: datetime, pc_id: int | None = None) -> int:
+    q = db.query(
+        HardwareStat.pc_id, HardwareStat.timestamp,
+        *[getattr(HardwareStat, f) for f in METRIC_FIELDS]
+    ).filter(HardwareStat.timestamp >= start, HardwareStat.timestamp < end)
+    if pc_id is not None:
+        q = q.filter(HardwareStat.pc_id == pc_id)
+    rows = q.all()
+    buckets: dict[tuple[int, datetime, str], list[float]] = defaultdict(list)
+    for row in rows:
+        bucket = floor_bucket(row[1], tier_seconds)
+        for i, field in enumerate(METRIC_FIELDS):
+            value = row[2 + i]
+            if value is not None:
+                buckets[(row[0], bucket, field)].append(value)
+    out = [
+        {
+            "pc_id": pc_id,
+            "tier": tier_seconds,
+            "metric": field,
+            "bucket_start": bucket,
+            "count": len(values),
+            "min": min(values),
+            "avg": sum(values) / len(values),
+            "max": max(values),
+            "p95": _p95(values),
+        }
+        for (pc_id, bucket, field), values in buckets.items()
+    ]
+    if out:
+        _upsert(db, out)
+    return len(out)
+
+
+def reroll_late(db) -> int:
+    """Recompute closed buckets that received samples after they were rolled up.
+
+    Agents replay buffered samples up to telemetry.MAX_SAMPLE_AGE_SEC late, past the grace
+    period. New raw rows (by id) stamped before a tier's watermark mark the buckets to redo.
+    """
+    global _raw_seen
+    top = db.query(func.max(HardwareStat.id)).scalar() or 0
+    if _raw_seen is None or top <= _raw_seen:
+        _raw_seen = top if _raw_seen is None else max(_raw_seen, top)
+        return 0
+    rerolled = 0
+    for _, seconds, _ in TIERS:
+        mark = _watermark(db, seconds)
+        if mark is None:
+            continue
+        late = db.query(
+            HardwareStat.pc_id, func.min(HardwareStat.timestamp), func.max(HardwareStat.timestamp)
+        ).filter(
+            HardwareStat.id > _raw_seen, HardwareStat.id <= top, HardwareStat.timestamp < mark,
+        ).group_by(HardwareStat.pc_id).all()
+        for pc_id, first, last in late:
+            end = min(mark, floor_bucket(last, seconds) + timedelta(seconds=seconds))
+            rerolled += _rollup_range(db, seconds, floor_bucket(first, seconds), end, pc_id)
+    db.commit()
+    _raw_seen = top
+    return rerolled
+
+
+def rollup(db, now: datetime | None = None) -> dict[str, int]:
+    """Roll closed buckets of every tier up from raw samples, chunk by chunk, then redo late ones."""
+    now = now or datetime.utcnow()
+    written = {"late": reroll_late(db)}
+    for name, seconds, _ in TIERS:
+        start = _watermark(db, seconds)
+        end = floor_bucket(now - timedelta(seconds=ROLLUP_GRACE_SEC), seconds)
+        total = 0
+        # Chunks are aligned to the tier so a bucket never straddles two chunks
+        chunk = max(ROLLUP_CHUNK, timedelta(seconds=seconds))
+        chunk = timedelta(seconds=(int(chunk.total_seconds()) // seconds) * seconds)
+        while start is not None and start < end:
+            # Skip gaps with no samples (PCs powered off overnight) in one step
+            next_raw = db.query(func.min(HardwareStat.timestamp)).filter(HardwareStat.timestamp >= start).scalar()
+            if next_raw is None:
+                break
+            start = max(start, floor_bucket(next_raw, seconds))
+            if start >= end:
+                break
+            stop = min(start + chunk, end)
+            total += _rollup_range(db, seconds, start, stop)
+            db.commit()
+            start = stop
+        written[name] = total
+    return written
+
+
+def _delete_batched(db, model, *criteria) -> int:
+    """Delete matching rows in small batches so writers are never blocked for long."""
+    deleted = 0
+    while True:
+        ids = [r[0] for r in db.query(model.id).filter(*criteria).limit(PRUNE_BATCH).all()]
+        if not ids:
+            return deleted
+        db.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+        db.commit()
+        deleted += len(ids)
+
+
+def prune(db, now: datetime | None = None) -> dict[str, int]:
+    now = now or datetime.utcnow()
+    pruned = {}
+    # Raw rows go only once every tier has rolled them up
+    raw_cutoff = now - timedelta(hours=RAW_RETENTION_HOURS)
+    for _, seconds, _ in TIERS:
+        mark = _watermark(db, seconds)
+        if mark is None:
+            break
+        raw_cutoff = min(raw_cutoff, mark)
+    pruned["raw"] = _delete_batched(db, HardwareStat, HardwareStat.timestamp < raw_cutoff)
+    for name, seconds, days in TIERS:
+        cutoff = now - timedelta(days=days)
+        pruned[name] = _delete_batched(
+            db, HardwareRollup, HardwareRollup.tier == seconds, HardwareRollup.bucket_start < cutoff
+        )
+    return pruned
+
+
+def pick_tier(start: datetime, end: datetime, max_points: int, now: datetime | None = None) -> tuple[str, int]:
+    """Finest resolution that covers [start, end) and stays within max_points buckets."""
+    now = now or datetime.utcnow()
+    span = max(1.0, (end - start).total_seconds())
+    if start >= now - timedelta(hours=RAW_RETENTION_HOURS) and span <= max_points * 10:
+        # Agents report every few seconds; a short recent window is served raw
+        return "raw", 0
+    for name, seconds, days in TIERS:
+        if start >= now - timedelta(days=days) and span / seconds <= max_points:
+            return name, seconds
+    name, seconds, _ = TIERS[-1]
+    return name, seconds
+
+
+def query_series(db, pc_id: int, start: datetime, end: datetime, max_points: int = 300, metrics: list[str] | None = None) -> dict:
+    metrics = [m for m in (metrics or METRIC_FIELDS) if m in METRIC_FIELDS]
+    tier, seconds = pick_tier(start, end, max_points)
+    points: dict[datetime, dict] = {}
+    if tier == "raw":
+        rows = db.query(HardwareStat).filter(
+            HardwareStat.pc_id == pc_id, HardwareStat.timestamp >= start, HardwareStat.timestamp < end
+        ).order_by(HardwareStat.timestamp.asc()).all()
+        for r in rows:
+            point = points.setdefault(r.timestamp, {"t": r.timestamp, "count": 1})
+            for m in metrics:
+                value = getattr(r, m)
+                if value is not None:
+                    point[m] = {"min": value, "avg": value, "max": value, "p95": value}
+    else:
+        rows = db.query(HardwareRollup).filter(
+            HardwareRollup.pc_id == pc_id,
+            HardwareRollup.tier == seconds,
+            HardwareRollup.bucket_start >= floor_bucket(start, seconds),
+            HardwareRollup.bucket_start < end,
+            HardwareRollup.metric.in_(metrics),
+        ).order_by(HardwareRollup.bucket_start.asc()).all()
+        for r in rows:
+            point = points.setdefault(r.bucket_start, {"t": r.bucket_start, "count": r.count})
+            point["count"] = max(point["count"], r.count)
+            point[r.metric] = {"min": r.min, "avg": r.avg, "max": r.max, "p95": r.p95}
+    return {"pc_id": pc_id, "tier": tier, "bucket_seconds": seconds, "points": list(points.values())}
+
+
+def _maintain_once() -> None:
+    db = SessionLocal()
+    try:
+        rollup(db)
+        prune(db)
+    finally:
+        db.close()
+
+
+async def maintenance_loop():
+    while True:
+        try:
+            await asyncio.to_thread(_maintain_once)
+        except Exception:
+            pass
+        await asyncio.sleep(ROLLUP_INTERVAL_SEC)
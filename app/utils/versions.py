@@ -0,0 +1,67 @@
+from datetime import datetime
+
+from sqlalchemy import update
+from sqlalchemy.exc import IntegrityError
+
+from app.models import VersionCounter
+
+# Bumps made by this process; lets in-process readers skip polling until something changed here
+_local_bumps = 0
+
+
+def local_bumps() -> int:
+    return _local_bumps
+
+
+def current(db, name: str) -> int:
+    return db.query(VersionCounter.value).filter(VersionCounter.name == name).scalar() or 0
+
+
+def bump(db, name: str) -> int:
+    """Increment a counter in the caller's transaction and return the new value.
+
+    The UPDATE takes the row lock, so concurrent writers get distinct, ordered
+    values and the bump commits or rolls back with the change it versions.
+    """
+    global _local_bumps
+    _local_bumps += 1
+    now = datetime.utcnow()
+    result = db.execute(
+        update(VersionCounter).where(VersionCounter.name == name)
+        .values(value=VersionCounter.value + 1, updated_at=now)
+    )
+    if result.rowcount == 0:
+        try:
+            with db.begin_nested():
+                db.add(VersionCounter(name=name, value=1, updated_at=now))
+            return 1
+        except IntegrityError:
+            # Created concurrently by another request
+            return bump(db, name)
+    return current(db, name)
+
+
+def floor_name(name: str) -> str:
+    return f"{name}:floor"
+
+
+def snapshot(db) -> dict[str, int]:
+    return {n: v or 0 for n, v in db.query(VersionCounter.name, VersionCounter.value).all()}
+
+
+def carry_over(db, live: dict[str, int]) -> None:
+    """After swapping in an older database, move every counter past both timelines.
+
+    Versions handed out before the restore must never be reused for different
+    data; `<name>:floor` records where the new timeline starts so readers can
+    tell clients holding an older version to resync from scratch.
+    """
+    restored = snapshot(db)
+    now = datetime.utcnow()
+    for name in set(live) | set(restored):
+        if name.endswith(":floor"):
+            continue
+        value = max(live.get(name, 0), restored.get(name, 0)) + 1
+        for key in (name, floor_name(name)):
+            db.merge(VersionCounter(name=key, value=value, updated_at=now))
+    db.commit()
@@ -0,0 +1,386 @@
+import asyncio
+import fnmatch
+import hashlib
+import hmac
+import json
+import math
+import os
+import random
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+
+import httpx
+from sqlalchemy import bindparam, insert, update
+from sqlalchemy import event as sa_event
+from sqlalchemy.exc import IntegrityError
+
+from app.database import SessionLocal
+from app.models import Webhook, WebhookBreaker, WebhookDelivery, WebhookEvent
+
+# Domain events; a webhook's `event` may also be "*" or a pattern such as "booking_*"
+SESSION_STARTED = "session_started"
+SESSION_STOPPED = "session_stopped"
+ORDER_CREATED = "order_created"
+WALLET_TOPUP = "wallet_topup"
+BOOKING_CREATED = "booking_created"
+BOOKING_CONFIRMED = "booking_confirmed"
+BOOKING_CANCELLED = "booking_cancelled"
+BOOKING_COMPLETED = "booking_completed"
+
+POLL_INTERVAL_SEC = float(os.getenv("WEBHOOK_POLL_SEC", "2"))
+BATCH_SIZE = int(os.getenv("WEBHOOK_BATCH_SIZE", "50"))
+CONCURRENCY = int(os.getenv("WEBHOOK_CONCURRENCY", "10"))
+TIMEOUT_SEC = float(os.getenv("WEBHOOK_TIMEOUT_SEC", "10"))
+MAX_ATTEMPTS = int(os.getenv("WEBHOOK_MAX_ATTEMPTS", "8"))
+BACKOFF_BASE_SEC = float(os.getenv("WEBHOOK_BACKOFF_BASE_SEC", "5"))
+BACKOFF_MAX_SEC = float(os.getenv("WEBHOOK_BACKOFF_MAX_SEC", "3600"))
+# Consecutive failed batches that open an endpoint's breaker, and how long it stays open at first
+BREAKER_THRESHOLD = int(os.getenv("WEBHOOK_BREAKER_THRESHOLD", "5"))
+BREAKER_COOLDOWN_SEC = float(os.getenv("WEBHOOK_BREAKER_COOLDOWN_SEC", "60"))
+RETENTION_DAYS = int(os.getenv("WEBHOOK_RETENTION_DAYS", "7"))
+# A claimed batch is handed to another worker if its sender has not reported back by then; a claim
+# of many batches adds one request timeout for every CONCURRENCY batches queued behind the semaphore
+LEASE_SEC = float(os.getenv("WEBHOOK_LEASE_SEC", str(TIMEOUT_SEC * 3)))
+SIGNATURE_HEADER = "X-Primus-Signature"
+TIMESTAMP_HEADER = "X-Primus-Timestamp"
+
+_lock = threading.Lock()
+_loop: asyncio.AbstractEventLoop | None = None
+_wakeup: asyncio.Event | None = None
+_client: httpx.AsyncClient | None = None
+_client_loop: asyncio.AbstractEventLoop | None = None
+_stats = {"events": 0, "delivered": 0, "failed_attempts": 0, "given_up": 0}
+
+
+def emit(db, event: str, data: dict) -> None:
+    """Record a domain event in the caller's transaction; it is delivered after the commit.
+
+    Costs one INSERT in a transaction the caller is committing anyway; nothing
+    is sent from the request.
+    """
+    db.add(WebhookEvent(event=event, payload=json.dumps(data, default=str), created_at=datetime.utcnow()))
+    db.info["webhook_events"] = True
+
+
+@sa_event.listens_for(SessionLocal, "after_commit")
+def _after_commit(session) -> None:
+    if session.info.pop("webhook_events", False):
+        _request_dispatch()
+
+
+@sa_event.listens_for(SessionLocal, "after_rollback")
+def _after_rollback(session) -> None:
+    session.info.pop("webhook_events", None)
+
+
+def _request_dispatch() -> None:
+    if _loop is not None and _wakeup is not None and _loop.is_running():
+        _loop.call_soon_threadsafe(_wakeup.set)
+
+
+def matches(pattern: str | None, event: str) -> bool:
+    return bool(pattern) and fnmatch.fnmatchcase(event, pattern.strip())
+
+
+def sign(secret: str, timestamp: int, body: bytes) -> str:
+    """HMAC-SHA256 over "<timestamp>.<body>"; receivers recompute it with the webhook secret."""
+    mac = hmac.new(secret.encode(), f"{timestamp}.".encode() + body, hashlib.sha256)
+    return f"sha256={mac.hexdigest()}"
+
+
+def backoff(attempts: int) -> float:
+    delay = min(BACKOFF_MAX_SEC, BACKOFF_BASE_SEC * (2 ** max(0, attempts - 1)))
+    return delay * (0.5 + random.random() / 2)
+
+
+def fan_out(db, limit: int = 500) -> int:
+    """Turn undispatched outbox events into one pending delivery per matching active webhook."""
+    events = db.query(WebhookEvent.id, WebhookEvent.event).filter(
+        WebhookEvent.dispatched_at == None  # noqa: E711
+    ).order_by(WebhookEvent.id).limit(limit).all()
+    if not events:
+        return 0
+    hooks = db.query(Webhook.id, Webhook.event).filter(Webhook.is_active == True).all()  # noqa: E712
+    now = datetime.utcnow()
+    ids = [e.id for e in events]
+    # Claim first: a concurrent worker that got here too updates fewer rows and backs off
+    claimed = db.execute(
+        update(WebhookEvent)
+        .where(WebhookEvent.id.in_(ids), WebhookEvent.dispatched_at == None)  # noqa: E711
+        .values(dispatched_at=now)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if claimed != len(ids):
+        db.rollback()
+        return 0
+    rows = [
+        {"webhook_id": h.id, "event_id": e.id, "event": e.event, "status": "pending",
+         "attempts": 0, "next_attempt_at": now, "created_at": now}
+        for e in events for h in hooks if matches(h.event, e.event)
+    ]
+    if rows:
+        db.execute(insert(WebhookDelivery), rows)
+    db.commit()
+    with _lock:
+        _stats["events"] += len(events)
+    return len(rows)
+
+
+def _open_breakers(db, now: datetime) -> set[int]:
+    return {wid for (wid,) in db.query(WebhookBreaker.webhook_id).filter(WebhookBreaker.open_until > now).all()}
+
+
+def _claim(db, limit: int = 1000) -> list[dict]:
+    """Lease due deliveries, up to BATCH_SIZE per endpoint whose breaker is closed (or half-open)."""
+    now = datetime.utcnow()
+    tripped = _open_breakers(db, now)
+    due = db.query(WebhookDelivery.id, WebhookDelivery.webhook_id, WebhookDelivery.event_id,
+                   WebhookDelivery.event, WebhookDelivery.attempts).filter(
+        WebhookDelivery.status == "pending",
+        WebhookDelivery.next_attempt_at <= now,
+        (WebhookDelivery.locked_until == None) | (WebhookDelivery.locked_until < now),  # noqa: E711
+    ).order_by(WebhookDelivery.id).limit(limit).all()
+    per_hook: dict[int, list] = {}
+    for d in due:
+        if d.webhook_id in tripped:
+            continue
+        rows = per_hook.setdefault(d.webhook_id, [])
+        if len(rows) < BATCH_SIZE:
+            rows.append(d)
+    ids = [d.id for rows in per_hook.values() for d in rows]
+    if not ids:
+        return []
+    token = uuid.uuid4().hex
+    lease = LEASE_SEC + TIMEOUT_SEC * math.ceil(len(per_hook) / CONCURRENCY)
+    claimed = db.execute(
+        update(WebhookDelivery)
+        .where(WebhookDelivery.id.in_(ids),
+               (WebhookDelivery.locked_until == None) | (WebhookDelivery.locked_until < now))  # noqa: E711
+        .values(locked_until=now + timedelta(seconds=lease), lease_token=token)
+        .execution_options(synchronize_session=False)
+    ).rowcount
+    if claimed != len(ids):
+        db.rollback()
+        return []
+    db.commit()
+    hooks = {h.id: h for h in db.query(Webhook.id, Webhook.url, Webhook.secret, Webhook.is_active)
+             .filter(Webhook.id.in_(per_hook)).all()}
+    event_ids = {d.event_id for rows in per_hook.values() for d in rows}
+    events = {e.id: e for e in db.query(WebhookEvent.id, WebhookEvent.payload, WebhookEvent.created_at)
+              .filter(WebhookEvent.id.in_(event_ids)).all()}
+    batches = []
+    for webhook_id, rows in per_hook.items():
+        hook = hooks.get(webhook_id)
+        batches.append({
+            "webhook_id": webhook_id,
+            "token": token,
+            "url": hook.url if hook else None,
+            "secret": hook.secret if hook else None,
+            "active": bool(hook and hook.is_active),
+            "deliveries": [
+                {"id": d.id, "event_id": d.event_id, "event": d.event, "attempts": d.attempts,
+                 "created_at": events[d.event_id].created_at if d.event_id in events else None,
+                 "data": json.loads(events[d.event_id].payload) if d.event_id in events else None}
+                for d in rows
+            ],
+        })
+    return batches
+
+
+def _http() -> httpx.AsyncClient:
+    global _client, _client_loop
+    loop = asyncio.get_running_loop()
+    if _client is None or _client.is_closed or _client_loop is not loop:
+        _client_loop = loop
+        _client = httpx.AsyncClient(
+            timeout=httpx.Timeout(TIMEOUT_SEC, connect=min(TIMEOUT_SEC, 3.0)),
+            limits=httpx.Limits(max_connections=CONCURRENCY * 2, max_keepalive_connections=CONCURRENCY),
+            follow_redirects=False,
+        )
+    return _client
+
+
+async def _send(batch: dict, sem: asyncio.Semaphore) -> dict:
+    """POST one batch; every delivery in it shares the outcome."""
+    result = {**batch, "ok": False, "status": None, "error": None, "duration_ms": None}
+    if not batch["active"] or not batch["url"]:
+        result["error"] = "webhook deactivated"
+        return result
+    body = json.dumps({
+        "webhook_id": batch["webhook_id"],
+        "events": [
+            {"id": d["event_id"], "delivery_id": d["id"], "event": d["event"],
+             "created_at": d["created_at"], "data": d["data"]}
+            for d in batch["deliveries"]
+        ],
+    }, default=str, separators=(",", ":")).encode()
+    ts = int(time.time())
+    headers = {"Content-Type": "application/json", TIMESTAMP_HEADER: str(ts), "User-Agent": "primus-webhooks"}
+    if batch["secret"]:
+        headers[SIGNATURE_HEADER] = sign(batch["secret"], ts, body)
+    started = time.monotonic()
+    async with sem:
+        try:
+            resp = await _http().post(batch["url"], content=body, headers=headers)
+            result["status"] = resp.status_code
+            result["ok"] = 200 <= resp.status_code < 300
+            if not result["ok"]:
+                result["error"] = f"HTTP {resp.status_code}: {resp.text[:200]}"
+        except httpx.HTTPError as e:
+            result["error"] = f"{e.__class__.__name__}: {e}"[:300]
+    result["duration_ms"] = int((time.monotonic() - started) * 1000)
+    return result
+
+
+def _trip(db, webhook_id: int, ok: bool, now: datetime) -> None:
+    """Update the endpoint's shared breaker in the caller's transaction."""
+    if ok:
+        db.query(WebhookBreaker).filter(WebhookBreaker.webhook_id == webhook_id, WebhookBreaker.failures > 0).update(
+            {WebhookBreaker.failures: 0, WebhookBreaker.trips: 0, WebhookBreaker.open_until: None},
+            synchronize_session=False,
+        )
+        return
+    # Relative update so failures recorded by other workers are not lost
+    bumped = db.query(WebhookBreaker).filter(WebhookBreaker.webhook_id == webhook_id).update(
+        {WebhookBreaker.failures: WebhookBreaker.failures + 1}, synchronize_session=False,
+    )
+    if not bumped:
+        try:
+            with db.begin_nested():
+                db.add(WebhookBreaker(webhook_id=webhook_id, failures=1, trips=0))
+        except IntegrityError:
+            # Created concurrently by another worker
+            return _trip(db, webhook_id, ok, now)
+    state = db.query(WebhookBreaker).filter(WebhookBreaker.webhook_id == webhook_id).populate_existing().one()
+    if state.failures >= BREAKER_THRESHOLD and (state.open_until is None or state.open_until <= now):
+        # Stays open longer each time the half-open probe fails
+        cooldown = min(BACKOFF_MAX_SEC, BREAKER_COOLDOWN_SEC * (2 ** (state.trips or 0)))
+        state.open_until = now + timedelta(seconds=cooldown)
+        state.trips = (state.trips or 0) + 1
+
+
+def _record(db, results: list[dict]) -> None:
+    """Store outcomes, but only for deliveries still leased under the token they were claimed with."""
+    now = datetime.utcnow()
+    done, retry = [], []
+    for r in results:
+        if r["active"]:
+            _trip(db, r["webhook_id"], r["ok"], now)
+        for d in r["deliveries"]:
+            attempts = d["attempts"] + 1
+            row = {"b_id": d["id"], "b_token": r["token"], "attempts": attempts, "locked_until": None,
+                   "lease_token": None, "response_status": r["status"], "duration_ms": r["duration_ms"]}
+            if r["ok"]:
+                done.append({**row, "status": "delivered", "delivered_at": now, "last_error": None})
+            elif attempts >= MAX_ATTEMPTS or r["error"] == "webhook deactivated":
+                done.append({**row, "status": "failed", "delivered_at": None, "last_error": r["error"]})
+            else:
+                retry.append({**row, "last_error": r["error"],
+                              "next_attempt_at": now + timedelta(seconds=backoff(attempts))})
+    for rows in (done, retry):
+        if rows:
+            t = WebhookDelivery.__table__
+            cols = [k for k in rows[0] if not k.startswith("b_")]
+            db.execute(
+                update(t).where(t.c.id == bindparam("b_id"), t.c.lease_token == bindparam("b_token"))
+                .values({c: bindparam(c) for c in cols}),
+                rows,
+            )
+    db.commit()
+    with _lock:
+        _stats["delivered"] += sum(1 for r in done if r["status"] == "delivered")
+        _stats["given_up"] += sum(1 for r in done if r["status"] == "failed")
+        _stats["failed_attempts"] += len(retry) + sum(1 for r in done if r["status"] == "failed")
+
+
+def _in_session(fn, *args):
+    db = SessionLocal()
+    try:
+        return fn(db, *args)
+    finally:
+        db.close()
+
+
+async def dispatch_once() -> int:
+    """Fan out new events and send every due batch, endpoints in parallel; returns deliveries attempted."""
+    await asyncio.to_thread(_in_session, fan_out)
+    batches = await asyncio.to_thread(_in_session, _claim)
+    if not batches:
+        return 0
+    sem = asyncio.Semaphore(CONCURRENCY)
+    results = await asyncio.gather(*(_send(b, sem) for b in batches))
+    await asyncio.to_thread(_in_session, _record, results)
+    return sum(len(b["deliveries"]) for b in batches)
+
+
+def prune(db) -> int:
+    """Drop finished deliveries and dispatched events older than the retention window."""
+    cutoff = datetime.utcnow() - timedelta(days=RETENTION_DAYS)
+    n = db.query(WebhookDelivery).filter(
+        WebhookDelivery.status != "pending", WebhookDelivery.created_at < cutoff
+    ).delete(synchronize_session=False)
+    pending = db.query(WebhookDelivery.event_id).filter(WebhookDelivery.status == "pending")
+    db.query(WebhookEvent).filter(
+        WebhookEvent.dispatched_at < cutoff, ~WebhookEvent.id.in_(pending)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return n
+
+
+def retry(db, delivery_id: int) -> WebhookDelivery | None:
+    """Re-queue one delivery now (e.g. after fixing the receiver); resets the endpoint's breaker."""
+    d = db.query(WebhookDelivery).filter_by(id=delivery_id).first()
+    if d is None:
+        return None
+    d.status = "pending"
+    d.next_attempt_at = datetime.utcnow()
+    d.locked_until = None
+    d.lease_token = None
+    db.query(WebhookBreaker).filter(WebhookBreaker.webhook_id == d.webhook_id).delete(synchronize_session=False)
+    db.commit()
+    db.refresh(d)
+    _request_dispatch()
+    return d
+
+
+def status(db) -> dict:
+    """This worker's counters and every endpoint's shared breaker."""
+    now = datetime.utcnow()
+    breakers = {
+        b.webhook_id: {"failures": b.failures, "open": bool(b.open_until and b.open_until > now),
+                       "retry_in_sec": max(0, round((b.open_until - now).total_seconds(), 1)) if b.open_until else 0}
+        for b in db.query(WebhookBreaker).filter(WebhookBreaker.failures > 0).all()
+    }
+    with _lock:
+        return {**_stats, "breakers": breakers}
+
+
+async def dispatch_loop():
+    global _loop, _wakeup
+    _loop = asyncio.get_running_loop()
+    _wakeup = asyncio.Event()
+    last_prune = 0.0
+    while True:
+        try:
+            await asyncio.wait_for(_wakeup.wait(), timeout=POLL_INTERVAL_SEC)
+        except asyncio.TimeoutError:
+            pass
+        _wakeup.clear()
+        try:
+            # Keep going while full batches come back so a backlog drains without waiting for the poll
+            while await dispatch_once() >= BATCH_SIZE:
+                pass
+            if time.monotonic() - last_prune > 3600:
+                await asyncio.to_thread(_in_session, prune)
+                last_prune = time.monotonic()
+        except Exception:
+            pass
+
+
+async def close() -> None:
+    global _client
+    if _client is not None and _client_loop is asyncio.get_running_loop():
+        await _client.aclose()
+    _client = None
@@ -18,6 +18,9 @@ async def broadcast_admin(payload: str):
                 pass
     _admin_connections[:] = living
 
+def has_admin_connections() -> bool:
+    return bool(_admin_connections)
+
 @router.websocket("/ws/admin")
 async def ws_admin(websocket: WebSocket):
     await websocket.accept()
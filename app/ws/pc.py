@@ -1,6 +1,10 @@
 from fastapi import APIRouter, WebSocket, WebSocketDisconnect
 from typing import Dict, List
 import asyncio
+import json
+from app.database import SessionLocal
+from app.models import ClientPC
+from app.utils import telemetry, manifests
 
 router = APIRouter()
 
@@ -20,6 +24,9 @@ async def notify_pc(pc_id: int, payload: str):
                 pass
     _pc_connections[pc_id] = living
 
+def connected_pc_ids() -> List[int]:
+    return [pc_id for pc_id, conns in _pc_connections.items() if conns]
+
 async def broadcast(payload: str):
     # Send to all connected PCs
     tasks = []
@@ -28,14 +35,55 @@ async def broadcast(payload: str):
     if tasks:
         await asyncio.gather(*tasks, return_exceptions=True)
 
+def _authenticate(websocket: WebSocket, pc_id: int) -> bool:
+    """A token of the user signed in on this PC or an admin (as on /api/hardware/batch),
+    or the PC's own license key and bound device id."""
+    from app.api.endpoints.auth import user_from_token
+
+    params, headers = websocket.query_params, websocket.headers
+    auth = headers.get("authorization") or ""
+    token = params.get("token") or (auth[7:] if auth.lower().startswith("bearer ") else None)
+    license_key = headers.get("x-license-key") or params.get("license_key")
+    device_id = headers.get("x-device-id") or headers.get("x-machine-id") or params.get("device_id")
+    db = SessionLocal()
+    try:
+        if token and telemetry.can_report(db, user_from_token(db, token), pc_id):
+            return True
+        if not license_key:
+            return False
+        pc = db.query(ClientPC).filter(ClientPC.id == pc_id).first()
+        if pc is None or pc.suspended or pc.license_key != license_key:
+            return False
+        return not pc.device_id or pc.device_id == device_id
+    finally:
+        db.close()
+
+async def _handle_message(pc_id: int, text: str, authenticated: bool):
+    try:
+        msg = json.loads(text)
+    except (ValueError, TypeError):
+        return
+    if not isinstance(msg, dict):
+        return
+    # Telemetry is only taken from sockets that proved who they are
+    if msg.get("type") == "hardware" and authenticated:
+        samples = msg.get("samples")
+        if isinstance(samples, dict):
+            samples = [samples]
+        if isinstance(samples, list):
+            telemetry.ingest_samples(pc_id, [s for s in samples if isinstance(s, dict)])
+
 @router.websocket("/ws/pc/{pc_id}")
 async def ws_pc(websocket: WebSocket, pc_id: int):
     await websocket.accept()
+    authenticated = await asyncio.to_thread(_authenticate, websocket, pc_id)
     _pc_connections.setdefault(pc_id, []).append(websocket)
+    manifests.forget_pushed(pc_id)
     try:
         while True:
-            # Keep the connection alive; client may send pings/keepalives
-            await websocket.receive_text()
+            # Keep the connection alive; client may send pings/keepalives or telemetry
+            text = await websocket.receive_text()
+            await _handle_message(pc_id, text, authenticated)
     except WebSocketDisconnect:
         pass
     finally:
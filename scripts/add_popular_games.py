@@ -4,7 +4,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.database import SessionLocal
 from app.models import Game
-from datetime import datetime
+from app.utils import catalog_import
 
 def add_popular_games():
     db = SessionLocal()
@@ -92,33 +92,13 @@ def add_popular_games():
     
     print(f"Adding {len(popular_games)} popular games...")
     
-    # Add popular games to database
-    for i, game_data in enumerate(popular_games):
-        # Check if game already exists
-        existing = db.query(Game).filter(Game.name == game_data["name"]).first()
-        if existing:
-            print(f"Game '{game_data['name']}' already exists, skipping...")
-            continue
-            
-        # Generate logo URL
+    # Upsert in one pass; re-running updates existing rows instead of duplicating them
+    rows = []
+    for i, game_data in enumerate(popular_games, 1):
         logo_url = f"/images/games/{game_data['name'].replace(' ', '_').replace(':', '').replace('-', '_').lower()}.jpg"
-        
-        game = Game(
-            name=game_data["name"],
-            category=game_data["category"],
-            enabled=game_data["enabled"],
-            logo_url=logo_url,
-            description=f"{game_data['name']} - Popular game",
-            last_updated=datetime.utcnow()
-        )
-        db.add(game)
-        
-        if (i + 1) % 50 == 0:
-            print(f"Added {i + 1} popular games...")
-            db.commit()
-    
-    db.commit()
-    print(f"Successfully added {len(popular_games)} popular games!")
+        rows.append((i, {**game_data, "logo_url": logo_url, "description": f"{game_data['name']} - Popular game"}, None))
+    result = catalog_import.import_rows(db, rows)
+    print(f"Created {result['created']}, updated {result['updated']}, skipped {result['skipped']} popular games")
     
     # Verify total count
     total_games = db.query(Game).count()
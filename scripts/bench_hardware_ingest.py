@@ -0,0 +1,63 @@
+import sys
+import os
+import tempfile
+import time
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Benchmark against a throwaway SQLite file unless a target DB is given explicitly
+_tmp_db = os.path.join(tempfile.mkdtemp(), "bench_ingest.db")
+os.environ["DATABASE_URL"] = os.getenv("BENCH_DATABASE_URL", f"sqlite:///{_tmp_db}")
+
+from app.database import SessionLocal, engine, Base
+from app.models import HardwareStat
+from app.utils import telemetry
+from datetime import datetime
+
+PCS = int(os.getenv("BENCH_PCS", "50"))
+SAMPLES_PER_PC = int(os.getenv("BENCH_SAMPLES", "100"))
+
+
+def _sample(i: int) -> dict:
+    return {
+        "cpu_percent": float(i % 100),
+        "ram_percent": 42.0,
+        "disk_percent": 61.5,
+        "gpu_percent": float((i * 7) % 100),
+        "temp": 55.0 + (i % 20),
+    }
+
+
+def bench_per_row() -> float:
+    """Current POST /api/hardware path: one insert + commit + refresh per sample."""
+    db = SessionLocal()
+    start = time.perf_counter()
+    try:
+        for pc_id in range(1, PCS + 1):
+            for i in range(SAMPLES_PER_PC):
+                hs = HardwareStat(pc_id=pc_id, timestamp=datetime.utcnow(), **_sample(i))
+                db.add(hs)
+                db.commit()
+                db.refresh(hs)
+    finally:
+        db.close()
+    return time.perf_counter() - start
+
+
+def bench_batched() -> float:
+    """POST /api/hardware/batch path: buffer per PC, multi-row insert on threshold."""
+    start = time.perf_counter()
+    for pc_id in range(1, PCS + 1):
+        telemetry.ingest_samples(pc_id, [_sample(i) for i in range(SAMPLES_PER_PC)])
+    telemetry.flush()
+    return time.perf_counter() - start
+
+
+if __name__ == "__main__":
+    Base.metadata.create_all(bind=engine)
+    total = PCS * SAMPLES_PER_PC
+    per_row = bench_per_row()
+    batched = bench_batched()
+    print(f"samples: {total} ({PCS} PCs x {SAMPLES_PER_PC})")
+    print(f"per-row:  {per_row:.3f}s  {total / per_row:,.0f} samples/s")
+    print(f"batched:  {batched:.3f}s  {total / batched:,.0f} samples/s")
+    print(f"speedup:  {per_row / batched:.1f}x")
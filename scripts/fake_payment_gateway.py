@@ -0,0 +1,145 @@
+"""Local stand-in for the Stripe and Razorpay endpoints the backend calls.
+
+Run it and point the backend at it to exercise checkouts without real keys:
+
+    python scripts/fake_payment_gateway.py --port 8099 --fail-first 1 --delay 0.2
+    STRIPE_API_BASE=http://127.0.0.1:8099 RAZORPAY_API_BASE=http://127.0.0.1:8099 \\
+        STRIPE_SECRET=sk_test_fake RAZORPAY_KEY_ID=rzp_fake RAZORPAY_KEY_SECRET=fake uvicorn main:app
+
+It honours Stripe's Idempotency-Key header and rejects a repeated Razorpay
+reference_id the way the real APIs do. --fail-first answers the first N
+create calls for each key with a 503 so client retries can be observed.
+GET /_stats reports how many checkouts were actually created, and
+POST /_pay/{id} marks a session or link paid as if the customer had paid.
+"""
+import argparse
+import asyncio
+import itertools
+from collections import defaultdict
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+app = FastAPI(title="Fake payment gateway")
+_opts = {"fail_first": 0, "delay": 0.0}
+_ids = itertools.count(1)
+_stripe_by_key: dict[str, dict] = {}
+_stripe_by_id: dict[str, dict] = {}
+_links_by_ref: dict[str, dict] = {}
+_links_by_id: dict[str, dict] = {}
+_failures: dict[str, int] = defaultdict(int)
+_stats = {"stripe_requests": 0, "stripe_created": 0, "razorpay_requests": 0, "razorpay_created": 0}
+
+
+async def _faulty(key: str) -> JSONResponse | None:
+    if _opts["delay"]:
+        await asyncio.sleep(_opts["delay"])
+    if _failures[key] < _opts["fail_first"]:
+        _failures[key] += 1
+        return JSONResponse({"error": {"message": "injected failure"}}, status_code=503)
+    return None
+
+
+@app.post("/v1/checkout/sessions")
+async def stripe_session(request: Request):
+    _stats["stripe_requests"] += 1
+    if not request.headers.get("authorization", "").startswith("Bearer "):
+        return JSONResponse({"error": {"message": "Invalid API Key provided"}}, status_code=401)
+    form = await request.form()
+    key = request.headers.get("idempotency-key") or f"anon-{next(_ids)}"
+    if key in _stripe_by_key:
+        return _stripe_by_key[key]
+    failed = await _faulty(key)
+    if failed is not None:
+        return failed
+    if not form.get("line_items[0][price_data][unit_amount]"):
+        return JSONResponse({"error": {"message": "Missing line_items"}}, status_code=400)
+    sid = f"cs_test_{next(_ids)}"
+    session = {
+        "id": sid,
+        "object": "checkout.session",
+        "status": "open",
+        "url": f"{request.base_url}pay/{sid}",
+        "metadata": {"user_id": form.get("metadata[user_id]")},
+    }
+    _stripe_by_key[key] = _stripe_by_id[sid] = session
+    _stats["stripe_created"] += 1
+    return session
+
+
+@app.get("/v1/checkout/sessions/{sid}")
+async def stripe_retrieve(sid: str):
+    if sid not in _stripe_by_id:
+        return JSONResponse({"error": {"message": f"No such checkout.session: {sid}"}}, status_code=404)
+    return _stripe_by_id[sid]
+
+
+@app.post("/v1/payment_links")
+async def razorpay_create(request: Request):
+    _stats["razorpay_requests"] += 1
+    if not request.headers.get("authorization", "").startswith("Basic "):
+        return JSONResponse({"error": {"description": "Authentication failed"}}, status_code=401)
+    body = await request.json()
+    ref = body.get("reference_id") or f"anon-{next(_ids)}"
+    failed = await _faulty(ref)
+    if failed is not None:
+        return failed
+    if ref in _links_by_ref:
+        return JSONResponse(
+            {"error": {"code": "BAD_REQUEST_ERROR", "description": f"reference_id {ref} already exists"}},
+            status_code=400,
+        )
+    lid = f"plink_{next(_ids)}"
+    link = {
+        "id": lid,
+        "amount": body.get("amount"),
+        "currency": body.get("currency"),
+        "reference_id": ref,
+        "status": "created",
+        "short_url": f"{request.base_url}rzp/{lid}",
+    }
+    _links_by_ref[ref] = _links_by_id[lid] = link
+    _stats["razorpay_created"] += 1
+    return link
+
+
+@app.get("/v1/payment_links")
+async def razorpay_list(reference_id: str | None = None):
+    links = [link for ref, link in _links_by_ref.items() if reference_id in (None, ref)]
+    return {"payment_links": links}
+
+
+@app.get("/v1/payment_links/{lid}")
+async def razorpay_fetch(lid: str):
+    if lid not in _links_by_id:
+        return JSONResponse({"error": {"description": "The id provided does not exist"}}, status_code=400)
+    return _links_by_id[lid]
+
+
+@app.post("/_pay/{checkout_id}")
+async def pay(checkout_id: str):
+    if checkout_id in _stripe_by_id:
+        _stripe_by_id[checkout_id]["status"] = "complete"
+        return _stripe_by_id[checkout_id]
+    if checkout_id in _links_by_id:
+        _links_by_id[checkout_id]["status"] = "paid"
+        return _links_by_id[checkout_id]
+    return JSONResponse({"error": {"message": "unknown checkout"}}, status_code=404)
+
+
+@app.get("/_stats")
+async def stats():
+    return _stats
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8099)
+    parser.add_argument("--fail-first", type=int, default=0, help="503 the first N create calls per key")
+    parser.add_argument("--delay", type=float, default=0.0, help="seconds to wait before answering creates")
+    args = parser.parse_args()
+    _opts.update(fail_first=args.fail_first, delay=args.delay)
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
@@ -4,7 +4,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from app.database import SessionLocal
 from app.models import Game
-from datetime import datetime
+from app.utils import catalog_import
 
 def generate_games():
     db = SessionLocal()
@@ -146,26 +146,17 @@ def generate_games():
     db.commit()
     
     # Create games with logos
-    for i, game_data in enumerate(games_data):
+    rows = []
+    for i, game_data in enumerate(games_data, 1):
         # Generate a simple logo URL based on the game name
         logo_url = f"/images/games/{game_data['name'].replace(' ', '_').replace('[', '').replace(']', '').replace(':', '').replace('!', '').lower()}.jpg"
-        
-        game = Game(
-            name=game_data["name"],
-            category=game_data["category"],
-            enabled=game_data["enabled"],
-            logo_url=logo_url,
-            description=f"{game_data['name']} - {'Game' if game_data['category'] == 'game' else 'Application'}",
-            last_updated=datetime.utcnow()
-        )
-        db.add(game)
-        
-        if (i + 1) % 100 == 0:
-            print(f"Created {i + 1} games...")
-            db.commit()
-    
-    db.commit()
-    print(f"Successfully created {len(games_data)} games!")
+        rows.append((i, {
+            **game_data,
+            "logo_url": logo_url,
+            "description": f"{game_data['name']} - {'Game' if game_data['category'] == 'game' else 'Application'}",
+        }, None))
+    result = catalog_import.import_rows(db, rows)
+    print(f"Successfully created {result['created']} games!")
     
     # Verify count
     total_games = db.query(Game).count()
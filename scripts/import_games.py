@@ -0,0 +1,42 @@
+import sys
+import os
+import argparse
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.database import SessionLocal
+from app.utils import catalog_import
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bulk upsert games from a JSONL or CSV file")
+    parser.add_argument("path", help="file to import, or - for stdin")
+    parser.add_argument("--format", choices=["jsonl", "csv"], help="defaults to the file extension")
+    parser.add_argument("--batch-size", type=int, default=catalog_import.BATCH_SIZE)
+    parser.add_argument("--dry-run", action="store_true", help="report counts without writing")
+    args = parser.parse_args()
+
+    try:
+        fmt = catalog_import.detect_format(None if args.path == "-" else args.path, args.format)
+    except catalog_import.ImportFormatError as exc:
+        parser.error(str(exc))
+
+    db = SessionLocal()
+    try:
+        if args.path == "-":
+            result = catalog_import.import_rows(db, catalog_import.read_rows(sys.stdin, fmt), args.batch_size, args.dry_run)
+        else:
+            with open(args.path, encoding="utf-8-sig", newline="") as fh:
+                result = catalog_import.import_rows(db, catalog_import.read_rows(fh, fmt), args.batch_size, args.dry_run)
+    finally:
+        db.close()
+
+    print(f"{'Would create' if args.dry_run else 'Created'}: {result['created']}")
+    print(f"{'Would update' if args.dry_run else 'Updated'}: {result['updated']}")
+    print(f"Skipped: {result['skipped']}")
+    for err in result["errors"]:
+        print(f"  line {err['line']}: {err['error']}")
+    print(f"Catalog version: {result['catalog_version']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+"""Point the app at a throwaway SQLite database before any test imports app.database."""
+import os
+import tempfile
+
+_tmp = tempfile.mkdtemp(prefix="primus-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(_tmp, 'live.db')}"
+os.environ["BACKUP_DIR"] = os.path.join(_tmp, "backups")
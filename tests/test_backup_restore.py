@@ -0,0 +1,82 @@
+"""Restoring a backup taken before later schema changes.
+
+Run from the repository root: python -m pytest tests
+"""
+import os
+import sqlite3
+
+from sqlalchemy import inspect
+
+from app.database import SessionLocal, engine
+from app.models import BackupEntry, ChatSummary, Game
+from app.utils import backup_engine, schema
+
+# Tables as they were created before this series added columns to them
+BASELINE_DDL = [
+    """CREATE TABLE backup_entries (
+        id INTEGER NOT NULL, backup_type VARCHAR, file_path VARCHAR, created_at DATETIME, note VARCHAR,
+        PRIMARY KEY (id))""",
+    """CREATE TABLE games (
+        id INTEGER NOT NULL, name VARCHAR, exe_path VARCHAR, logo_url VARCHAR, icon_url VARCHAR, version VARCHAR,
+        last_updated DATETIME, is_free BOOLEAN, min_age INTEGER, enabled BOOLEAN, category VARCHAR,
+        description VARCHAR, age_rating INTEGER, tags VARCHAR, website VARCHAR, pc_groups VARCHAR,
+        user_groups VARCHAR, launchers VARCHAR, never_use_parent_license BOOLEAN, image_600x900 VARCHAR,
+        image_background VARCHAR, PRIMARY KEY (id), UNIQUE (name))""",
+    """CREATE TABLE audit_logs (
+        id INTEGER NOT NULL, user_id INTEGER, action VARCHAR, detail VARCHAR, timestamp DATETIME, ip VARCHAR,
+        PRIMARY KEY (id))""",
+    """CREATE TABLE chat_messages (
+        id INTEGER NOT NULL, from_user_id INTEGER, to_user_id INTEGER, pc_id INTEGER, message VARCHAR,
+        timestamp DATETIME, read BOOLEAN, PRIMARY KEY (id))""",
+]
+
+
+def _baseline_image(path):
+    con = sqlite3.connect(path)
+    try:
+        for ddl in BASELINE_DDL:
+            con.execute(ddl)
+        con.execute("INSERT INTO backup_entries (id, backup_type, file_path, note) VALUES (1, 'manual', 'old.db', 'old')")
+        con.execute("INSERT INTO games (id, name, enabled) VALUES (1, 'Old Game', 1)")
+        con.execute("INSERT INTO audit_logs (id, user_id, action, detail, timestamp) "
+                    "VALUES (1, NULL, 'login', 'x', '2024-01-01 00:00:00')")
+        con.execute("INSERT INTO chat_messages (id, from_user_id, to_user_id, message, timestamp, read) "
+                    "VALUES (1, 2, 3, 'hi', '2024-01-01 00:00:00', 0)")
+        con.commit()
+    finally:
+        con.close()
+
+
+def _columns(table):
+    return {c["name"] for c in inspect(engine).get_columns(table)}
+
+
+def test_restore_upgrades_a_baseline_schema_backup(tmp_path):
+    schema.upgrade(engine)
+    image = str(tmp_path / "baseline.db")
+    _baseline_image(image)
+    db = SessionLocal()
+    try:
+        entry = BackupEntry(backup_type="manual", file_path=image, status="done", kind="full", note="baseline")
+        db.add(entry)
+        db.commit()
+        entry_id = entry.id
+
+        backup_engine.restore(db, entry)
+    finally:
+        db.close()
+
+    assert {name for name, _ in schema.COLUMNS["backup_entries"]} <= _columns("backup_entries")
+    assert "catalog_version" in _columns("games")
+    assert "category" in _columns("audit_logs")
+    assert "conversation_id" in _columns("chat_messages")
+    assert not os.path.exists(backup_engine.RESTORE_MARKER)
+    db = SessionLocal()
+    try:
+        assert db.query(Game.name).scalar() == "Old Game"
+        # The live catalog, including the entry that was restored, is carried over
+        restored = db.get(BackupEntry, entry_id)
+        assert restored is not None and restored.status == "done"
+        assert db.query(ChatSummary).count() == 2
+    finally:
+        db.close()
@@ -0,0 +1,175 @@
+"""Checkout creation against scripts/fake_payment_gateway.py, served in-process.
+
+Run from the repository root: python -m pytest tests
+"""
+import asyncio
+from types import SimpleNamespace
+
+import httpx
+import pytest
+
+from app import config
+from app.utils import payments
+from app.utils.cache import _InMemoryCache
+from scripts import fake_payment_gateway as gateway
+
+BASE = "http://gateway.test"
+LINES = [
+    {"product_id": 1, "name": "Coffee", "quantity": 2, "price": 3.5},
+    {"product_id": 2, "name": "Chips", "quantity": 1, "price": 1.25},
+]
+
+
+@pytest.fixture(autouse=True)
+def fake_gateway(monkeypatch):
+    for store in (gateway._stripe_by_key, gateway._stripe_by_id, gateway._links_by_ref,
+                  gateway._links_by_id, gateway._failures):
+        store.clear()
+    for name in gateway._stats:
+        gateway._stats[name] = 0
+    gateway._opts.update(fail_first=0, delay=0.0)
+
+    monkeypatch.setattr(config, "STRIPE_SECRET", "sk_test_fake")
+    monkeypatch.setattr(config, "STRIPE_API_BASE", BASE)
+    monkeypatch.setattr(config, "RAZORPAY_KEY_ID", "rzp_fake")
+    monkeypatch.setattr(config, "RAZORPAY_KEY_SECRET", "fake")
+    monkeypatch.setattr(config, "RAZORPAY_API_BASE", BASE)
+    monkeypatch.setattr(payments, "RETRY_BASE_SEC", 0.0)
+    cache = _InMemoryCache()
+    monkeypatch.setattr(payments, "get_cache", lambda: cache)
+
+    clients = []
+
+    def client():
+        # One client per event loop, like payments.client(); each test runs its own loop
+        loop = asyncio.get_running_loop()
+        for c, owner in clients:
+            if owner is loop:
+                return c
+        c = httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway.app), base_url=BASE)
+        clients.append((c, loop))
+        return c
+
+    monkeypatch.setattr(payments, "client", client)
+    yield gateway
+    payments._inflight.clear()
+
+
+def _user(user_id=7):
+    return SimpleNamespace(id=user_id, name="Test User", email="test@example.com")
+
+
+def _pay(checkout_id):
+    async def go():
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=gateway.app), base_url=BASE) as c:
+            (await c.post(f"/_pay/{checkout_id}")).raise_for_status()
+    asyncio.run(go())
+
+
+def _checkout(gw, user=None, lines=LINES):
+    return asyncio.run(payments.checkout(gw, user or _user(), lines))
+
+
+@pytest.mark.parametrize("gw", ["stripe", "razorpay"])
+def test_retries_transient_failures_and_creates_once(gw):
+    gateway._opts["fail_first"] = 2
+
+    result = _checkout(gw)
+
+    assert result["url"] and result["reused"] is False
+    assert gateway._stats[f"{gw}_requests"] == 3
+    assert gateway._stats[f"{gw}_created"] == 1
+
+
+def test_gives_up_after_max_retries():
+    gateway._opts["fail_first"] = payments.MAX_RETRIES + 1
+
+    with pytest.raises(payments.GatewayError):
+        _checkout("stripe")
+    assert gateway._stats["stripe_requests"] == payments.MAX_RETRIES + 1
+    assert gateway._stats["stripe_created"] == 0
+
+
+@pytest.mark.parametrize("gw", ["stripe", "razorpay"])
+def test_concurrent_identical_carts_share_one_checkout(gw):
+    gateway._opts["delay"] = 0.05
+
+    async def burst():
+        return await asyncio.gather(*(payments.checkout(gw, _user(), LINES) for _ in range(5)))
+
+    results = asyncio.run(burst())
+
+    assert len({r["url"] for r in results}) == 1
+    assert gateway._stats[f"{gw}_created"] == 1
+
+
+@pytest.mark.parametrize("gw", ["stripe", "razorpay"])
+def test_repeated_cart_reuses_open_checkout(gw):
+    first = _checkout(gw)
+    # Same cart in a different order is the same cart
+    second = _checkout(gw, lines=list(reversed(LINES)))
+
+    assert second == {**first, "reused": True}
+    assert gateway._stats[f"{gw}_created"] == 1
+
+
+def test_different_users_get_different_checkouts():
+    a = _checkout("stripe", _user(1))
+    b = _checkout("stripe", _user(2))
+
+    assert a["url"] != b["url"]
+    assert gateway._stats["stripe_created"] == 2
+
+
+@pytest.mark.parametrize("gw", ["stripe", "razorpay"])
+def test_paid_checkout_is_not_reused(gw):
+    first = _checkout(gw)
+    _pay(first["id"])
+
+    second = _checkout(gw)
+
+    assert second["reused"] is False
+    assert second["id"] != first["id"]
+    assert gateway._stats[f"{gw}_created"] == 2
+    # The new checkout is remembered and reused in turn
+    assert _checkout(gw) == {**second, "reused": True}
+
+
+@pytest.mark.parametrize("gw", ["stripe", "razorpay"])
+def test_unknown_status_neither_reuses_nor_replaces_the_checkout(gw):
+    first = _checkout(gw)
+    # The status lookup fails while the checkout itself still exists
+    by_id = gateway._stripe_by_id if gw == "stripe" else gateway._links_by_id
+    saved = dict(by_id)
+    by_id.clear()
+
+    with pytest.raises(payments.GatewayError):
+        _checkout(gw)
+    assert gateway._stats[f"{gw}_created"] == 1
+    # Once the gateway answers again the same checkout is handed out
+    by_id.update(saved)
+    assert _checkout(gw) == {**first, "reused": True}
+
+
+def test_stripe_idempotency_key_survives_a_lost_cache_entry():
+    first = _checkout("stripe")
+    payments.forget_checkout("stripe", 7, payments.cart_digest(7, "stripe", config.STRIPE_CURRENCY.lower(), LINES))
+
+    second = _checkout("stripe")
+
+    assert second["id"] == first["id"] and second["reused"] is False
+    assert gateway._stats["stripe_created"] == 1
+
+
+@pytest.mark.parametrize("gw", ["stripe", "razorpay"])
+def test_paid_checkout_with_lost_cache_entry_starts_a_new_one(gw):
+    first = _checkout(gw)
+    _pay(first["id"])
+    currency = config.STRIPE_CURRENCY.lower() if gw == "stripe" else config.RAZORPAY_CURRENCY.upper()
+    payments.forget_checkout(gw, 7, payments.cart_digest(7, gw, currency, LINES))
+
+    # Stripe replays the paid session for the key; Razorpay rejects the repeated reference_id
+    second = _checkout(gw)
+
+    assert second["id"] != first["id"]
+    assert gateway._stats[f"{gw}_created"] == 2